@@ -0,0 +1,325 @@
+"""
+Usage analytics over the whole message history.
+
+MessageColumns loads every message of a live conversation into compact
+columns (about 35 bytes per message, no message text) in bulk: SQLite
+concatenates each column of a range of ids into one string and the string
+is parsed in one call, instead of building a Python tuple per row. With
+NumPy installed the columns are NumPy arrays and the report is computed
+with vectorized operations; without it they are array.array and the same
+report is computed in one pure-Python pass.
+
+Exports are .npz files (one array per column) that np.load reads directly;
+they are written in the same format when NumPy is not installed.
+
+    python -m app.analytics [conversations.db] [--weeks 8] [--export messages.npz]
+"""
+import os
+import struct
+import sys
+import zipfile
+from array import array
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+
+from .database import ConversationDB
+
+try:
+    import numpy as np
+except ImportError:  # optional: everything also works with array.array
+    np = None
+
+ROLES = ("user", "assistant", "system")
+WEEKDAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+# name: (SQL expression over messages m / conversations c, array typecode)
+COLUMNS = {
+    "conversation_id": ("m.conversation_id", "I"),
+    # hours since 1970-01-01 UTC; julianday() works on SQLite versions without unixepoch()
+    "hour": ("CAST((julianday(m.timestamp) - 2440587.5) * 24 + 1e-6 AS INTEGER)", "I"),
+    "chars": ("length(m.content)", "I"),
+    "role": ("CASE m.role WHEN 'user' THEN 0 WHEN 'assistant' THEN 1 ELSE 2 END", "B"),
+    "cost": ("m.cost", "d"),
+    "prompt_tokens": ("m.prompt_tokens", "I"),
+    "completion_tokens": ("m.completion_tokens", "I"),
+    "cached_tokens": ("m.cached_tokens", "I"),
+}
+MODEL_SEPARATOR = "\x1f"
+NPY_TYPES = {"B": "|u1", "H": "<u2", "I": "<u4", "d": "<f8"}
+PERCENTILES = (50, 90, 99)
+
+
+def _week_start(week: int) -> str:
+    """Monday of a week number, (days since 1970-01-01 + 3) // 7 (that day was a Thursday)."""
+    return (datetime(1969, 12, 29, tzinfo=timezone.utc) + timedelta(weeks=week)).strftime("%Y-%m-%d")
+
+
+class MessageColumns:
+    """Per-message columns of the history, without the message text."""
+
+    def __init__(self, columns: Dict, models: List[str]):
+        self.columns = columns
+        self.models = models  # "model" holds indexes into this list
+
+    def __len__(self) -> int:
+        return len(self.columns["role"])
+
+    def __getitem__(self, name: str):
+        return self.columns[name]
+
+    @classmethod
+    def load(cls, db: ConversationDB, chunk_size: int = 500_000) -> "MessageColumns":
+        # COALESCE: group_concat skips NULLs, which would shift the columns against each other
+        select = ", ".join(f"group_concat(COALESCE({sql}, 0))" for sql, _ in COLUMNS.values())
+        select += f", group_concat(COALESCE(m.model, c.model), char({ord(MODEL_SEPARATOR)})), COUNT(*)"
+
+        parts = {name: [] for name in COLUMNS}
+        parts["model"] = []
+        codes: Dict[str, int] = {}
+        for row in db.scan_messages(select, chunk_size):
+            if not row[-1]:
+                continue
+            for (name, (_, typecode)), text in zip(COLUMNS.items(), row):
+                parts[name].append(_parse(text, typecode))
+            names = row[-2].split(MODEL_SEPARATOR)
+            for name in sorted(set(names).difference(codes)):
+                codes[name] = len(codes)
+            parts["model"].append(array("H", map(codes.__getitem__, names)))
+
+        typecodes = dict((name, typecode) for name, (_, typecode) in COLUMNS.items())
+        typecodes["model"] = "H"
+        columns = {name: _concat(chunks, typecodes[name]) for name, chunks in parts.items()}
+        return cls(columns, sorted(codes, key=codes.get))
+
+    def summarize(self, weeks: int = 8) -> Dict:
+        """Totals, cost per model per week, message-length percentiles and histograms, busiest hours."""
+        if np is not None:
+            report = self._summarize_numpy(weeks)
+        else:
+            report = self._summarize_python(weeks)
+        report["weekly"].sort(key=lambda row: (row["week"], row["model"]))
+        report["backend"] = "numpy" if np is not None else "python"
+        return report
+
+    def _summarize_numpy(self, weeks: int) -> Dict:
+        c = {name: np.asarray(column) for name, column in self.columns.items()}
+        count = len(self)
+        report = self._totals(
+            count, np.unique(c["conversation_id"]).size if count else 0, float(c["cost"].sum()),
+            *(int(c[name].sum(dtype=np.int64)) for name in ("prompt_tokens", "completion_tokens", "cached_tokens"))
+        )
+
+        days = c["hour"] // 24
+        week = (days + 3) // 7
+        recent = week > (int(week.max()) - weeks) if count else week.astype(bool)
+        n_models = max(len(self.models), 1)
+        first_week = int(week[recent].min()) if recent.any() else 0
+        key = (week[recent] - first_week) * n_models + c["model"][recent]
+        size = (weeks + 1) * n_models
+
+        def per_key(values=None, mask=None):
+            selected = key if mask is None else key[mask]
+            weights = None if values is None else (values[recent] if mask is None else values[recent][mask])
+            return np.bincount(selected, weights=weights, minlength=size)
+
+        replies = c["role"][recent] == 1
+        grouped = {
+            "replies": per_key(mask=replies),
+            "cost": per_key(c["cost"]),
+            "prompt_tokens": per_key(c["prompt_tokens"]),
+            "completion_tokens": per_key(c["completion_tokens"]),
+        }
+        report["weekly"] = [
+            self._week_row(first_week + index // n_models, index % n_models,
+                           {name: values[index] for name, values in grouped.items()})
+            for index in np.flatnonzero(grouped["replies"] + (grouped["cost"] > 0))
+        ]
+
+        buckets = np.zeros(count, dtype=np.int64)
+        nonzero = c["chars"] > 0
+        buckets[nonzero] = np.floor(np.log2(c["chars"][nonzero])).astype(np.int64) + 1
+        report["lengths"] = {}
+        for code, role in enumerate(ROLES):
+            mask = c["role"] == code
+            if not mask.any():
+                continue
+            chars = c["chars"][mask]
+            report["lengths"][role] = self._length_row(
+                int(mask.sum()), [float(value) for value in np.percentile(chars, PERCENTILES)],
+                int(chars.max()), float(chars.mean()), np.bincount(buckets[mask]).tolist()
+            )
+
+        report["hours"] = np.bincount(c["hour"] % 24, minlength=24).tolist() if count else [0] * 24
+        report["weekdays"] = np.bincount((days + 3) % 7, minlength=7).tolist() if count else [0] * 7
+        return report
+
+    def _summarize_python(self, weeks: int) -> Dict:
+        c = self.columns
+        count = len(self)
+        report = self._totals(
+            count, len(set(c["conversation_id"])), sum(c["cost"]),
+            *(sum(c[name]) for name in ("prompt_tokens", "completion_tokens", "cached_tokens"))
+        )
+
+        last_week = (max(c["hour"]) // 24 + 3) // 7 if count else 0
+        grouped: Dict[tuple, Dict[str, float]] = {}
+        chars_by_role: Dict[int, List[int]] = {}
+        hours = [0] * 24
+        weekdays = [0] * 7
+        for hour, model, role, chars, cost, prompt, completion in zip(
+            c["hour"], c["model"], c["role"], c["chars"], c["cost"], c["prompt_tokens"], c["completion_tokens"]
+        ):
+            days = hour // 24
+            hours[hour % 24] += 1
+            weekdays[(days + 3) % 7] += 1
+            chars_by_role.setdefault(role, []).append(chars)
+            week = (days + 3) // 7
+            if week > last_week - weeks:
+                group = grouped.setdefault((week, model), {
+                    "replies": 0, "cost": 0.0, "prompt_tokens": 0, "completion_tokens": 0
+                })
+                group["replies"] += role == 1
+                group["cost"] += cost
+                group["prompt_tokens"] += prompt
+                group["completion_tokens"] += completion
+        report["weekly"] = [self._week_row(week, model, group)
+                            for (week, model), group in sorted(grouped.items())
+                            if group["replies"] or group["cost"] > 0]
+
+        report["lengths"] = {}
+        for code, role in enumerate(ROLES):
+            values = sorted(chars_by_role.get(code, ()))
+            if not values:
+                continue
+            histogram = [0] * (values[-1].bit_length() + 1)
+            for value in values:
+                histogram[value.bit_length()] += 1
+            report["lengths"][role] = self._length_row(
+                len(values), [_percentile(values, q) for q in PERCENTILES],
+                values[-1], sum(values) / len(values), histogram
+            )
+
+        report["hours"] = hours
+        report["weekdays"] = weekdays
+        return report
+
+    @staticmethod
+    def _totals(messages: int, conversations: int, cost: float, prompt_tokens: int,
+                completion_tokens: int, cached_tokens: int) -> Dict:
+        return {
+            "messages": messages,
+            "conversations": conversations,
+            "cost": round(cost, 6),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "cached_tokens": cached_tokens,
+        }
+
+    def _week_row(self, week: int, model: int, group: Dict) -> Dict:
+        return {
+            "week": _week_start(int(week)),
+            "model": self.models[int(model)] if self.models else "",
+            "replies": int(group["replies"]),
+            "cost": round(float(group["cost"]), 6),
+            "prompt_tokens": int(group["prompt_tokens"]),
+            "completion_tokens": int(group["completion_tokens"]),
+        }
+
+    @staticmethod
+    def _length_row(count: int, percentiles: List[float], longest: int, mean: float,
+                    histogram: List[int]) -> Dict:
+        """histogram[i] counts messages of 2**(i-1) to 2**i - 1 characters (histogram[0]: empty)."""
+        row = {"count": count, "mean": round(mean, 1), "max": longest, "histogram": histogram}
+        row.update({f"p{q}": round(value, 1) for q, value in zip(PERCENTILES, percentiles)})
+        return row
+
+    def export(self, path: str) -> str:
+        """Write the columns (plus the model and role names) as an .npz file."""
+        if not path.endswith(".npz"):
+            path += ".npz"
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if np is not None:
+            np.savez_compressed(path, **{name: np.asarray(column) for name, column in self.columns.items()},
+                                models=np.array(self.models, dtype=str), roles=np.array(ROLES))
+            return path
+
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+            for name, column in self.columns.items():
+                archive.writestr(f"{name}.npy", _npy(column))
+            archive.writestr("models.npy", _npy_strings(self.models))
+            archive.writestr("roles.npy", _npy_strings(ROLES))
+        return path
+
+
+def _parse(text: str, typecode: str):
+    """One group_concat string -> one array, parsed in a single call."""
+    if np is not None:
+        dtype = np.float64 if typecode == "d" else np.int64
+        return np.fromstring(text, dtype=dtype, sep=",").astype(NPY_TYPES[typecode])
+    convert = float if typecode == "d" else int
+    return array(typecode, map(convert, text.split(",")))
+
+
+def _concat(chunks: List, typecode: str):
+    if np is not None:
+        dtype = NPY_TYPES[typecode]
+        return np.concatenate([np.asarray(chunk, dtype=dtype) for chunk in chunks]) if chunks \
+            else np.zeros(0, dtype=dtype)
+    joined = array(typecode)
+    for chunk in chunks:
+        joined.extend(chunk)
+    return joined
+
+
+def _percentile(values: List[int], q: float) -> float:
+    """Linear interpolation between closest ranks, like numpy.percentile's default."""
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def _npy_header(descr: str, length: int) -> bytes:
+    header = f"{{'descr': '{descr}', 'fortran_order': False, 'shape': ({length},), }}"
+    header += " " * (-(len(header) + 11) % 64) + "\n"
+    return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode("latin1")
+
+
+def _npy(column: array) -> bytes:
+    if sys.byteorder == "big":
+        column = array(column.typecode, column)
+        column.byteswap()
+    return _npy_header(NPY_TYPES[column.typecode], len(column)) + column.tobytes()
+
+
+def _npy_strings(values) -> bytes:
+    width = max((len(value) for value in values), default=1) or 1
+    data = b"".join(value.ljust(width, "\0").encode("utf-32-le") for value in values)
+    return _npy_header(f"<U{width}", len(values)) + data
+
+
+def default_export_path() -> str:
+    return os.path.join("analytics", f"messages-{datetime.now().strftime('%Y%m%d-%H%M%S')}.npz")
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    import time
+
+    parser = argparse.ArgumentParser(description="Usage analytics over the chat history")
+    parser.add_argument("db_path", nargs="?", default="conversations.db")
+    parser.add_argument("--weeks", type=int, default=8)
+    parser.add_argument("--export", help="Write the message columns to this .npz file")
+    args = parser.parse_args()
+
+    from .database import create_conversation_db
+
+    start = time.perf_counter()
+    columns = MessageColumns.load(create_conversation_db(args.db_path))
+    loaded = time.perf_counter() - start
+    print(json.dumps(columns.summarize(args.weeks), indent=2))
+    print(f"📈 Loaded {len(columns)} messages in {loaded:.2f}s", file=sys.stderr)
+    if args.export:
+        print(f"💾 Exported to {columns.export(args.export)}", file=sys.stderr)
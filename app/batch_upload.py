@@ -0,0 +1,408 @@
+import ast
+import glob
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .chatbot import (
+    ask_within_budget, load_system_prompt, get_current_model,
+    create_conversation, save_message_to_db, get_upload_settings
+)
+from .database import conversation_db
+from .file_analysis import (
+    CHARS_PER_TOKEN, MAX_WORKERS, REQUESTS_PER_MINUTE, RateLimiter,
+    content_hash, gather_results, ingest_upload, is_usable_reply, reduce_partials, review_file
+)
+from .ingest import IngestError
+
+SUPPORTED_EXTENSIONS = (".py", ".txt")
+BATCH_TOKENS = 12000
+BATCH_CHARS = BATCH_TOKENS * CHARS_PER_TOKEN
+ALWAYS_IGNORED = {".git", "__pycache__", ".venv", "venv", "node_modules"}
+
+BATCH_PROMPT = (
+    "Here are {count} files from '{name}' (batch {index} of {total}), ordered so that "
+    "modules come before the files that import them.\n\n{files}\n\n"
+    "Review each file: summarize its purpose, list bugs and risky code, and suggest "
+    "concrete improvements. Mention problems that span several files."
+)
+
+
+def is_glob_pattern(target: str) -> bool:
+    return any(char in target for char in "*?[")
+
+
+def _gitignore_regex(pattern: str) -> Tuple[re.Pattern, bool]:
+    """Translate one .gitignore pattern into a regex over '/'-separated relative paths."""
+    dir_only = pattern.endswith("/")
+    pattern = pattern.rstrip("/")
+    anchored = "/" in pattern
+    pattern = pattern.lstrip("/")
+
+    regex = ""
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            regex += "(?:.*/)?"
+            i += 3
+        elif pattern.startswith("/**", i) and i + 3 == len(pattern):
+            regex += "/.*"
+            i += 3
+        elif pattern[i] == "*":
+            regex += "[^/]*"
+            i += 1
+        elif pattern[i] == "?":
+            regex += "[^/]"
+            i += 1
+        elif pattern[i] == "[":
+            end = pattern.find("]", i)
+            if end == -1:
+                regex += re.escape(pattern[i])
+                i += 1
+            else:
+                regex += pattern[i:end + 1].replace("[!", "[^")
+                i = end + 1
+        else:
+            regex += re.escape(pattern[i])
+            i += 1
+
+    prefix = "^" if anchored else "^(?:.*/)?"
+    return re.compile(prefix + regex + "$"), dir_only
+
+
+class GitIgnore:
+    """Minimal .gitignore matcher: comments, negation, anchors, dir-only and ** patterns."""
+
+    def __init__(self):
+        self.rules: List[Tuple[str, re.Pattern, bool, bool]] = []
+
+    def add_file(self, path: str, base: str):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                lines = f.read().splitlines()
+        except OSError:
+            return
+        for line in lines:
+            line = line.rstrip()
+            if not line or line.startswith("#"):
+                continue
+            negate = line.startswith("!")
+            if negate:
+                line = line[1:]
+            regex, dir_only = _gitignore_regex(line)
+            self.rules.append((base, regex, dir_only, negate))
+
+    def is_ignored(self, rel_path: str, is_dir: bool) -> bool:
+        if os.path.basename(rel_path) in ALWAYS_IGNORED:
+            return True
+        ignored = False
+        for base, regex, dir_only, negate in self.rules:
+            if base:
+                if not rel_path.startswith(base + "/"):
+                    continue
+                candidate = rel_path[len(base) + 1:]
+            else:
+                candidate = rel_path
+            if dir_only and not is_dir:
+                continue
+            if regex.match(candidate):
+                ignored = not negate
+        return ignored
+
+
+def collect_files(target: str) -> Tuple[str, List[str]]:
+    """
+    Resolve a directory or glob pattern into supported files, skipping anything
+    matched by .gitignore. Returns the root directory and paths relative to it.
+    """
+    if os.path.isdir(target):
+        root = os.path.abspath(target)
+        ignore = GitIgnore()
+        files = []
+        for dirpath, dirnames, filenames in os.walk(root):
+            rel_dir = os.path.relpath(dirpath, root).replace(os.sep, "/")
+            rel_dir = "" if rel_dir == "." else rel_dir
+            ignore.add_file(os.path.join(dirpath, ".gitignore"), rel_dir)
+            dirnames[:] = sorted(
+                d for d in dirnames
+                if not ignore.is_ignored(f"{rel_dir}/{d}".lstrip("/"), True)
+            )
+            for filename in sorted(filenames):
+                rel_path = f"{rel_dir}/{filename}".lstrip("/")
+                if filename.lower().endswith(SUPPORTED_EXTENSIONS) and not ignore.is_ignored(rel_path, False):
+                    files.append(rel_path)
+        return root, files
+
+    matches = [path for path in glob.glob(target, recursive=True) if os.path.isfile(path)]
+    root = os.path.abspath(os.getcwd())
+    ignore = GitIgnore()
+    loaded = set()
+    files = []
+    for path in sorted(matches):
+        rel_path = os.path.relpath(os.path.abspath(path), root).replace(os.sep, "/")
+        if not rel_path.lower().endswith(SUPPORTED_EXTENSIONS):
+            continue
+        if rel_path.startswith("../"):
+            files.append(rel_path)
+            continue
+        parts = rel_path.split("/")
+        hidden = False
+        for depth in range(len(parts)):
+            rel_dir = "/".join(parts[:depth])
+            if rel_dir and ignore.is_ignored(rel_dir, True):
+                hidden = True
+                break
+            if rel_dir not in loaded:
+                loaded.add(rel_dir)
+                ignore.add_file(os.path.join(root, rel_dir, ".gitignore"), rel_dir)
+        if not hidden and not ignore.is_ignored(rel_path, False):
+            files.append(rel_path)
+    return root, files
+
+
+def read_files(root: str, rel_paths: List[str], max_workers: int = 8,
+               progress: Callable[[str], None] = print) -> Dict[str, str]:
+    """
+    Read files in parallel through the ingestion stage. Unreadable, binary,
+    oversized and generated files are reported and skipped.
+    """
+    contents = {}
+    omitted_lines = 0
+    omitted_chars = 0
+
+    def read(rel_path: str) -> Dict:
+        return ingest_upload(os.path.join(root, rel_path))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(read, rel_path): rel_path for rel_path in rel_paths}
+        for future in as_completed(futures):
+            rel_path = futures[future]
+            try:
+                upload = future.result()
+            except (OSError, IngestError) as e:
+                progress(f"⚠️  Skipping '{rel_path}': {e}")
+                continue
+            if upload["generated"]:
+                progress(f"⚠️  Skipping '{rel_path}': marked as generated code")
+                continue
+            contents[rel_path] = upload["text"]
+            omitted_lines += upload["omitted_lines"]
+            omitted_chars += upload["omitted_chars"]
+    if omitted_lines or omitted_chars:
+        progress(f"🧹 Compressed {omitted_lines:,} repeated lines and {omitted_chars:,} characters of generated data")
+    return contents
+
+
+def _module_name(rel_path: str) -> str:
+    parts = rel_path[:-3].split("/")
+    if parts[-1] == "__init__":
+        parts = parts[:-1]
+    return ".".join(parts)
+
+
+def _imported_modules(rel_path: str, source: str) -> List[str]:
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        return []
+    package = _module_name(rel_path).split(".")
+    if not rel_path.endswith("__init__.py"):
+        package = package[:-1]
+
+    modules = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            modules.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            if node.level:
+                base = package[:len(package) - node.level + 1] if node.level > 1 else package
+                prefix = ".".join(base)
+                module = f"{prefix}.{node.module}" if node.module and prefix else (node.module or prefix)
+            else:
+                module = node.module or ""
+            modules.append(module)
+            modules.extend(f"{module}.{alias.name}" for alias in node.names)
+    return modules
+
+
+def order_by_imports(contents: Dict[str, str]) -> List[str]:
+    """Topologically sort files so imported modules come before their importers."""
+    paths = sorted(contents)
+    modules = {_module_name(path): path for path in paths if path.endswith(".py")}
+
+    dependencies = {path: set() for path in paths}
+    for path in paths:
+        if not path.endswith(".py"):
+            continue
+        for module in _imported_modules(path, contents[path]):
+            # "pkg.mod.name" may refer to pkg/mod.py; walk up until a known module matches
+            parts = module.split(".")
+            while parts:
+                target = modules.get(".".join(parts))
+                if target:
+                    if target != path:
+                        dependencies[path].add(target)
+                    break
+                parts.pop()
+
+    ordered = []
+    done = set()
+    visiting = set()
+
+    def visit(path: str):
+        if path in done or path in visiting:
+            return
+        visiting.add(path)
+        for dependency in sorted(dependencies[path]):
+            visit(dependency)
+        visiting.discard(path)
+        done.add(path)
+        ordered.append(path)
+
+    for path in paths:
+        visit(path)
+    return ordered
+
+
+def pack_files(ordered: List[str], contents: Dict[str, str],
+               budget_chars: int = BATCH_CHARS) -> Tuple[List[List[str]], List[str]]:
+    """
+    Pack files into batches under the character budget in dependency order: a
+    batch is filled until the next file does not fit, so a module is never in a
+    later batch than the files that import it. Files too large for any batch are
+    returned separately to go through the chunked single-file pipeline.
+    """
+    batches: List[List[str]] = []
+    used = 0
+    oversized = []
+    for path in ordered:
+        size = len(contents[path]) + len(path) + 20
+        if size > budget_chars:
+            oversized.append(path)
+            continue
+        if not batches or used + size > budget_chars:
+            batches.append([])
+            used = 0
+        batches[-1].append(path)
+        used += size
+    return batches, oversized
+
+
+def _format_file(path: str, content: str) -> str:
+    fence = "python" if path.endswith(".py") else "text"
+    return f"### {path}\n```{fence}\n{content}\n```"
+
+
+def analyze_batches(batches: List[List[str]], contents: Dict[str, str], name: str,
+                    model: Optional[str] = None, max_workers: int = MAX_WORKERS,
+                    requests_per_minute: int = REQUESTS_PER_MINUTE,
+                    progress: Callable[[str], None] = print, usage_log: Optional[List[Dict]] = None) -> Dict:
+    """
+    Send each batch as one request, concurrently within the rate limit.
+    Each reply is cached under the model that actually answered it.
+    """
+    system_prompt = load_system_prompt()
+    model_id = model or get_current_model()['id']
+    limiter = RateLimiter(requests_per_minute)
+    lock = threading.Lock()
+    state = {"done": 0, "cost": 0.0}
+    results = [None] * len(batches)
+
+    prompts = [
+        BATCH_PROMPT.format(
+            count=len(batch), name=name, index=i + 1, total=len(batches),
+            files="\n\n".join(_format_file(path, contents[path]) for path in batch)
+        )
+        for i, batch in enumerate(batches)
+    ]
+    # keyed on the system prompt too, so a batch reviewed under another persona is sent again
+    hashes = [content_hash(f"{system_prompt}\0{prompt}") for prompt in prompts]
+    cached = conversation_db.get_chunk_analyses(hashes, model_id)
+
+    def analyze(index: int) -> str:
+        if hashes[index] in cached:
+            reply, cost = cached[hashes[index]], 0.0
+        else:
+            messages = [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompts[index]}
+            ]
+            limiter.wait()
+            result = ask_within_budget(messages, model, usage_log=usage_log)
+            reply, cost = result["reply"], result["usage"]["cost"]
+            if is_usable_reply(reply):
+                conversation_db.save_chunk_analysis(hashes[index], result["model"], reply)
+        with lock:
+            state["done"] += 1
+            state["cost"] += cost
+            source = "cached" if hashes[index] in cached else "analyzed"
+            progress(f"📦 Batch {state['done']}/{len(batches)} {source} "
+                     f"({len(batches[index])} files) | 💰 ${state['cost']:.6f} so far")
+        return reply
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(analyze, i): i for i in range(len(batches))}
+        gather_results(futures, results)
+
+    return {"partials": results, "cost": state["cost"]}
+
+
+def upload_many(target: str, model: Optional[str] = None,
+                budget_chars: int = BATCH_CHARS,
+                progress: Callable[[str], None] = print) -> Optional[Dict]:
+    """
+    Review every supported file in a directory or glob as one report.
+    The report is stored as a new conversation, carrying the real cost of
+    every request made for it; returns its id and text.
+    """
+    root, rel_paths = collect_files(target)
+    if not rel_paths:
+        progress(f"❌ No .py or .txt files found for '{target}'")
+        return None
+
+    contents = read_files(root, rel_paths, progress=progress)
+    if not contents:
+        progress(f"❌ None of the files for '{target}' could be read")
+        return None
+    max_tokens = get_upload_settings().get("max_tokens", 0)
+    tokens = sum(len(content) for content in contents.values()) // CHARS_PER_TOKEN
+    if max_tokens and tokens > max_tokens:
+        progress(f"❌ These files add up to ~{tokens:,} tokens, over the {max_tokens:,}-token upload limit; "
+                 "nothing was sent")
+        return None
+    ordered = order_by_imports(contents)
+    batches, oversized = pack_files(ordered, contents, budget_chars)
+    name = os.path.basename(root.rstrip(os.sep)) if os.path.isdir(target) else target
+    total_chars = sum(len(content) for content in contents.values())
+    progress(f"📂 {len(ordered)} files (~{total_chars // CHARS_PER_TOKEN:,} tokens) packed into "
+             f"{len(batches)} requests" + (f", {len(oversized)} large files reviewed separately" if oversized else ""))
+
+    partials = []
+    titles = []
+    usage_log = []
+    if batches:
+        mapped = analyze_batches(batches, contents, name, model, progress=progress, usage_log=usage_log)
+        partials.extend(mapped["partials"])
+        titles.extend(f"Batch {i + 1}: {', '.join(batch)}" for i, batch in enumerate(batches))
+    for path in oversized:
+        progress(f"\n📚 Reviewing large file '{path}' on its own...")
+        # not streamed: only the combined report below is shown as it arrives
+        partials.append(review_file(os.path.join(root, path), contents[path], model, progress,
+                                    stream=False, usage_log=usage_log))
+        titles.append(f"File: {path}")
+
+    progress("🧩 Combining results into one report...\n")
+    reduced = reduce_partials(partials, titles, name, "batch", model, budget_chars, progress, usage_log=usage_log)
+    cost = sum(usage["cost"] for usage in usage_log)
+    progress(f"💰 Total cost: ${cost:.6f} ({len(usage_log)} requests)")
+
+    report = reduced["reply"]
+    conversation_id = create_conversation(f"Upload review: {name}")
+    save_message_to_db(conversation_id, "system", load_system_prompt())
+    save_message_to_db(conversation_id, "user", f"Review these files from '{name}':\n" + "\n".join(ordered))
+    save_message_to_db(conversation_id, "assistant", report, cost=cost)
+    # the report message now carries these costs, so the daily limits must not count them twice
+    conversation_db.assign_request_usage([usage["id"] for usage in usage_log], conversation_id)
+    return {"conversation_id": conversation_id, "report": report}
@@ -0,0 +1,218 @@
+"""
+Cost estimation calibrated on real usage, and budget admission control.
+
+CostEstimator starts from the usual guesses (4 characters per token, half
+of max_tokens for the reply) and switches to per-model averages of the
+usage the API actually reported once a model has a few requests recorded.
+
+Budget checks a request against the configured limits (USD):
+    "budget": {"session": 0.50, "daily": 2.00, "models": {"gpt-4o": 1.00}, "policy": ["downgrade", "trim"]}
+"session" is per ChatSession, "daily" and "models" are per UTC day. When a
+request would exceed a limit the policy steps are tried in order:
+"downgrade" switches to the most capable cheaper model that fits and
+"trim" drops the oldest turns until the prompt fits. If nothing fits
+(or the policy is "reject") the request is refused before it is sent.
+"""
+import math
+import threading
+from typing import Callable, Dict, List, Optional
+
+from .database import ConversationDB
+from .messages import CHARS_PER_TOKEN, History, MessageLike, as_message, total_chars
+
+MIN_SAMPLES = 3
+POLICY_STEPS = ("reject", "downgrade", "trim")
+
+
+class BudgetExceededError(Exception):
+    pass
+
+
+def usage_cost(prices: Dict[str, float], prompt_tokens: int, completion_tokens: int,
+               cached_tokens: int = 0) -> float:
+    """Cost of reported usage; cached prompt tokens are billed at the model's cached_input price."""
+    cached_price = prices.get("cached_input", prices["input"])
+    input_cost = (prompt_tokens - cached_tokens) / 1000 * prices["input"] + cached_tokens / 1000 * cached_price
+    return round(input_cost + completion_tokens / 1000 * prices["output"], 6)
+
+
+class CostEstimator:
+    """Per-model token estimates, calibrated from the model_usage table."""
+
+    def __init__(self, db: ConversationDB):
+        self.db = db
+        self._usage: Optional[Dict[str, Dict]] = None
+        self._lock = threading.Lock()
+
+    def _calibration(self, model: str) -> Optional[Dict]:
+        with self._lock:
+            if self._usage is None:
+                self._usage = self.db.get_usage_calibration()
+            usage = self._usage.get(model)
+        if not usage or usage["requests"] < MIN_SAMPLES or not usage["prompt_chars"]:
+            return None
+        return usage
+
+    def tokens_per_char(self, model: str) -> float:
+        usage = self._calibration(model)
+        if usage:
+            return usage["prompt_tokens"] / usage["prompt_chars"]
+        return 1 / CHARS_PER_TOKEN
+
+    def completion_tokens(self, model: str, max_tokens: int) -> float:
+        usage = self._calibration(model)
+        if usage:
+            return min(max_tokens, usage["completion_tokens"] / usage["requests"])
+        return max_tokens / 2
+
+    def estimate(self, model: str, prices: Dict[str, float], input_chars: int,
+                 max_tokens: int) -> Dict[str, float]:
+        input_tokens = input_chars * self.tokens_per_char(model)
+        output_tokens = self.completion_tokens(model, max_tokens)
+        input_cost = input_tokens / 1000 * prices["input"]
+        output_cost = output_tokens / 1000 * prices["output"]
+        return {
+            "input": round(input_cost, 6),
+            "output": round(output_cost, 6),
+            "total": round(input_cost + output_cost, 6),
+            "input_tokens": math.ceil(input_tokens),
+            "output_tokens": math.ceil(output_tokens),
+            "calibrated": self._calibration(model) is not None
+        }
+
+    def affordable_chars(self, model: str, prices: Dict[str, float], budget: float,
+                         max_tokens: int) -> int:
+        """Largest prompt (in characters) whose estimated cost stays within budget."""
+        output_cost = self.completion_tokens(model, max_tokens) / 1000 * prices["output"]
+        cost_per_char = self.tokens_per_char(model) / 1000 * prices["input"]
+        if budget <= output_cost or cost_per_char <= 0:
+            return 0
+        return int((budget - output_cost) / cost_per_char)
+
+    def observe(self, model: str, prompt_chars: int, prompt_tokens: int, completion_tokens: int):
+        self.db.record_usage(model, prompt_chars, prompt_tokens, completion_tokens)
+        with self._lock:
+            if self._usage is None:
+                return
+            usage = self._usage.setdefault(model, {
+                "model": model, "requests": 0, "prompt_chars": 0, "prompt_tokens": 0, "completion_tokens": 0
+            })
+            usage["requests"] += 1
+            usage["prompt_chars"] += prompt_chars
+            usage["prompt_tokens"] += prompt_tokens
+            usage["completion_tokens"] += completion_tokens
+
+
+_estimators: Dict[int, CostEstimator] = {}
+_estimators_lock = threading.Lock()
+
+
+def get_estimator(db: ConversationDB) -> CostEstimator:
+    """One shared estimator per database."""
+    with _estimators_lock:
+        estimator = _estimators.get(id(db))
+        if estimator is None or estimator.db is not db:
+            estimator = _estimators[id(db)] = CostEstimator(db)
+        return estimator
+
+
+def policy_steps(policy) -> List[str]:
+    steps = [policy] if isinstance(policy, str) else list(policy or [])
+    for step in steps:
+        if step not in POLICY_STEPS:
+            raise ValueError(f"Unknown budget policy {step!r}; use {', '.join(POLICY_STEPS)}")
+    return steps
+
+
+class Budget:
+    """Remaining budget for one request, with spend read once from the database."""
+
+    def __init__(self, limits: Dict, db: ConversationDB, session_spent: float):
+        self.limits = limits
+        self.db = db
+        self.session_spent = session_spent
+        self._daily: Optional[float] = None
+        self._model_daily: Dict[str, float] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.limits.get("session") or self.limits.get("daily") or self.limits.get("models"))
+
+    def remaining(self, model: str) -> Dict[str, float]:
+        """Remaining USD per limit that applies to this model."""
+        remaining = {}
+        if self.limits.get("session"):
+            remaining["session"] = self.limits["session"] - self.session_spent
+        if self.limits.get("daily"):
+            if self._daily is None:
+                self._daily = self.db.get_daily_spend()
+            remaining["daily"] = self.limits["daily"] - self._daily
+        model_limit = (self.limits.get("models") or {}).get(model)
+        if model_limit:
+            if model not in self._model_daily:
+                self._model_daily[model] = self.db.get_daily_spend(model)
+            remaining[f"{model} daily"] = model_limit - self._model_daily[model]
+        return remaining
+
+    def violation(self, model: str, cost: float) -> Optional[str]:
+        """Description of the first limit this cost would exceed, or None if it fits."""
+        for name, left in self.remaining(model).items():
+            if cost > left:
+                return f"{name} budget (${max(left, 0):.4f} left, request ~${cost:.4f})"
+        return None
+
+    def headroom(self, model: str) -> float:
+        return min(self.remaining(model).values(), default=math.inf)
+
+
+def trim_messages(messages: List[MessageLike], max_chars: int) -> Optional[History]:
+    """
+    Drop the oldest non-system messages until the prompt fits in max_chars.
+    System messages (the prompt and any persona switches) and the latest
+    message are always kept; returns None if even that does not fit.
+    """
+    history = [as_message(message) for message in messages]
+    leading = 0
+    while leading < len(history) - 1 and history[leading].role == "system":
+        leading += 1
+    size = total_chars(history)
+    start = leading
+    kept = []
+    while size > max_chars and start < len(history) - 1:
+        if history[start].role == "system":
+            kept.append(history[start])
+        else:
+            size -= len(history[start].content)
+        start += 1
+    if size > max_chars:
+        return None
+    return History(history[:leading] + kept + history[start:])
+
+
+def admit(messages: List[MessageLike], model: str, budget: Budget, policy,
+          estimate: Callable[[List[MessageLike], str], Dict], cheaper_models: List[str],
+          affordable_chars: Callable[[str, float], int]) -> Dict:
+    """
+    Decide how a request may be sent: {"action": "allow" | "downgrade" | "trim",
+    "model", "messages", "cost", "reason"}. Raises BudgetExceededError if it can't.
+    """
+    cost = estimate(messages, model)
+    reason = budget.violation(model, cost["total"]) if budget.enabled else None
+    if reason is None:
+        return {"action": "allow", "model": model, "messages": messages, "cost": cost, "reason": None}
+
+    for step in policy_steps(policy):
+        if step == "downgrade":
+            for cheaper in cheaper_models:
+                cheaper_cost = estimate(messages, cheaper)
+                if budget.violation(cheaper, cheaper_cost["total"]) is None:
+                    return {"action": "downgrade", "model": cheaper, "messages": messages,
+                            "cost": cheaper_cost, "reason": reason}
+        elif step == "trim":
+            trimmed = trim_messages(messages, affordable_chars(model, budget.headroom(model)))
+            if trimmed is not None and len(trimmed) < len(messages):
+                trimmed_cost = estimate(trimmed, model)
+                if budget.violation(model, trimmed_cost["total"]) is None:
+                    return {"action": "trim", "model": model, "messages": trimmed,
+                            "cost": trimmed_cost, "reason": reason}
+    raise BudgetExceededError(f"Request blocked: it would exceed the {reason}")
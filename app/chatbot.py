@@ -1,31 +1,41 @@
 import os
 import json
-from typing import List, Dict, Optional
+import threading
+from typing import List, Dict, Iterator, Optional, Tuple
 from dotenv import load_dotenv
 from openai import OpenAI
-from .database import conversation_db
+from .database import ConversationDB, conversation_db
+from .analytics import MessageColumns
+from .messages import History, MessageLike, to_payload, total_chars
+from .retrieval import get_retriever
+from .budget import Budget, BudgetExceededError, admit, get_estimator, usage_cost
+from .transport import client_from_env
 
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+client = client_from_env(lambda: OpenAI(api_key=os.getenv("OPENAI_API_KEY")))
 
 AVAILABLE_MODELS = {
     "gpt-4o": {
         "name": "GPT-4o",
         "description": "Most capable model, best for complex tasks",
+        "capability": 3,
         "max_tokens": 4096,
-        "cost_per_1k_tokens": {"input": 0.005, "output": 0.015}
+        "cost_per_1k_tokens": {"input": 0.005, "cached_input": 0.0025, "output": 0.015}
     },
     "gpt-4o-mini": {
         "name": "GPT-4o Mini", 
         "description": "Faster and more cost-effective version of GPT-4o",
+        "capability": 2,
         "max_tokens": 16384,
-        "cost_per_1k_tokens": {"input": 0.00015, "output": 0.0006}
+        "cost_per_1k_tokens": {"input": 0.00015, "cached_input": 0.000075, "output": 0.0006}
     },
     "gpt-3.5-turbo": {
         "name": "GPT-3.5 Turbo",
         "description": "Fast and efficient for most conversations",
+        "capability": 1,
         "max_tokens": 4096,
-        "cost_per_1k_tokens": {"input": 0.0005, "output": 0.0015}
+        # no prompt caching discount for this model
+        "cost_per_1k_tokens": {"input": 0.0005, "cached_input": 0.0005, "output": 0.0015}
     }
 }
 
@@ -35,6 +45,8 @@ class PromptManager:
         self.config_file = os.path.join(self.prompts_dir, "prompts_config.json")
         self.prompts = {}
         self.current_prompt = "default"
+        self._lock = threading.RLock()
+        self._content_cache: Dict[str, Tuple[int, str]] = {}
         self.load_prompts_config()
     
     def load_prompts_config(self):
@@ -65,12 +77,13 @@ class PromptManager:
     
     def save_config(self):
         try:
-            config = {
-                "prompts": self.prompts,
-                "current_prompt": self.current_prompt
-            }
-            with open(self.config_file, 'w', encoding='utf-8') as f:
-                json.dump(config, f, indent=2)
+            with self._lock:
+                config = {
+                    "prompts": dict(self.prompts),
+                    "current_prompt": self.current_prompt
+                }
+                with open(self.config_file, 'w', encoding='utf-8') as f:
+                    json.dump(config, f, indent=2)
         except Exception as e:
             print(f"Warning: Could not save prompts config: {e}")
     
@@ -89,11 +102,12 @@ class PromptManager:
         }
     
     def set_prompt(self, prompt_id: str) -> bool:
-        if prompt_id in self.prompts:
-            self.current_prompt = prompt_id
-            self.save_config()
-            return True
-        return False
+        with self._lock:
+            if prompt_id in self.prompts:
+                self.current_prompt = prompt_id
+                self.save_config()
+                return True
+            return False
     
     def load_prompt_content(self, prompt_id: Optional[str] = None) -> str:
         prompt_to_use = prompt_id or self.current_prompt
@@ -107,19 +121,32 @@ class PromptManager:
         
         try:
             if os.path.exists(filepath):
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    return f.read().strip()
+                return self._read_prompt_file(filepath)
             else:
                 fallback_path = os.path.join(self.prompts_dir, 'default.txt')
                 if os.path.exists(fallback_path):
-                    with open(fallback_path, 'r', encoding='utf-8') as f:
-                        return f.read().strip()
+                    return self._read_prompt_file(fallback_path)
                 else:
                     return "You are a helpful AI assistant."
         except Exception as e:
             print(f"Warning: Could not load prompt: {e}")
             return "You are a helpful AI assistant."
     
+    def _read_prompt_file(self, filepath: str) -> str:
+        """
+        Prompt text, re-read only when the file changes. Returning the same string
+        for an unchanged file keeps the start of every request byte-identical,
+        which is what provider-side prompt caching matches on.
+        """
+        mtime = os.stat(filepath).st_mtime_ns
+        cached = self._content_cache.get(filepath)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        with open(filepath, 'r', encoding='utf-8') as f:
+            content = f.read().strip()
+        self._content_cache[filepath] = (mtime, content)
+        return content
+    
     def create_custom_prompt(self, prompt_id: str, name: str, description: str, content: str, category: str = "custom") -> bool:
         try:
             filename = f"{prompt_id}.txt"
@@ -128,14 +155,15 @@ class PromptManager:
             with open(filepath, 'w', encoding='utf-8') as f:
                 f.write(content)
             
-            self.prompts[prompt_id] = {
-                "name": name,
-                "description": description,
-                "file": filename,
-                "category": category
-            }
-            
-            self.save_config()
+            with self._lock:
+                self.prompts = dict(self.prompts)
+                self.prompts[prompt_id] = {
+                    "name": name,
+                    "description": description,
+                    "file": filename,
+                    "category": category
+                }
+                self.save_config()
             return True
         except Exception as e:
             print(f"Error creating custom prompt: {e}")
@@ -148,6 +176,23 @@ class ChatbotConfig:
         self.model = "gpt-4o-mini"
         self.temperature = 0.7
         self.max_tokens = 1000
+        self.retrieval = {
+            "enabled": False,
+            "top_k": 5,
+            "token_budget": 800,
+            "recent_messages": 6
+        }
+        self.budget = {
+            "session": None,
+            "daily": None,
+            "models": {},
+            "policy": "reject"
+        }
+        self.upload = {
+            "max_bytes": 10_000_000,
+            "max_tokens": 200_000,
+            "compress": True
+        }
         self.config_file = "config.json"
         self.load_config()
     
@@ -159,6 +204,9 @@ class ChatbotConfig:
                     self.model = config_data.get('model', self.model)
                     self.temperature = config_data.get('temperature', self.temperature)
                     self.max_tokens = config_data.get('max_tokens', self.max_tokens)
+                    self.retrieval.update(config_data.get('retrieval', {}))
+                    self.budget.update(config_data.get('budget', {}))
+                    self.upload.update(config_data.get('upload', {}))
         except Exception as e:
             print(f"Warning: Could not load config file: {e}")
     
@@ -167,7 +215,10 @@ class ChatbotConfig:
             config_data = {
                 'model': self.model,
                 'temperature': self.temperature,
-                'max_tokens': self.max_tokens
+                'max_tokens': self.max_tokens,
+                'retrieval': self.retrieval,
+                'budget': self.budget,
+                'upload': self.upload
             }
             with open(self.config_file, 'w') as f:
                 json.dump(config_data, f, indent=2)
@@ -176,17 +227,367 @@ class ChatbotConfig:
 
 config = ChatbotConfig()
 
+def get_client() -> OpenAI:
+    return client
+
+def set_client(new_client):
+    """Swap the shared client, e.g. for a CassetteClient replaying recorded responses"""
+    global client
+    client = new_client
+    default_session.client = new_client
+
+class ChatSession:
+    """
+    One chat: owns its model, prompt, generation parameters and history.
+    The OpenAI client, ConversationDB and PromptManager are shared and injected,
+    so many sessions can run in parallel threads without touching each other's
+    settings. Changing a session's model or prompt never rewrites config files.
+    """
+    
+    def __init__(self, client: Optional[OpenAI] = None, db: Optional[ConversationDB] = None,
+                 prompts: Optional[PromptManager] = None, model: Optional[str] = None,
+                 prompt_id: Optional[str] = None, temperature: Optional[float] = None,
+                 max_tokens: Optional[int] = None):
+        self.client = client or get_client()
+        self.db = db or conversation_db
+        self.prompts = prompts or prompt_manager
+        self.model = model if model in AVAILABLE_MODELS else config.model
+        self.prompt_id = prompt_id or self.prompts.current_prompt
+        self.temperature = config.temperature if temperature is None else temperature
+        self.max_tokens = config.max_tokens if max_tokens is None else max_tokens
+        self.retrieval = dict(config.retrieval)
+        self.budget = dict(config.budget)
+        self.messages = History()
+        self.conversation_id: Optional[int] = None
+        self.last_cost: Dict[str, float] = {"input": 0, "output": 0, "total": 0}
+        self.spent = 0.0
+        self.lock = threading.RLock()
+    
+    def set_model(self, model_name: str) -> bool:
+        if model_name in AVAILABLE_MODELS:
+            self.model = model_name
+            return True
+        return False
+    
+    def get_current_model(self) -> Dict:
+        return {
+            'id': self.model,
+            'info': AVAILABLE_MODELS.get(self.model, {})
+        }
+    
+    def set_prompt(self, prompt_id: str) -> bool:
+        if prompt_id in self.prompts.get_available_prompts():
+            self.prompt_id = prompt_id
+            return True
+        return False
+    
+    def get_current_prompt(self) -> Dict:
+        prompts = self.prompts.get_available_prompts()
+        if self.prompt_id in prompts:
+            return {'id': self.prompt_id, 'info': prompts[self.prompt_id]}
+        return {
+            'id': 'default',
+            'info': {'name': 'Default', 'description': 'Default assistant'}
+        }
+    
+    def system_prompt(self, prompt_id: Optional[str] = None) -> str:
+        return self.prompts.load_prompt_content(prompt_id or self.prompt_id)
+    
+    def _request_args(self, model: Optional[str]) -> Dict:
+        model_to_use = model or self.model
+        if model_to_use not in AVAILABLE_MODELS:
+            raise ValueError(f"Model {model_to_use} not available")
+        model_max_tokens = AVAILABLE_MODELS[model_to_use]["max_tokens"]
+        return {
+            "model": model_to_use,
+            "temperature": self.temperature,
+            "max_tokens": min(self.max_tokens, model_max_tokens)
+        }
+    
+    @staticmethod
+    def _capture_usage(usage, model: str, admission: Optional[Dict]):
+        if admission is None:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        admission["usage"] = {
+            "model": model,
+            "prompt_tokens": usage.prompt_tokens,
+            "completion_tokens": usage.completion_tokens,
+            "cached_tokens": getattr(details, "cached_tokens", None) or 0
+        }
+    
+    def _payload(self, messages: Optional[List[MessageLike]]) -> List[Dict[str, str]]:
+        return to_payload(self.messages if messages is None else messages)
+    
+    def ask(self, messages: Optional[List[MessageLike]] = None, model: Optional[str] = None,
+            admission: Optional[Dict] = None) -> str:
+        """The full reply; the usage the API reports goes to admission["usage"] when given."""
+        try:
+            args = self._request_args(model)
+            response = self.client.chat.completions.create(
+                messages=self._payload(messages),
+                **args
+            )
+            if response.usage:
+                self._capture_usage(response.usage, args["model"], admission)
+            return response.choices[0].message.content
+        except Exception as e:
+            return f"Error: {str(e)}"
+    
+    def stream(self, messages: Optional[List[MessageLike]] = None, model: Optional[str] = None,
+               admission: Optional[Dict] = None) -> Iterator[str]:
+        """
+        Yield the chatbot response as text deltas.
+        Errors are raised to the caller; closing the generator ends the request.
+        The usage reported at the end of the stream goes to admission["usage"] when given,
+        so parallel requests on one session each keep their own.
+        """
+        args = self._request_args(model)
+        response = self.client.chat.completions.create(
+            messages=self._payload(messages),
+            stream=True,
+            stream_options={"include_usage": True},
+            **args
+        )
+        try:
+            for chunk in response:
+                if getattr(chunk, "usage", None):
+                    self._capture_usage(chunk.usage, args["model"], admission)
+                if not chunk.choices:
+                    continue
+                delta = getattr(chunk.choices[0].delta, "content", None)
+                if delta:
+                    yield delta
+        finally:
+            response.close()
+    
+    def estimate_cost(self, messages: Optional[List[MessageLike]] = None,
+                      model: Optional[str] = None) -> Dict[str, float]:
+        model_to_use = model or self.model
+        if model_to_use not in AVAILABLE_MODELS:
+            return {"input": 0, "output": 0, "total": 0}
+        
+        input_chars = total_chars(self.messages if messages is None else messages)
+        return get_estimator(self.db).estimate(
+            model_to_use,
+            AVAILABLE_MODELS[model_to_use]["cost_per_1k_tokens"],
+            input_chars,
+            min(self.max_tokens, AVAILABLE_MODELS[model_to_use]["max_tokens"])
+        )
+    
+    def _affordable_chars(self, model: str, budget: float) -> int:
+        return get_estimator(self.db).affordable_chars(
+            model,
+            AVAILABLE_MODELS[model]["cost_per_1k_tokens"],
+            budget,
+            min(self.max_tokens, AVAILABLE_MODELS[model]["max_tokens"])
+        )
+    
+    def admit(self, messages: Optional[List[MessageLike]] = None, model: Optional[str] = None) -> Dict:
+        """
+        Check the request against the session, daily and per-model budgets before sending it.
+        Returns the model and messages to send (possibly downgraded or trimmed) and the
+        estimated cost; raises BudgetExceededError if the request is refused.
+        """
+        model_to_use = model or self.model
+        prices = AVAILABLE_MODELS[model_to_use]["cost_per_1k_tokens"]
+        # most capable first, so a downgrade gives up as little quality as it can
+        cheaper = sorted(
+            (name for name, info in AVAILABLE_MODELS.items()
+             if info["cost_per_1k_tokens"]["output"] < prices["output"]),
+            key=lambda name: -AVAILABLE_MODELS[name]["capability"]
+        )
+        return admit(
+            self.messages if messages is None else messages,
+            model_to_use,
+            Budget(self.budget, self.db, self.spent),
+            self.budget.get("policy"),
+            self.estimate_cost,
+            cheaper,
+            self._affordable_chars
+        )
+    
+    def record_usage(self, reply: str, admission: Dict) -> Dict:
+        """
+        Count a request's cost against the session: the usage the API reported
+        (or, if the stream was cut short before usage arrived, an estimate).
+        Real usage also feeds the estimator.
+        """
+        model = admission["model"]
+        prompt_chars = total_chars(admission["messages"])
+        usage = admission.get("usage")
+        if usage and usage["model"] == model:
+            get_estimator(self.db).observe(model, prompt_chars, usage["prompt_tokens"], usage["completion_tokens"])
+            usage = dict(usage, estimated=False)
+        elif reply:
+            usage = {
+                "model": model,
+                "prompt_tokens": admission["cost"].get("input_tokens", 0),
+                "completion_tokens": -(-len(reply) // 4),
+                "cached_tokens": 0,
+                "estimated": True
+            }
+        else:
+            usage = {"model": model, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0,
+                     "estimated": True}
+        usage["cost"] = usage_cost(
+            AVAILABLE_MODELS[model]["cost_per_1k_tokens"], usage["prompt_tokens"], usage["completion_tokens"],
+            usage["cached_tokens"]
+        )
+        with self.lock:
+            self.spent += usage["cost"]
+        admission["usage"] = usage
+        return usage
+    
+    def record_reply(self, reply: str, admission: Dict, conversation_id: Optional[int] = None) -> Dict:
+        """Save the assistant reply with its usage (see record_usage)."""
+        usage = self.record_usage(reply, admission)
+        self.db.add_message(
+            conversation_id or self.conversation_id, "assistant", reply,
+            tokens_used=usage["prompt_tokens"] + usage["completion_tokens"],
+            cost=usage["cost"],
+            prompt_tokens=usage["prompt_tokens"],
+            completion_tokens=usage["completion_tokens"],
+            model=usage["model"],
+            cached_tokens=usage["cached_tokens"]
+        )
+        return usage
+    
+    def reserve(self, messages: List[MessageLike], model: Optional[str] = None) -> Dict:
+        """
+        Admit one request of a larger job (an upload) and hold its estimated cost
+        against the session budget until settle(), so requests running in parallel
+        can't overspend together. Raises BudgetExceededError if refused.
+        """
+        with self.lock:
+            admission = self.admit(messages, model)
+            self.spent += admission["cost"]["total"]
+            return admission
+    
+    def settle(self, reply: str, admission: Dict) -> Dict:
+        """
+        Replace a reservation with the request's real cost. The reply is not saved as a
+        message, so the cost is stored as a request_usage row (usage["id"]) that the
+        daily and per-model limits count.
+        """
+        with self.lock:
+            self.spent -= admission["cost"]["total"]
+            usage = self.record_usage(reply, admission)
+        usage["id"] = self.db.record_request_usage(
+            usage["model"], usage["prompt_tokens"], usage["completion_tokens"], usage["cached_tokens"], usage["cost"]
+        )
+        return usage
+    
+    def create_conversation(self, title: Optional[str] = None) -> int:
+        if not title:
+            from datetime import datetime
+            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M")
+            title = f"Chat {timestamp}"
+        return self.db.create_conversation(title=title, model=self.model, prompt_id=self.prompt_id)
+    
+    def start_conversation(self, title: Optional[str] = None) -> int:
+        """Create a conversation and reset the history to the session's system prompt."""
+        with self.lock:
+            self.conversation_id = self.create_conversation(title)
+            system_prompt = self.system_prompt()
+            self.messages = History()
+            self.messages.add("system", system_prompt)
+            self.db.add_message(self.conversation_id, "system", system_prompt)
+            return self.conversation_id
+    
+    def load_conversation(self, conversation_id: int) -> bool:
+        info = self.db.get_conversation_info(conversation_id)
+        if not info:
+            return False
+        messages = History.from_rows(self.db.get_conversation_turns(conversation_id))
+        with self.lock:
+            self.conversation_id = conversation_id
+            self.messages = messages
+            self.set_model(info['model'])
+            self.set_prompt(info['prompt_id'])
+        return True
+    
+    def fork(self, after_messages: Optional[int] = None, title: Optional[str] = None) -> Optional[int]:
+        """
+        Continue in a new branch of the current conversation. The branch shares the
+        parent's stored messages instead of copying them; the parent is left as is.
+        """
+        with self.lock:
+            branch_id = self.db.fork_conversation(self.conversation_id, after_messages, title)
+            if branch_id is None:
+                return None
+            if after_messages is None:
+                self.messages = History(self.messages)
+            else:
+                self.messages = History.from_rows(self.db.get_conversation_turns(branch_id))
+            self.conversation_id = branch_id
+            return branch_id
+    
+    def prepare_messages(self, messages: Optional[List[MessageLike]] = None) -> Dict:
+        """
+        Retrieval stage in front of the request: when enabled, send only the recent
+        turns plus the most relevant snippets of past conversations.
+        """
+        messages = self.messages if messages is None else messages
+        if not self.retrieval.get("enabled"):
+            tokens = -(-total_chars(messages) // 4)
+            return {"messages": messages, "retrieved": 0, "tokens_before": tokens, "tokens_after": tokens}
+        return get_retriever(self.db).build_context(
+            messages,
+            top_k=self.retrieval["top_k"],
+            token_budget=self.retrieval["token_budget"],
+            recent_messages=self.retrieval["recent_messages"]
+        )
+    
+    def send(self, content: str, turn: Optional[Dict] = None) -> Iterator[str]:
+        """
+        Run one turn: record the user message, stream the reply and record it.
+        Turns on the same session are serialized; separate sessions run in parallel.
+        turn, if given, receives this turn's "admission" and recorded "usage".
+        """
+        with self.lock:
+            if self.conversation_id is None:
+                self.start_conversation()
+            self.messages.add("user", content)
+            context = self.prepare_messages()
+            try:
+                admission = self.admit(context["messages"])
+            except BudgetExceededError:
+                self.messages.pop()
+                raise
+            self.last_cost = admission["cost"]
+            if turn is not None:
+                turn["admission"] = admission
+            self.db.add_message(self.conversation_id, "user", content)
+            parts = []
+            try:
+                for delta in self.stream(admission["messages"], admission["model"], admission):
+                    parts.append(delta)
+                    yield delta
+            finally:
+                reply = "".join(parts)
+                self.messages.add("assistant", reply)
+                usage = self.record_reply(reply, admission)
+                if turn is not None:
+                    turn["usage"] = usage
+
+# The module-level functions below are a facade over this default session,
+# which also persists model and prompt changes for the CLI.
+default_session = ChatSession(client, conversation_db, prompt_manager)
+
 def load_system_prompt(prompt_id: Optional[str] = None):
-    return prompt_manager.load_prompt_content(prompt_id)
+    return default_session.system_prompt(prompt_id)
 
 def get_available_prompts():
     return prompt_manager.get_available_prompts()
 
 def set_prompt(prompt_id: str) -> bool:
-    return prompt_manager.set_prompt(prompt_id)
+    if prompt_manager.set_prompt(prompt_id):
+        return default_session.set_prompt(prompt_id)
+    return False
 
 def get_current_prompt():
-    return prompt_manager.get_current_prompt()
+    return default_session.get_current_prompt()
 
 def create_custom_prompt(prompt_id: str, name: str, description: str, content: str, category: str = "custom") -> bool:
     return prompt_manager.create_custom_prompt(prompt_id, name, description, content, category)
@@ -195,125 +596,126 @@ def get_available_models():
     return AVAILABLE_MODELS
 
 def set_model(model_name: str) -> bool:
-    if model_name in AVAILABLE_MODELS:
+    if default_session.set_model(model_name):
         config.model = model_name
         config.save_config()
         return True
     return False
 
 def get_current_model():
-    return {
-        'id': config.model,
-        'info': AVAILABLE_MODELS.get(config.model, {})
-    }
+    return default_session.get_current_model()
 
-def ask_chatbot(messages: List[Dict[str, str]], model: Optional[str] = None) -> str:
-    try:
-        model_to_use = model or config.model
-        
-        if model_to_use not in AVAILABLE_MODELS:
-            raise ValueError(f"Model {model_to_use} not available")
-        
-        model_max_tokens = AVAILABLE_MODELS[model_to_use]["max_tokens"]
-        effective_max_tokens = min(config.max_tokens, model_max_tokens)
-        
-        response = client.chat.completions.create(
-            model=model_to_use,
-            messages=messages,
-            temperature=config.temperature,
-            max_tokens=effective_max_tokens
-        )
-        return response.choices[0].message.content
-        
-    except Exception as e:
-        return f"Error: {str(e)}"
+def ask_chatbot(messages: List[MessageLike], model: Optional[str] = None,
+                admission: Optional[Dict] = None) -> str:
+    return default_session.ask(messages, model, admission)
+
+def stream_chatbot(messages: List[MessageLike], model: Optional[str] = None,
+                   admission: Optional[Dict] = None) -> Iterator[str]:
+    return default_session.stream(messages, model, admission)
 
-def ask_chatbot_stream(messages: List[Dict[str, str]], model: Optional[str] = None):
+def ask_chatbot_stream(messages: List[MessageLike], model: Optional[str] = None,
+                       admission: Optional[Dict] = None):
     """
     Stream the chatbot response chunk by chunk (for CLI streaming)
     Returns the full response as a string. User can stop with Ctrl+C.
+    The reported usage goes to admission["usage"] when an admission is given.
     """
     try:
-        model_to_use = model or config.model
-        if model_to_use not in AVAILABLE_MODELS:
-            raise ValueError(f"Model {model_to_use} not available")
-        model_max_tokens = AVAILABLE_MODELS[model_to_use]["max_tokens"]
-        effective_max_tokens = min(config.max_tokens, model_max_tokens)
-        response = client.chat.completions.create(
-            model=model_to_use,
-            messages=messages,
-            temperature=config.temperature,
-            max_tokens=effective_max_tokens,
-            stream=True
-        )
-        full_reply = ""
+        parts = []
+        stream = stream_chatbot(messages, model, admission)
         try:
-            for chunk in response:
-                delta = getattr(chunk.choices[0].delta, "content", None)
-                if delta:
-                    print(delta, end="", flush=True)
-                    full_reply += delta
+            for delta in stream:
+                print(delta, end="", flush=True)
+                parts.append(delta)
         except KeyboardInterrupt:
+            stream.close()
             print("\n⏹️ Response stopped by user.")
         print()  # Newline after streaming
-        return full_reply
+        return "".join(parts)
     except Exception as e:
         print(f"Error: {str(e)}")
         return ""
 
-def estimate_cost(messages: List[Dict[str, str]], model: Optional[str] = None) -> Dict[str, float]:
-    model_to_use = model or config.model
-    if model_to_use not in AVAILABLE_MODELS:
-        return {"input": 0, "output": 0, "total": 0}
-    
-    input_chars = sum(len(msg["content"]) for msg in messages)
-    input_tokens = input_chars / 4
-    
-    output_tokens = config.max_tokens / 2
-    
-    cost_info = AVAILABLE_MODELS[model_to_use]["cost_per_1k_tokens"]
-    
-    input_cost = (input_tokens / 1000) * cost_info["input"]
-    output_cost = (output_tokens / 1000) * cost_info["output"]
-    
+def estimate_cost(messages: List[MessageLike], model: Optional[str] = None) -> Dict[str, float]:
+    return default_session.estimate_cost(messages, model)
+
+def admit_request(messages: List[MessageLike], model: Optional[str] = None) -> Dict:
+    """Budget admission for the next request; raises BudgetExceededError if refused"""
+    return default_session.admit(messages, model)
+
+def record_reply(conversation_id: int, reply: str, admission: Dict) -> Dict:
+    """Save an assistant reply with its real token usage and cost"""
+    return default_session.record_reply(reply, admission, conversation_id)
+
+def ask_within_budget(messages: List[MessageLike], model: Optional[str] = None, stream: bool = False,
+                      usage_log: Optional[List[Dict]] = None) -> Dict:
+    """
+    One request of an upload: admitted against the budgets like a chat turn,
+    then counted and stored at its real cost. Returns {"reply", "model", "usage"},
+    where model is the one that answered (the budget may have downgraded it);
+    usage_log, if given, also receives the usage. Raises BudgetExceededError if refused.
+    """
+    admission = default_session.reserve(messages, model)
+    reply = ""
+    try:
+        if stream:
+            reply = ask_chatbot_stream(admission["messages"], admission["model"], admission)
+        else:
+            reply = ask_chatbot(admission["messages"], admission["model"], admission)
+    finally:
+        usage = default_session.settle(reply, admission)
+        if usage_log is not None:
+            usage_log.append(usage)
+    return {"reply": reply, "model": admission["model"], "usage": usage}
+
+def get_budget_status() -> Dict:
+    """Configured limits with what is left of each for the current model"""
+    budget = Budget(default_session.budget, default_session.db, default_session.spent)
     return {
-        "input": round(input_cost, 6),
-        "output": round(output_cost, 6),
-        "total": round(input_cost + output_cost, 6)
+        "limits": default_session.budget,
+        "session_spent": default_session.spent,
+        "daily_spent": default_session.db.get_daily_spend(),
+        "remaining": budget.remaining(default_session.model)
     }
 
+def prepare_chat_messages(messages: List[MessageLike]) -> Dict:
+    """Apply the retrieval stage to a chat history before sending it"""
+    return default_session.prepare_messages(messages)
+
+def set_retrieval(enabled: bool):
+    default_session.retrieval["enabled"] = enabled
+    config.retrieval["enabled"] = enabled
+    config.save_config()
+
+def get_retrieval_settings() -> Dict:
+    return dict(default_session.retrieval)
+
+def get_upload_settings() -> Dict:
+    """Size and token ceilings for uploaded files"""
+    return dict(config.upload)
+
 def create_conversation(title: str = None) -> int:
-    if not title:
-        current_model = get_current_model()
-        current_prompt = get_current_prompt()
-        from datetime import datetime
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M")
-        title = f"Chat {timestamp}"
-    
-    return conversation_db.create_conversation(
-        title=title,
-        model=config.model,
-        prompt_id=prompt_manager.current_prompt
-    )
+    return default_session.create_conversation(title)
 
 def save_message_to_db(conversation_id: int, role: str, content: str, 
                       tokens_used: int = 0, cost: float = 0.0):
     """Save a message to the database"""
     return conversation_db.add_message(conversation_id, role, content, tokens_used, cost)
 
-def load_conversation(conversation_id: int) -> List[Dict[str, str]]:
+def load_conversation(conversation_id: int) -> History:
     """Load a conversation from the database"""
-    messages = conversation_db.get_conversation_messages(conversation_id)
-    
-    chat_messages = []
-    for msg in messages:
-        if msg['role'] in ['system', 'user', 'assistant']:
-            chat_messages.append({
-                'role': msg['role'],
-                'content': msg['content']
-            })
-    
-    return chat_messages
+    return History.from_rows(conversation_db.get_conversation_turns(conversation_id))
+
+def fork_conversation(conversation_id: int, after_messages: Optional[int] = None,
+                      title: Optional[str] = None) -> Optional[int]:
+    """Branch a conversation (optionally after its first N user/assistant messages)"""
+    return conversation_db.fork_conversation(conversation_id, after_messages, title)
+
+def get_conversation_info(conversation_id: int) -> Optional[Dict]:
+    return conversation_db.get_conversation_info(conversation_id)
+
+def list_conversation_branches(conversation_id: int) -> List[Dict]:
+    return conversation_db.list_branches(conversation_id)
 
 def list_recent_conversations(limit: int = 20) -> List[Dict]:
     """List recent conversations"""
@@ -331,6 +733,18 @@ def get_conversation_stats() -> Dict:
     """Get usage statistics"""
     return conversation_db.get_stats()
 
+def get_read_cache_stats() -> Dict:
+    """Hit rate and size of the database's in-process read cache"""
+    return conversation_db.read_cache_stats()
+
+def get_usage_analytics(weeks: int = 8, export_path: Optional[str] = None) -> Dict:
+    """Usage report over all messages; optionally also write the message columns to an .npz file"""
+    columns = MessageColumns.load(conversation_db)
+    report = columns.summarize(weeks)
+    if export_path:
+        report["export_path"] = columns.export(export_path)
+    return report
+
 def export_conversation(conversation_id: int, format: str = "json") -> str:
     """Export a conversation in the specified format"""
     messages = conversation_db.get_conversation_messages(conversation_id)
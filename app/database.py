@@ -1,16 +1,176 @@
 import sqlite3
 import json
+import os
+import queue
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
-from typing import List, Dict, Optional, Tuple
+from typing import Any, Callable, Hashable, Iterator, List, Dict, Optional, Tuple
+
+from .messages import PERSONA_SWITCH_PREFIX
+
+READ_CACHE_SIZE = 256
+MAX_CACHED_MESSAGES = 2000  # longer conversations are read from disk every time
+
+class ReadCache:
+    """
+    Bounded LRU of query results keyed by (kind, argument), with hit/miss counters.
+    Results loaded while an invalidation ran are returned but not stored, and
+    neither are empty results (None, no rows): a conversation that doesn't exist
+    yet must be found once it is created. changed, if given, is asked before
+    every lookup and empties the cache when it returns True.
+    """
+    
+    def __init__(self, maxsize: int = READ_CACHE_SIZE, changed: Optional[Callable[[], bool]] = None):
+        self.maxsize = maxsize
+        self.changed = changed
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+    
+    def get(self, key: Hashable, load: Callable[[], Any], cacheable: Callable[[Any], bool] = lambda value: True):
+        if self.maxsize > 0 and self.changed is not None and self.changed():
+            self.clear()
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            generation = self._generation
+        value = load()
+        with self._lock:
+            if self.maxsize > 0 and generation == self._generation and value and cacheable(value):
+                self._entries[key] = value
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return value
+    
+    def discard(self, *keys: Hashable, kinds: Tuple[str, ...] = ()):
+        """Drop the given keys and every entry of the given kinds."""
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._entries.pop(key, None)
+            if kinds:
+                for key in [key for key in self._entries if key[0] in kinds]:
+                    del self._entries[key]
+    
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+    
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
 
 class ConversationDB:
     
-    def __init__(self, db_path: str = "conversations.db"):
+    def __init__(self, db_path: str = "conversations.db", pool_size: int = 8,
+                 read_cache_size: int = READ_CACHE_SIZE):
         self.db_path = db_path
+        self._pool = queue.Queue(maxsize=pool_size)
+        # Conversation lists, info and message pages; every write below discards what it changes,
+        # and a commit by any other connection (e.g. the CLI and the API server in two processes) drops it all
+        self._watch: Optional[sqlite3.Connection] = None
+        self._watch_lock = threading.Lock()
+        self._data_version: Optional[int] = None
+        self._read_cache = ReadCache(read_cache_size, self._changed_elsewhere)
+        # Callbacks for derived indexes: (message_id, conversation_id, role, content) and (conversation_id)
+        self.on_message_added: List[Callable[[int, int, str, str], None]] = []
+        self.on_conversation_deleted: List[Callable[[int], None]] = []
         self.init_database()
     
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """
+        Borrow a pooled connection for one transaction, so concurrent
+        sessions share a bounded set of connections instead of reopening the file.
+        """
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._open_connection()
+        conn.row_factory = None
+        changes = conn.total_changes
+        try:
+            with conn:
+                yield conn
+                own_write = conn.total_changes != changes and self.db_path != ":memory:"
+                if own_write:
+                    # this transaction holds the write lock, so no one else can commit until it does
+                    if self._changed_elsewhere():
+                        self._read_cache.clear()
+                    version = conn.execute("PRAGMA data_version").fetchone()[0]
+            if own_write:
+                self._own_commit(conn, version)
+        finally:
+            try:
+                self._pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+    
+    def _open_connection(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+    
+    def _changed_elsewhere(self) -> bool:
+        """
+        Whether another connection committed since the last check. SQLite's data_version
+        changes with commits by every other connection to the file, so writes from another
+        process are noticed; our own writes move the baseline instead (see _own_commit).
+        """
+        if self.db_path == ":memory:":
+            return False
+        with self._watch_lock:
+            if self._watch is None:
+                self._watch = self._open_connection()
+            version = self._watch.execute("PRAGMA data_version").fetchone()[0]
+            changed = self._data_version is not None and version != self._data_version
+            self._data_version = version
+            return changed
+    
+    def _own_commit(self, conn: sqlite3.Connection, version: int):
+        """
+        Move the data_version baseline past a commit of ours, whose cache entries the write
+        already discarded. conn's own data_version (read just before the commit as version)
+        only moves for other connections, so if it moved, someone else committed right after
+        us and the baseline is left alone for the next check to notice.
+        """
+        with self._watch_lock:
+            if self._watch is None:
+                return
+            latest = self._watch.execute("PRAGMA data_version").fetchone()[0]
+            if conn.execute("PRAGMA data_version").fetchone()[0] == version:
+                self._data_version = latest
+    
+    def close(self):
+        with self._watch_lock:
+            if self._watch is not None:
+                self._watch.close()
+                self._watch = None
+                self._data_version = None
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+    
     def init_database(self):
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect() as conn:
+            if self.db_path != ":memory:":
+                conn.execute("PRAGMA journal_mode = WAL")
+            
             conn.execute("""
                 CREATE TABLE IF NOT EXISTS conversations (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -44,76 +204,389 @@ class ConversationDB:
                 CREATE INDEX IF NOT EXISTS idx_messages_conversation 
                 ON messages(conversation_id, timestamp)
             """)
+            
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS file_reviews (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    path TEXT NOT NULL,
+                    content_hash TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    review TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_file_reviews_hash 
+                ON file_reviews(content_hash, model)
+            """)
+            
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_file_reviews_path 
+                ON file_reviews(path, id DESC)
+            """)
+            
+            # reviews depend on the system prompt they were made under
+            self._add_missing_columns(conn, "file_reviews", {
+                "prompt_hash": "TEXT NOT NULL DEFAULT ''"
+            })
+            
+            self._add_missing_columns(conn, "conversations", {
+                "parent_id": "INTEGER REFERENCES conversations (id)",
+                "fork_message_id": "INTEGER"
+            })
+            
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_conversations_parent 
+                ON conversations(parent_id)
+            """)
+            
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_messages_conversation_id 
+                ON messages(conversation_id, id)
+            """)
+            
+            self._add_missing_columns(conn, "messages", {
+                "prompt_tokens": "INTEGER DEFAULT 0",
+                "completion_tokens": "INTEGER DEFAULT 0",
+                "model": "TEXT",
+                "cached_tokens": "INTEGER DEFAULT 0"
+            })
+            
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_messages_timestamp 
+                ON messages(timestamp)
+            """)
+            
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS model_usage (
+                    model TEXT PRIMARY KEY,
+                    requests INTEGER NOT NULL DEFAULT 0,
+                    prompt_chars INTEGER NOT NULL DEFAULT 0,
+                    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+                    completion_tokens INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            
+            # API requests that are not stored as a message (upload parts, batches, merges);
+            # conversation_id is set once their cost is carried by a saved message
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS request_usage (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    model TEXT NOT NULL,
+                    prompt_tokens INTEGER DEFAULT 0,
+                    completion_tokens INTEGER DEFAULT 0,
+                    cached_tokens INTEGER DEFAULT 0,
+                    cost REAL DEFAULT 0.0,
+                    conversation_id INTEGER
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_request_usage_timestamp ON request_usage(timestamp)")
+            
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS chunk_analyses (
+                    chunk_hash TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    analysis TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (chunk_hash, model)
+                )
+            """)
+    
+    @staticmethod
+    def _add_missing_columns(conn: sqlite3.Connection, table: str, columns: Dict[str, str],
+                             schema: str = "main"):
+        """Migrate databases created by older versions in place."""
+        existing = {row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table})")}
+        for name, definition in columns.items():
+            if name not in existing:
+                conn.execute(f"ALTER TABLE {schema}.{table} ADD COLUMN {name} {definition}")
     
     def create_conversation(self, title: str, model: str, prompt_id: str) -> int:
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect() as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 INSERT INTO conversations (title, model, prompt_id)
                 VALUES (?, ?, ?)
             """, (title, model, prompt_id))
-            return cursor.lastrowid
+            conversation_id = cursor.lastrowid
+        self._forget_conversation(conversation_id)
+        return conversation_id
     
     def add_message(self, conversation_id: int, role: str, content: str, 
-                   tokens_used: int = 0, cost: float = 0.0) -> int:
-        with sqlite3.connect(self.db_path) as conn:
+                   tokens_used: int = 0, cost: float = 0.0, prompt_tokens: int = 0,
+                   completion_tokens: int = 0, model: Optional[str] = None,
+                   cached_tokens: int = 0) -> int:
+        with self._connect() as conn:
+            message_id = self._insert_message(conn, conversation_id, role, content, tokens_used, cost,
+                                              prompt_tokens, completion_tokens, model, cached_tokens)
+        self._forget_conversation(conversation_id)
+        
+        for callback in self.on_message_added:
+            callback(message_id, conversation_id, role, content)
+        return message_id
+    
+    def _insert_message(self, conn: sqlite3.Connection, conversation_id: int, role: str, content: str,
+                        tokens_used: int, cost: float, prompt_tokens: int, completion_tokens: int,
+                        model: Optional[str], cached_tokens: int) -> int:
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            INSERT INTO messages (conversation_id, role, content, tokens_used, cost,
+                                  prompt_tokens, completion_tokens, model, cached_tokens)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (conversation_id, role, content, tokens_used, cost,
+              prompt_tokens, completion_tokens, model, cached_tokens))
+        message_id = cursor.lastrowid
+        
+        cursor.execute("""
+            UPDATE conversations 
+            SET updated_at = CURRENT_TIMESTAMP 
+            WHERE id = ?
+        """, (conversation_id,))
+        return message_id
+    
+    # Branches share their ancestors' rows: walk up the parent chain, taking
+    # each ancestor's messages up to the point where the child was forked.
+    ANCESTRY_CTE = """
+        WITH RECURSIVE chain(id, parent_id, fork_message_id, upto) AS (
+            SELECT id, parent_id, fork_message_id, NULL
+            FROM conversations WHERE id = ?
+            UNION ALL
+            SELECT c.id, c.parent_id, c.fork_message_id,
+                   CASE WHEN chain.upto IS NULL OR chain.fork_message_id < chain.upto
+                        THEN chain.fork_message_id ELSE chain.upto END
+            FROM conversations c JOIN chain ON c.id = chain.parent_id
+        )
+    """
+    # The same walk for every conversation in {seed} at once, keyed by the conversation it starts from
+    CHAINS_CTE = """
+        chains(leaf, id, parent_id, fork_message_id, upto) AS (
+            SELECT id, id, parent_id, fork_message_id, NULL
+            FROM {seed}
+            UNION ALL
+            SELECT chains.leaf, c.id, c.parent_id, c.fork_message_id,
+                   CASE WHEN chains.upto IS NULL OR chains.fork_message_id < chains.upto
+                        THEN chains.fork_message_id ELSE chains.upto END
+            FROM conversations c JOIN chains ON c.id = chains.parent_id
+        )
+    """
+    
+    def _forget_conversation(self, conversation_id: int):
+        """
+        Drop the cached reads a write to this conversation changes. Branches only
+        inherit messages up to their fork point, so their entries stay valid.
+        """
+        self._read_cache.discard(("info", conversation_id), ("messages", conversation_id),
+                                 ("turns", conversation_id), kinds=("list",))
+    
+    def read_cache_stats(self) -> Dict:
+        return self._read_cache.stats()
+    
+    def get_conversation_messages(self, conversation_id: int) -> List[Dict]:
+        """All messages of a conversation, including those inherited by a branch."""
+        rows = self._read_cache.get(("messages", conversation_id),
+                                    lambda: self._fetch_messages(conversation_id),
+                                    lambda rows: len(rows) <= MAX_CACHED_MESSAGES)
+        return [dict(row) for row in rows]
+    
+    def get_conversation_turns(self, conversation_id: int) -> List[Tuple[str, str]]:
+        """(role, content) pairs of the chat roles only, without building a dict per row."""
+        return list(self._read_cache.get(("turns", conversation_id),
+                                         lambda: self._fetch_turns(conversation_id),
+                                         lambda rows: len(rows) <= MAX_CACHED_MESSAGES))
+    
+    def _fetch_messages(self, conversation_id: int) -> List[Dict]:
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             
-            cursor.execute("""
-                INSERT INTO messages (conversation_id, role, content, tokens_used, cost)
-                VALUES (?, ?, ?, ?, ?)
-            """, (conversation_id, role, content, tokens_used, cost))
+            cursor.execute(self.ANCESTRY_CTE + """
+                SELECT m.role, m.content, m.timestamp, m.tokens_used, m.cost,
+                       m.prompt_tokens, m.completion_tokens, m.model, m.cached_tokens
+                FROM chain
+                JOIN messages m ON m.conversation_id = chain.id
+                WHERE chain.upto IS NULL OR m.id <= chain.upto
+                ORDER BY m.id
+            """, (conversation_id,))
             
-            cursor.execute("""
-                UPDATE conversations 
-                SET updated_at = CURRENT_TIMESTAMP 
-                WHERE id = ?
+            return [dict(row) for row in cursor.fetchall()]
+    
+    def _fetch_turns(self, conversation_id: int) -> List[Tuple[str, str]]:
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute(self.ANCESTRY_CTE + """
+                SELECT m.role, m.content
+                FROM chain
+                JOIN messages m ON m.conversation_id = chain.id
+                WHERE (chain.upto IS NULL OR m.id <= chain.upto)
+                  AND m.role IN ('system', 'user', 'assistant')
+                ORDER BY m.id
             """, (conversation_id,))
             
-            return cursor.lastrowid
+            return cursor.fetchall()
     
-    def get_conversation_messages(self, conversation_id: int) -> List[Dict]:
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
+    def fork_conversation(self, conversation_id: int, after_messages: Optional[int] = None,
+                          title: Optional[str] = None) -> Optional[int]:
+        """
+        Branch a conversation without copying messages: the branch records its parent
+        and the id of the last inherited message. By default it inherits everything;
+        after_messages keeps only the first N user/assistant messages.
+        Returns the new conversation id, or None if the conversation does not exist.
+        """
+        with self._connect() as conn:
             cursor = conn.cursor()
+            cursor.execute("SELECT title, fork_message_id FROM conversations WHERE id = ?", (conversation_id,))
+            row = cursor.fetchone()
+            if not row:
+                return None
+            parent_title, parent_fork = row
             
+            if after_messages is None:
+                fork_message_id = self._last_message_id(conn, conversation_id) or parent_fork or 0
+            else:
+                fork_message_id = self._nth_message_id(conn, conversation_id, max(after_messages, 1))
+                if fork_message_id is None:
+                    return None
+            
+            if not title:
+                title = parent_title if parent_title.endswith(" (branch)") else f"{parent_title} (branch)"
             cursor.execute("""
-                SELECT role, content, timestamp, tokens_used, cost
-                FROM messages 
-                WHERE conversation_id = ?
-                ORDER BY timestamp ASC
+                INSERT INTO conversations (title, model, prompt_id, parent_id, fork_message_id)
+                SELECT ?, model, prompt_id, id, ?
+                FROM conversations WHERE id = ?
+            """, (title, fork_message_id, conversation_id))
+            branch_id = cursor.lastrowid
+        self._forget_conversation(branch_id)
+        return branch_id
+    
+    def _last_message_id(self, conn: sqlite3.Connection, conversation_id: int) -> Optional[int]:
+        """Id of the conversation's own latest message."""
+        return conn.execute("SELECT MAX(id) FROM messages WHERE conversation_id = ?",
+                            (conversation_id,)).fetchone()[0]
+    
+    def _nth_message_id(self, conn: sqlite3.Connection, conversation_id: int, n: int) -> Optional[int]:
+        """Id of the Nth user/assistant message, counting inherited ones."""
+        row = conn.execute(self.ANCESTRY_CTE + """
+            SELECT m.id
+            FROM chain
+            JOIN messages m ON m.conversation_id = chain.id
+            WHERE (chain.upto IS NULL OR m.id <= chain.upto)
+              AND m.role IN ('user', 'assistant')
+            ORDER BY m.id
+            LIMIT 1 OFFSET ?
+        """, (conversation_id, n - 1)).fetchone()
+        return row[0] if row else None
+    
+    def list_branches(self, conversation_id: int) -> List[Dict]:
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT id, title, fork_message_id, created_at, updated_at
+                FROM conversations
+                WHERE parent_id = ?
+                ORDER BY id
             """, (conversation_id,))
-            
             return [dict(row) for row in cursor.fetchall()]
     
+    def iter_messages(self, roles: Tuple[str, ...] = ('user', 'assistant'),
+                      batch_size: int = 5000) -> Iterator[Tuple[int, int, str, str]]:
+        """Stream (id, conversation_id, role, content) for all messages, in id order."""
+        placeholders = ", ".join("?" for _ in roles)
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT id, conversation_id, role, content
+                FROM messages
+                WHERE role IN ({placeholders})
+                ORDER BY id
+            """, roles)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+    
+    def scan_messages(self, select: str, chunk_size: int = 500_000) -> Iterator[tuple]:
+        """
+        Run an aggregate SELECT (e.g. group_concat columns) over consecutive id
+        ranges of the messages of live conversations, aliased m and joined to
+        their conversation c. Yields one result row per range.
+        """
+        with self._connect() as conn:
+            yield from self._scan_table(conn, "main.messages", select, chunk_size)
+    
+    @staticmethod
+    def _scan_table(conn: sqlite3.Connection, table: str, select: str, chunk_size: int) -> Iterator[tuple]:
+        low, high = conn.execute(f"SELECT MIN(id), MAX(id) FROM {table}").fetchone()
+        if low is None:
+            return
+        for start in range(low - 1, high, chunk_size):
+            yield conn.execute(f"""
+                SELECT {select}
+                FROM {table} m
+                JOIN main.conversations c ON c.id = m.conversation_id
+                WHERE m.id > ? AND m.id <= ?
+            """, (start, start + chunk_size)).fetchone()
+    
+    def get_messages_by_ids(self, message_ids: List[int]) -> Dict[int, Dict]:
+        if not message_ids:
+            return {}
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            placeholders = ", ".join("?" for _ in message_ids)
+            cursor.execute(f"""
+                SELECT id, conversation_id, role, content, timestamp
+                FROM messages
+                WHERE id IN ({placeholders})
+            """, message_ids)
+            return {row['id']: dict(row) for row in cursor.fetchall()}
+    
     def list_conversations(self, limit: int = 20) -> List[Dict]:
-        with sqlite3.connect(self.db_path) as conn:
+        rows = self._read_cache.get(("list", limit), lambda: self._fetch_conversation_list(limit))
+        return [dict(row) for row in rows]
+    
+    def _fetch_conversation_list(self, limit: int) -> List[Dict]:
+        """Latest conversations; a branch's message count and cost include its inherited messages."""
+        with self._connect() as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             
             cursor.execute("""
-                SELECT c.id, c.title, c.model, c.prompt_id, c.created_at, c.updated_at,
+                WITH RECURSIVE page AS (
+                    SELECT * FROM conversations ORDER BY updated_at DESC LIMIT ?
+                ),""" + self.CHAINS_CTE.format(seed="page") + """
+                SELECT p.id, p.title, p.model, p.prompt_id, p.created_at, p.updated_at, p.parent_id,
                        COUNT(m.id) as message_count,
                        ROUND(SUM(m.cost), 6) as total_cost
-                FROM conversations c
-                LEFT JOIN messages m ON c.id = m.conversation_id
-                GROUP BY c.id
-                ORDER BY c.updated_at DESC
-                LIMIT ?
+                FROM page p
+                JOIN chains ON chains.leaf = p.id
+                LEFT JOIN messages m ON m.conversation_id = chains.id
+                                    AND (chains.upto IS NULL OR m.id <= chains.upto)
+                GROUP BY p.id
+                ORDER BY p.updated_at DESC
             """, (limit,))
             
             return [dict(row) for row in cursor.fetchall()]
     
     def search_conversations(self, query: str, limit: int = 10) -> List[Dict]:
-        with sqlite3.connect(self.db_path) as conn:
+        """Conversations whose title or messages (inherited ones included) match the query."""
+        with self._connect() as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             
-            cursor.execute("""
-                SELECT DISTINCT c.id, c.title, c.model, c.created_at,
+            cursor.execute("WITH RECURSIVE" + self.CHAINS_CTE.format(seed="conversations") + """
+                SELECT c.id, c.title, c.model, c.created_at,
                        COUNT(m.id) as message_count
                 FROM conversations c
-                JOIN messages m ON c.id = m.conversation_id
+                JOIN chains ON chains.leaf = c.id
+                JOIN messages m ON m.conversation_id = chains.id
+                               AND (chains.upto IS NULL OR m.id <= chains.upto)
                 WHERE m.content LIKE ? OR c.title LIKE ?
                 GROUP BY c.id
                 ORDER BY c.updated_at DESC
@@ -123,44 +596,62 @@ class ConversationDB:
             return [dict(row) for row in cursor.fetchall()]
     
     def delete_conversation(self, conversation_id: int) -> bool:
-        with sqlite3.connect(self.db_path) as conn:
+        """Delete a conversation; refused (False) while branches still share its messages."""
+        with self._connect() as conn:
             cursor = conn.cursor()
             
+            cursor.execute("SELECT 1 FROM conversations WHERE parent_id = ? LIMIT 1", (conversation_id,))
+            if cursor.fetchone():
+                return False
+            
             cursor.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
             
             cursor.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,))
-            
-            return cursor.rowcount > 0
+            deleted = cursor.rowcount > 0
+        
+        if deleted:
+            self._forget_conversation(conversation_id)
+            for callback in self.on_conversation_deleted:
+                callback(conversation_id)
+        return deleted
     
     def get_conversation_info(self, conversation_id: int) -> Optional[Dict]:
-        with sqlite3.connect(self.db_path) as conn:
+        info = self._read_cache.get(("info", conversation_id), lambda: self._fetch_conversation_info(conversation_id))
+        return dict(info) if info else None
+    
+    def _fetch_conversation_info(self, conversation_id: int) -> Optional[Dict]:
+        with self._connect() as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             
-            cursor.execute("""
+            cursor.execute(self.ANCESTRY_CTE + """
                 SELECT c.*, COUNT(m.id) as message_count, 
                        ROUND(SUM(m.cost), 6) as total_cost
                 FROM conversations c
-                LEFT JOIN messages m ON c.id = m.conversation_id
+                JOIN chain
+                LEFT JOIN messages m ON m.conversation_id = chain.id
+                                    AND (chain.upto IS NULL OR m.id <= chain.upto)
                 WHERE c.id = ?
                 GROUP BY c.id
-            """, (conversation_id,))
+            """, (conversation_id, conversation_id))
             
             row = cursor.fetchone()
             return dict(row) if row else None
     
     def update_conversation_title(self, conversation_id: int, new_title: str) -> bool:
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect() as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 UPDATE conversations 
                 SET title = ?, updated_at = CURRENT_TIMESTAMP
                 WHERE id = ?
             """, (new_title, conversation_id))
-            return cursor.rowcount > 0
+            updated = cursor.rowcount > 0
+        self._read_cache.discard(("info", conversation_id), kinds=("list",))
+        return updated
     
     def get_stats(self) -> Dict:
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect() as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             
@@ -169,6 +660,9 @@ class ConversationDB:
                     COUNT(DISTINCT c.id) as total_conversations,
                     COUNT(m.id) as total_messages,
                     ROUND(SUM(m.cost), 6) as total_cost,
+                    SUM(m.prompt_tokens) as prompt_tokens,
+                    SUM(m.completion_tokens) as completion_tokens,
+                    SUM(m.cached_tokens) as cached_tokens,
                     COUNT(DISTINCT c.model) as models_used,
                     COUNT(DISTINCT c.prompt_id) as prompts_used
                 FROM conversations c
@@ -177,36 +671,174 @@ class ConversationDB:
             
             return dict(cursor.fetchone())
     
+    def get_daily_spend(self, model: Optional[str] = None) -> float:
+        """Cost recorded since midnight (UTC), optionally for one model."""
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            if model:
+                cursor.execute("""
+                    SELECT COALESCE(SUM(cost), 0) FROM messages
+                    WHERE timestamp >= date('now') AND model = ?
+                """, (model,))
+            else:
+                cursor.execute("""
+                    SELECT COALESCE(SUM(cost), 0) FROM messages
+                    WHERE timestamp >= date('now')
+                """)
+            return cursor.fetchone()[0] + self._daily_request_spend(conn, model)
+    
+    def _daily_request_spend(self, conn: sqlite3.Connection, model: Optional[str] = None) -> float:
+        """
+        Today's cost of requests that are not saved as messages. For one model every such
+        request counts (the message carrying an upload's total has no model); for the
+        overall total only those not yet carried by a saved message.
+        """
+        query = "SELECT COALESCE(SUM(cost), 0) FROM request_usage WHERE timestamp >= date('now')"
+        if model:
+            return conn.execute(query + " AND model = ?", (model,)).fetchone()[0]
+        return conn.execute(query + " AND conversation_id IS NULL").fetchone()[0]
+    
+    def record_request_usage(self, model: str, prompt_tokens: int, completion_tokens: int,
+                             cached_tokens: int, cost: float) -> int:
+        """Store the real cost of a request whose reply is not saved as a message; returns the row id."""
+        with self._connect() as conn:
+            return conn.execute("""
+                INSERT INTO request_usage (model, prompt_tokens, completion_tokens, cached_tokens, cost)
+                VALUES (?, ?, ?, ?, ?)
+            """, (model, prompt_tokens, completion_tokens, cached_tokens, cost)).lastrowid
+    
+    def assign_request_usage(self, usage_ids: List[int], conversation_id: int):
+        """Mark requests as carried by a message of this conversation, so their cost is not counted twice."""
+        with self._connect() as conn:
+            for start in range(0, len(usage_ids), 500):
+                batch = usage_ids[start:start + 500]
+                conn.execute(
+                    f"UPDATE request_usage SET conversation_id = ? WHERE id IN ({', '.join('?' for _ in batch)})",
+                    [conversation_id, *batch]
+                )
+    
+    def record_usage(self, model: str, prompt_chars: int, prompt_tokens: int, completion_tokens: int):
+        """Accumulate real usage per model for calibrating cost estimates."""
+        with self._connect() as conn:
+            conn.execute("""
+                INSERT INTO model_usage (model, requests, prompt_chars, prompt_tokens, completion_tokens)
+                VALUES (?, 1, ?, ?, ?)
+                ON CONFLICT(model) DO UPDATE SET
+                    requests = requests + 1,
+                    prompt_chars = prompt_chars + excluded.prompt_chars,
+                    prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                    completion_tokens = completion_tokens + excluded.completion_tokens
+            """, (model, prompt_chars, prompt_tokens, completion_tokens))
+    
+    def get_usage_calibration(self) -> Dict[str, Dict]:
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM model_usage")
+            return {row['model']: dict(row) for row in cursor.fetchall()}
+    
     def clean_duplicate_system_messages(self) -> int:
-        with sqlite3.connect(self.db_path) as conn:
+        """
+        Drop repeated system prompts. A conversation keeps its first system message
+        (the start of every request), its persona switches and its newest other one.
+        """
+        switch = (len(PERSONA_SWITCH_PREFIX), PERSONA_SWITCH_PREFIX)
+        with self._connect() as conn:
             cursor = conn.cursor()
             
             cursor.execute("""
-                SELECT conversation_id, COUNT(*) as system_count
+                SELECT conversation_id, MIN(id), MAX(id)
                 FROM messages 
-                WHERE role = 'system'
+                WHERE role = 'system' AND substr(content, 1, ?) != ?
                 GROUP BY conversation_id
-                HAVING COUNT(*) > 1
-            """)
+                HAVING COUNT(*) > 2
+            """, switch)
             
             affected_conversations = cursor.fetchall()
             total_deleted = 0
             
-            for conv_id, count in affected_conversations:
+            for conv_id, first_id, last_id in affected_conversations:
                 cursor.execute("""
                     DELETE FROM messages 
-                    WHERE conversation_id = ? AND role = 'system' 
-                    AND id NOT IN (
-                        SELECT id FROM messages 
-                        WHERE conversation_id = ? AND role = 'system'
-                        ORDER BY timestamp DESC 
-                        LIMIT 1
-                    )
-                """, (conv_id, conv_id))
+                    WHERE conversation_id = ? AND role = 'system'
+                    AND substr(content, 1, ?) != ?
+                    AND id NOT IN (?, ?)
+                """, (conv_id, *switch, first_id, last_id))
                 
                 deleted = cursor.rowcount
                 total_deleted += deleted
-                
-            return total_deleted
+        
+        # branches may have inherited the removed messages
+        self._read_cache.clear()
+        return total_deleted
+
+    def get_file_review_by_hash(self, content_hash: str, model: str, prompt_hash: str) -> Optional[Dict]:
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            
+            cursor.execute("""
+                SELECT * FROM file_reviews 
+                WHERE content_hash = ? AND model = ? AND prompt_hash = ?
+                ORDER BY id DESC
+                LIMIT 1
+            """, (content_hash, model, prompt_hash))
+            
+            row = cursor.fetchone()
+            return dict(row) if row else None
+    
+    def get_latest_file_review(self, path: str) -> Optional[Dict]:
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.cursor()
+            
+            cursor.execute("""
+                SELECT * FROM file_reviews 
+                WHERE path = ?
+                ORDER BY id DESC
+                LIMIT 1
+            """, (path,))
+            
+            row = cursor.fetchone()
+            return dict(row) if row else None
+    
+    def save_file_review(self, path: str, content_hash: str, model: str, 
+                         content: str, review: str, prompt_hash: str = "") -> int:
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO file_reviews (path, content_hash, model, content, review, prompt_hash)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (path, content_hash, model, content, review, prompt_hash))
+            return cursor.lastrowid
+    
+    def get_chunk_analyses(self, chunk_hashes: List[str], model: str) -> Dict[str, str]:
+        if not chunk_hashes:
+            return {}
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            placeholders = ", ".join("?" for _ in chunk_hashes)
+            cursor.execute(f"""
+                SELECT chunk_hash, analysis FROM chunk_analyses 
+                WHERE model = ? AND chunk_hash IN ({placeholders})
+            """, (model, *chunk_hashes))
+            return dict(cursor.fetchall())
+    
+    def save_chunk_analysis(self, chunk_hash: str, model: str, analysis: str):
+        with self._connect() as conn:
+            conn.execute("""
+                INSERT OR REPLACE INTO chunk_analyses (chunk_hash, model, analysis)
+                VALUES (?, ?, ?)
+            """, (chunk_hash, model, analysis))
+
+def create_conversation_db(db_path: str = "conversations.db") -> ConversationDB:
+    """ConversationDB, or the month-partitioned variant when CHATBOT_DB_PARTITIONS=monthly."""
+    mode = os.getenv("CHATBOT_DB_PARTITIONS", "").strip().lower()
+    if mode == "monthly":
+        from .partitions import PartitionedConversationDB
+        return PartitionedConversationDB(db_path)
+    if mode and mode not in ("off", "none"):
+        print(f"Warning: Unknown CHATBOT_DB_PARTITIONS value '{mode}', using a single database file")
+    return ConversationDB(db_path)
 
-conversation_db = ConversationDB()
+conversation_db = create_conversation_db(os.getenv("CHATBOT_DB_PATH", "conversations.db"))
@@ -0,0 +1,467 @@
+import ast
+import difflib
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional
+
+from .chatbot import (
+    ask_within_budget, estimate_cost, load_system_prompt, get_current_model, get_upload_settings
+)
+from .database import conversation_db
+from .ingest import ingest_file
+
+CHARS_PER_TOKEN = 4
+CHUNK_TOKENS = 3000
+CHUNK_CHARS = CHUNK_TOKENS * CHARS_PER_TOKEN
+MAX_WORKERS = 4
+REQUESTS_PER_MINUTE = 60
+# Send only a diff when it is at most this fraction of the full content
+DIFF_RATIO_LIMIT = 0.5
+
+SINGLE_PROMPTS = {
+    ".py": "Here is my Python code:\n\n{content}\n\nCan you review it and suggest improvements?",
+    ".txt": "Here is a document:\n\n{content}\n\nSummarize the main points.",
+}
+
+DIFF_PROMPTS = {
+    ".py": ("I previously shared the Python file '{name}' and you reviewed it:\n\n{review}\n\n"
+            "The file has changed since then. Here is the unified diff:\n\n```diff\n{diff}\n```\n\n"
+            "Update the review for the new version: drop points the change resolves, keep the ones "
+            "still valid and review the new code."),
+    ".txt": ("I previously shared the document '{name}' and you summarized it:\n\n{review}\n\n"
+             "The document has changed since then. Here is the unified diff:\n\n```diff\n{diff}\n```\n\n"
+             "Update the summary of the main points for the new version."),
+}
+
+MAP_PROMPTS = {
+    ".py": ("This is part {index} of {total} of the Python file '{name}' ({location}).\n\n"
+            "```python\n{text}\n```\n\n"
+            "Review this part: list bugs, risky code and concrete improvements. Be concise."),
+    ".txt": ("This is part {index} of {total} of the document '{name}' ({location}).\n\n"
+             "{text}\n\n"
+             "Summarize the main points of this part in a few bullet points."),
+}
+
+REDUCE_PROMPTS = {
+    ".py": ("Below are reviews of consecutive parts of the Python file '{name}'.\n\n{partials}\n\n"
+            "Combine them into one code review: remove duplicates, group related issues and "
+            "order the suggestions by importance."),
+    ".txt": ("Below are summaries of consecutive parts of the document '{name}'.\n\n{partials}\n\n"
+             "Combine them into one summary of the main points of the whole document."),
+    "batch": ("Below are reviews of groups of files uploaded from '{name}'.\n\n{partials}\n\n"
+              "Combine them into one report: a short section per file, then the cross-cutting "
+              "issues and the most important recommendations for the whole set."),
+}
+
+
+def ingest_upload(path: str) -> Dict:
+    """Stream an uploaded file in with the configured limits (see app/ingest.py)."""
+    settings = get_upload_settings()
+    return ingest_file(path, settings.get("max_bytes", 0), settings.get("max_tokens", 0),
+                       settings.get("compress", True))
+
+
+def read_file_text(path: str) -> str:
+    return ingest_upload(path)["text"]
+
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def chunk_hash(chunk: Dict, ext: str, system_prompt: str = "") -> str:
+    """Cached analyses are only reused under the same system prompt (persona)."""
+    return content_hash(f"{system_prompt}\0{ext}\0{chunk['text']}")
+
+
+def is_usable_reply(reply: str) -> bool:
+    return bool(reply) and not reply.startswith("Error:")
+
+
+def needs_chunking(content: str, chunk_chars: int = CHUNK_CHARS) -> bool:
+    return len(content) > chunk_chars
+
+
+def _make_chunk(lines: List[str], start: int, end: int, label: str) -> Dict:
+    return {
+        "label": label,
+        "start_line": start,
+        "end_line": end,
+        "text": "".join(lines[start - 1:end]),
+    }
+
+
+def _split_lines(lines: List[str], start: int, end: int, max_chars: int, label: str) -> List[Dict]:
+    """Fallback: split a line range into pieces of at most max_chars."""
+    chunks = []
+    chunk_start = start
+    size = 0
+    for lineno in range(start, end + 1):
+        line_len = len(lines[lineno - 1])
+        if size and size + line_len > max_chars:
+            chunks.append(_make_chunk(lines, chunk_start, lineno - 1, label))
+            chunk_start = lineno
+            size = 0
+        size += line_len
+    if chunk_start <= end:
+        chunks.append(_make_chunk(lines, chunk_start, end, label))
+    return chunks
+
+
+def _node_span(node: ast.AST) -> tuple:
+    start = node.lineno
+    for decorator in getattr(node, "decorator_list", []):
+        start = min(start, decorator.lineno)
+    return start, node.end_lineno
+
+
+def _node_label(node: ast.AST) -> str:
+    if isinstance(node, ast.ClassDef):
+        return f"class {node.name}"
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+        return f"def {node.name}"
+    return "module code"
+
+
+def _split_nodes(nodes: List[ast.AST], lines: List[str], first: int, last: int,
+                 max_chars: int, prefix: str = "") -> List[Dict]:
+    """Group consecutive AST nodes into chunks, splitting oversized classes by method."""
+    spans = []
+    cursor = first
+    for node in nodes:
+        start, end = _node_span(node)
+        if start > cursor:
+            # comments or blank lines before the node travel with it
+            start = cursor
+        spans.append((start, end, node))
+        cursor = end + 1
+    if spans and last > spans[-1][1]:
+        start, _, node = spans[-1]
+        spans[-1] = (start, last, node)
+
+    chunks = []
+    group = []
+    group_size = 0
+
+    def flush():
+        nonlocal group, group_size
+        if group:
+            labels = ", ".join(dict.fromkeys(label for _, _, label in group))
+            chunks.append(_make_chunk(lines, group[0][0], group[-1][1], labels))
+        group = []
+        group_size = 0
+
+    for start, end, node in spans:
+        label = prefix + _node_label(node)
+        size = sum(len(lines[i - 1]) for i in range(start, end + 1))
+        if size > max_chars:
+            flush()
+            body = getattr(node, "body", None)
+            if isinstance(node, ast.ClassDef) and body:
+                # the class header travels with its first methods
+                chunks.extend(_split_nodes(body, lines, start, end, max_chars, f"{label}."))
+            else:
+                chunks.extend(_split_lines(lines, start, end, max_chars, label))
+            continue
+        if group_size and group_size + size > max_chars:
+            flush()
+        group.append((start, end, label))
+        group_size += size
+    flush()
+    return chunks
+
+
+def split_python_source(text: str, max_chars: int = CHUNK_CHARS) -> List[Dict]:
+    """Split Python source on top-level function and class boundaries."""
+    try:
+        tree = ast.parse(text)
+    except SyntaxError:
+        return split_text(text, max_chars)
+
+    lines = text.splitlines(keepends=True)
+    if not tree.body:
+        return split_text(text, max_chars)
+    return _split_nodes(tree.body, lines, 1, len(lines), max_chars)
+
+
+def split_text(text: str, max_chars: int = CHUNK_CHARS) -> List[Dict]:
+    """Split plain text on paragraph boundaries (blank lines)."""
+    lines = text.splitlines(keepends=True)
+    chunks = []
+    chunk_start = 1
+    size = 0
+    paragraph_start = 1
+
+    def paragraph_end(lineno: int) -> bool:
+        return lineno == len(lines) or not lines[lineno].strip()
+
+    for lineno in range(1, len(lines) + 1):
+        if not paragraph_end(lineno):
+            continue
+        paragraph_size = sum(len(lines[i - 1]) for i in range(paragraph_start, lineno + 1))
+        if paragraph_size > max_chars:
+            if size:
+                chunks.append(_make_chunk(lines, chunk_start, paragraph_start - 1, "paragraphs"))
+            chunks.extend(_split_lines(lines, paragraph_start, lineno, max_chars, "paragraph"))
+            chunk_start = lineno + 1
+            size = 0
+        elif size and size + paragraph_size > max_chars:
+            chunks.append(_make_chunk(lines, chunk_start, paragraph_start - 1, "paragraphs"))
+            chunk_start = paragraph_start
+            size = paragraph_size
+        else:
+            size += paragraph_size
+        paragraph_start = lineno + 1
+
+    if chunk_start <= len(lines):
+        chunks.append(_make_chunk(lines, chunk_start, len(lines), "paragraphs"))
+    return [chunk for chunk in chunks if chunk["text"].strip()]
+
+
+def split_content(content: str, ext: str, max_chars: int = CHUNK_CHARS) -> List[Dict]:
+    if ext == ".py":
+        return split_python_source(content, max_chars)
+    return split_text(content, max_chars)
+
+
+def gather_results(futures: Dict, results: List):
+    """
+    Store each finished request's result at its index. On the first failure (such as a
+    refused budget) the requests not started yet are cancelled, so they are never sent.
+    """
+    try:
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+    except Exception:
+        for future in futures:
+            future.cancel()
+        raise
+
+
+class RateLimiter:
+    """Spaces out request starts so at most `per_minute` begin each minute."""
+
+    def __init__(self, per_minute: int = REQUESTS_PER_MINUTE):
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def analyze_chunks(chunks: List[Dict], name: str, ext: str, model: Optional[str] = None,
+                   max_workers: int = MAX_WORKERS, requests_per_minute: int = REQUESTS_PER_MINUTE,
+                   progress: Callable[[str], None] = print, usage_log: Optional[List[Dict]] = None) -> Dict:
+    """
+    Map step: analyze every chunk concurrently within the rate limit.
+    Returns partial results in file order plus their accumulated real cost.
+    Each analysis is cached under the model that actually answered it.
+    """
+    template = MAP_PROMPTS.get(ext, MAP_PROMPTS[".txt"])
+    system_prompt = load_system_prompt()
+    limiter = RateLimiter(requests_per_minute)
+    lock = threading.Lock()
+    state = {"done": 0, "cost": 0.0}
+    partials = [None] * len(chunks)
+
+    model_id = model or get_current_model()['id']
+    hashes = [chunk_hash(chunk, ext, system_prompt) for chunk in chunks]
+    cached = conversation_db.get_chunk_analyses(list(set(hashes)), model_id)
+    pending = []
+    for i, digest in enumerate(hashes):
+        if digest in cached:
+            partials[i] = cached[digest]
+        else:
+            pending.append(i)
+    if cached:
+        progress(f"♻️  Reusing cached analysis for {len(chunks) - len(pending)}/{len(chunks)} unchanged parts")
+
+    def analyze(index: int, chunk: Dict) -> str:
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": template.format(
+                index=index + 1, total=len(chunks), name=name,
+                location=f"lines {chunk['start_line']}-{chunk['end_line']}, {chunk['label']}",
+                text=chunk["text"]
+            )}
+        ]
+        limiter.wait()
+        result = ask_within_budget(messages, model, usage_log=usage_log)
+        reply = result["reply"]
+        usable = is_usable_reply(reply)
+        if usable:
+            conversation_db.save_chunk_analysis(hashes[index], result["model"], reply)
+        with lock:
+            state["done"] += 1
+            state["cost"] += result["usage"]["cost"]
+            outcome = "analyzed" if usable else f"failed ({reply})"
+            progress(f"📦 Part {state['done']}/{len(pending)} {outcome} "
+                     f"(lines {chunk['start_line']}-{chunk['end_line']}) | 💰 ${state['cost']:.6f} so far")
+        return reply
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(analyze, i, chunks[i]): i for i in pending}
+        gather_results(futures, partials)
+
+    return {"partials": partials, "cost": state["cost"]}
+
+
+def _send(messages: List[Dict], model: Optional[str], stream: bool, usage_log: Optional[List[Dict]] = None) -> str:
+    """Stream the reply to the terminal, or (inside a larger job) just return it."""
+    return ask_within_budget(messages, model, stream, usage_log)["reply"]
+
+
+def reduce_partials(partials: List[str], titles: List[str], name: str, ext: str,
+                    model: Optional[str] = None, max_chars: int = CHUNK_CHARS,
+                    progress: Callable[[str], None] = print, stream: bool = True,
+                    usage_log: Optional[List[Dict]] = None) -> Dict:
+    """
+    Reduce step: merge partial results, in rounds if they do not fit in one prompt.
+    Failed partial results ("Error: ..." replies) are left out. The final merge
+    is streamed to the terminal unless stream is False. Returns the reply and the
+    real cost of the merges.
+    """
+    template = REDUCE_PROMPTS.get(ext, REDUCE_PROMPTS[".txt"])
+    system_prompt = load_system_prompt()
+    sections = [f"### {title}\n{partial}" for title, partial in zip(titles, partials) if is_usable_reply(partial)]
+    cost = 0.0
+    if len(sections) < len(partials):
+        progress(f"⚠️  Leaving out {len(partials) - len(sections)} of {len(partials)} parts whose analysis failed")
+    if not sections:
+        return {"reply": "Error: no part could be analyzed", "cost": cost}
+
+    while sum(len(section) for section in sections) > max_chars and len(sections) > 1:
+        groups = []
+        group = []
+        for section in sections:
+            if group and sum(len(s) for s in group) + len(section) > max_chars:
+                groups.append(group)
+                group = []
+            group.append(section)
+        groups.append(group)
+        if len(groups) == len(sections):
+            break
+        progress(f"🔁 Merging {len(sections)} partial results in {len(groups)} groups...")
+        merged = []
+        for i, group in enumerate(groups):
+            messages = [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": template.format(name=name, partials="\n\n".join(group))}
+            ]
+            result = ask_within_budget(messages, model, usage_log=usage_log)
+            cost += result["usage"]["cost"]
+            reply = result["reply"]
+            if is_usable_reply(reply):
+                merged.append(f"### Merged group {i + 1}\n{reply}")
+            else:
+                progress(f"⚠️  Merging group {i + 1} failed ({reply}), keeping its parts unmerged")
+                merged.extend(group)
+        if len(merged) >= len(sections):
+            break
+        sections = merged
+
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": template.format(name=name, partials="\n\n".join(sections))}
+    ]
+    result = ask_within_budget(messages, model, stream, usage_log)
+    return {"reply": result["reply"], "cost": cost + result["usage"]["cost"]}
+
+
+def analyze_file_chunked(path: str, content: str, model: Optional[str] = None,
+                         chunk_chars: int = CHUNK_CHARS, max_workers: int = MAX_WORKERS,
+                         requests_per_minute: int = REQUESTS_PER_MINUTE,
+                         progress: Callable[[str], None] = print, stream: bool = True,
+                         usage_log: Optional[List[Dict]] = None) -> str:
+    """Analyze a large file with a chunked map-reduce pipeline and return the combined review."""
+    ext = os.path.splitext(path)[1].lower()
+    name = os.path.basename(path)
+    chunks = split_content(content, ext, chunk_chars)
+    progress(f"✂️  Split '{name}' into {len(chunks)} parts (~{chunk_chars // CHARS_PER_TOKEN} tokens each)")
+
+    mapped = analyze_chunks(chunks, name, ext, model, max_workers, requests_per_minute, progress, usage_log)
+    progress("🧩 Combining partial results...\n")
+    titles = [
+        f"Part {i + 1} (lines {chunk['start_line']}-{chunk['end_line']}, {chunk['label']})"
+        for i, chunk in enumerate(chunks)
+    ]
+    reduced = reduce_partials(mapped["partials"], titles, name, ext, model, chunk_chars, progress, stream, usage_log)
+
+    progress(f"💰 Total cost: ${mapped['cost'] + reduced['cost']:.6f}")
+    return reduced["reply"]
+
+
+def _single_prompt(prompt: str, model: Optional[str], progress: Callable[[str], None], stream: bool,
+                   usage_log: Optional[List[Dict]] = None) -> str:
+    messages = [
+        {"role": "system", "content": load_system_prompt()},
+        {"role": "user", "content": prompt}
+    ]
+    progress(f"💰 Estimated cost: ${estimate_cost(messages, model)['total']:.6f}")
+    return _send(messages, model, stream, usage_log)
+
+
+def review_file(path: str, content: str, model: Optional[str] = None,
+                progress: Callable[[str], None] = print, stream: bool = True,
+                usage_log: Optional[List[Dict]] = None) -> str:
+    """
+    Review or summarize an uploaded file, reusing earlier work where possible:
+    identical content returns the cached review, a changed file sends only the
+    diff against its last review, and large files reuse cached chunk analyses.
+    Reviews are only reused for the same model and system prompt (persona), and
+    a review the budget downgraded to another model is stored under that model.
+    With stream=False (a file inside a batch upload) nothing is printed as it arrives.
+    usage_log, if given, receives the usage of every request made.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    name = os.path.basename(path)
+    abs_path = os.path.abspath(path)
+    model_id = model or get_current_model()['id']
+    digest = content_hash(content)
+    prompt_hash = content_hash(load_system_prompt())
+
+    cached = conversation_db.get_file_review_by_hash(digest, model_id, prompt_hash)
+    if cached:
+        progress(f"♻️  '{name}' is unchanged since its review on {cached['created_at'][:16]}, reusing it (no cost)")
+        if cached['path'] != abs_path:
+            conversation_db.save_file_review(abs_path, digest, model_id, content, cached['review'], prompt_hash)
+        return cached['review']
+
+    reply = ""
+    requests = []
+    previous = conversation_db.get_latest_file_review(abs_path)
+    if previous and previous['model'] == model_id and previous['prompt_hash'] == prompt_hash:
+        diff = "".join(difflib.unified_diff(
+            previous['content'].splitlines(keepends=True), content.splitlines(keepends=True),
+            fromfile=f"{name} (last review)", tofile=name
+        ))
+        if len(diff) <= len(content) * DIFF_RATIO_LIMIT and not needs_chunking(diff + previous['review']):
+            progress(f"🔀 '{name}' changed since its last review, sending only the diff ({len(diff):,} characters)")
+            template = DIFF_PROMPTS.get(ext, DIFF_PROMPTS[".txt"])
+            reply = _single_prompt(
+                template.format(name=name, review=previous['review'], diff=diff), model, progress, stream, requests
+            )
+
+    if not reply:
+        if needs_chunking(content):
+            progress(f"\n📚 Large file detected ({len(content):,} characters), analyzing in parts...")
+            reply = analyze_file_chunked(path, content, model, progress=progress, stream=stream, usage_log=requests)
+        else:
+            template = SINGLE_PROMPTS.get(ext, SINGLE_PROMPTS[".txt"])
+            reply = _single_prompt(template.format(content=content), model, progress, stream, requests)
+
+    if usage_log is not None:
+        usage_log.extend(requests)
+    answered_by = {usage["model"] for usage in requests}
+    if is_usable_reply(reply) and len(answered_by) == 1:
+        conversation_db.save_file_review(abs_path, digest, answered_by.pop(), content, reply, prompt_hash)
+    return reply
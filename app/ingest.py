@@ -0,0 +1,205 @@
+"""
+Upload ingestion: stream a file in, decode it and drop low-value content.
+
+ingest_file reads an uploaded file in fixed-size blocks instead of loading
+it whole. The first bytes decide the encoding (BOM, a Python coding cookie,
+valid UTF-8, else cp1252) and reject binary files. Lines pass through an
+incremental decoder and a compressor that:
+    - in text files (not source code), keeps the first and last of a run of
+      similar lines (equal once digits and hex ids are masked, as in repeated
+      log lines; indentation must match) and replaces the rest with one
+      marker line,
+    - shortens long unbroken runs of generated data (base64, hashes, minified
+      blobs) to their first characters.
+Size (bytes on disk) and token ceilings are checked while reading, so an
+oversized upload is rejected before it is fully read or anything is sent.
+"""
+import codecs
+import os
+import re
+from typing import Dict, List, Optional
+
+from .messages import CHARS_PER_TOKEN
+
+BLOCK_SIZE = 64 * 1024
+SNIFF_BYTES = 8 * 1024
+MAX_BYTES = 10_000_000
+MAX_TOKENS = 200_000
+FALLBACK_ENCODINGS = ("cp1252", "latin-1")
+# a run of this many similar lines is collapsed to its first and last line
+REPEAT_MIN = 4
+GENERATED_RUN_CHARS = 200
+GENERATED_KEEP_CHARS = 40
+
+BOMS = (
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+CODING_COOKIE = re.compile(rb"^[ \t\f]*#.*?coding[:=][ \t]*([-\w.]+)")
+GENERATED_HEADER = re.compile(r"@generated|do not edit|auto-?generated", re.IGNORECASE)
+GENERATED_RUN = re.compile(rf"[A-Za-z0-9+/=_\-]{{{GENERATED_RUN_CHARS},}}")
+VARIABLE_PARTS = re.compile(r"0x[0-9a-fA-F]+|[0-9a-fA-F]{8,}|\d+")
+TEXT_CONTROL_BYTES = set(b"\t\n\r\f\b\x1b")
+
+
+class IngestError(ValueError):
+    """Raised when an upload is binary or over the configured limits."""
+
+
+def sniff_encoding(sample: bytes, ext: str = "") -> Optional[str]:
+    """Encoding of a file from its first bytes, or None if it looks binary."""
+    for bom, encoding in BOMS:
+        if sample.startswith(bom):
+            return encoding
+    if b"\0" in sample:
+        return None
+    if sample:
+        control = sum(1 for byte in sample if byte < 32 and byte not in TEXT_CONTROL_BYTES)
+        if control / len(sample) > 0.3:
+            return None
+    if ext == ".py":
+        for line in sample.split(b"\n", 2)[:2]:
+            match = CODING_COOKIE.match(line)
+            if match:
+                try:
+                    return codecs.lookup(match.group(1).decode("ascii")).name
+                except LookupError:
+                    break
+    try:
+        # final=False: the sample may end in the middle of a multi-byte character
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        return FALLBACK_ENCODINGS[0]
+
+
+class LineCompressor:
+    """
+    Collects decoded lines, shortening generated blobs. Runs of similar lines are
+    collapsed only in text: in source code they are distinct statements.
+    """
+
+    def __init__(self, source: bool = False, enabled: bool = True):
+        self.source = source
+        self.enabled = enabled
+        self.lines: List[str] = []
+        self.chars = 0
+        self.omitted_lines = 0
+        self.omitted_chars = 0
+        self._key: Optional[str] = None
+        self._run: List[str] = []  # lines after the first of the current run; only the last is kept once it is long
+        self._run_length = 0
+
+    def _emit(self, line: str):
+        self.lines.append(line)
+        self.chars += len(line)
+
+    def _shorten(self, match: re.Match) -> str:
+        omitted = len(match.group()) - GENERATED_KEEP_CHARS
+        self.omitted_chars += omitted
+        return f"{match.group()[:GENERATED_KEEP_CHARS]}…[{omitted:,} characters omitted]"
+
+    def _flush_run(self):
+        if self._run_length + 1 >= REPEAT_MIN:
+            omitted = self._run_length - 1
+            self.omitted_lines += omitted
+            self._emit(f"[... {omitted} similar lines omitted ...]\n")
+            self._emit(self._run[-1])
+        else:
+            for line in self._run:
+                self._emit(line)
+        self._run = []
+        self._run_length = 0
+
+    def add(self, line: str):
+        if not self.enabled:
+            self._emit(line)
+            return
+        if len(line) > GENERATED_RUN_CHARS:
+            line = GENERATED_RUN.sub(self._shorten, line)
+        # leading whitespace stays in the key: differently indented lines are not a run
+        key = VARIABLE_PARTS.sub("0", line.rstrip()) if line.strip() and not self.source else None
+        if key is not None and key == self._key:
+            self._run_length += 1
+            if len(self._run) < REPEAT_MIN:
+                self._run.append(line)
+            else:
+                self._run[-1] = line
+            return
+        self._flush_run()
+        self._key = key
+        self._emit(line)
+
+    def close(self) -> str:
+        self._flush_run()
+        return "".join(self.lines)
+
+
+def _read_lines(f, sample: bytes, encoding: str, compressor: LineCompressor, max_bytes: int,
+                max_tokens: int, name: str, block_size: int) -> int:
+    """Decode the stream block by block into the compressor; returns the bytes read."""
+    decoder = codecs.getincrementaldecoder(encoding)()
+    pending = ""
+    size = 0
+    data = sample
+    while True:
+        size += len(data)
+        if max_bytes and size > max_bytes:
+            raise IngestError(f"'{name}' is over the {max_bytes:,}-byte upload limit")
+        text = pending + decoder.decode(data, final=not data)
+        lines = text.split("\n")
+        pending = lines.pop()
+        for line in lines:
+            compressor.add(line.rstrip("\r") + "\n")
+        if max_tokens and compressor.chars > max_tokens * CHARS_PER_TOKEN:
+            raise IngestError(f"'{name}' is over the {max_tokens:,}-token upload limit "
+                              f"(~{compressor.chars // CHARS_PER_TOKEN:,} tokens read so far)")
+        if not data:
+            break
+        data = f.read(block_size)
+    if pending:
+        compressor.add(pending.rstrip("\r"))
+    return size
+
+
+def ingest_file(path: str, max_bytes: int = MAX_BYTES, max_tokens: int = MAX_TOKENS,
+                compress: bool = True, block_size: int = BLOCK_SIZE) -> Dict:
+    """
+    Read an upload within the limits (0 disables a limit). Returns the text plus
+    what was done to it: encoding, bytes, tokens, omitted lines and characters,
+    and whether the file declares itself generated. Raises IngestError.
+    """
+    name = os.path.basename(path)
+    size = os.path.getsize(path)
+    if max_bytes and size > max_bytes:
+        raise IngestError(f"'{name}' is {size:,} bytes, over the {max_bytes:,}-byte upload limit")
+
+    ext = os.path.splitext(path)[1].lower()
+    with open(path, "rb") as f:
+        sample = f.read(SNIFF_BYTES)
+        sniffed = sniff_encoding(sample, ext)
+        if sniffed is None:
+            raise IngestError(f"'{name}' looks like a binary file")
+        for encoding in dict.fromkeys((sniffed,) + FALLBACK_ENCODINGS):
+            compressor = LineCompressor(source=ext == ".py", enabled=compress)
+            try:
+                size = _read_lines(f, sample, encoding, compressor, max_bytes, max_tokens, name, block_size)
+                break
+            except UnicodeDecodeError:
+                # the sniffed encoding was wrong further into the file: read it again with the next one
+                f.seek(len(sample))
+
+    text = compressor.close()
+    head = "".join(compressor.lines[:5])
+    return {
+        "text": text,
+        "encoding": encoding,
+        "bytes": size,
+        "tokens": len(text) // CHARS_PER_TOKEN,
+        "omitted_lines": compressor.omitted_lines,
+        "omitted_chars": compressor.omitted_chars,
+        "generated": bool(GENERATED_HEADER.search(head)),
+    }
@@ -0,0 +1,196 @@
+import hashlib
+import sys
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+CHARS_PER_TOKEN = 4
+PERSONA_SWITCH_PREFIX = "From now on, follow these instructions instead of the earlier ones:\n\n"
+
+
+class Message:
+    """
+    A chat message with an interned role and lazily cached token count and
+    content hash. Supports msg["role"] / msg["content"] so code written for
+    the old dict messages keeps working.
+    """
+
+    __slots__ = ("role", "content", "_tokens", "_hash")
+
+    def __init__(self, role: str, content: str):
+        self.role = sys.intern(role)
+        self.content = content
+        self._tokens = None
+        self._hash = None
+
+    @property
+    def tokens(self) -> int:
+        if self._tokens is None:
+            self._tokens = -(-len(self.content) // CHARS_PER_TOKEN)
+        return self._tokens
+
+    @property
+    def content_hash(self) -> str:
+        if self._hash is None:
+            self._hash = hashlib.blake2b(self.content.encode("utf-8"), digest_size=16).hexdigest()
+        return self._hash
+
+    def __getitem__(self, key: str) -> str:
+        if key == "role":
+            return self.role
+        if key == "content":
+            return self.content
+        raise KeyError(key)
+
+    def get(self, key: str, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def to_dict(self) -> Dict[str, str]:
+        return {"role": self.role, "content": self.content}
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, Message):
+            return self.role == other.role and self.content == other.content
+        if isinstance(other, dict):
+            return other == self.to_dict()
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        preview = self.content if len(self.content) <= 40 else self.content[:37] + "..."
+        return f"Message({self.role!r}, {preview!r})"
+
+
+MessageLike = Union[Message, Dict[str, str]]
+
+
+def as_message(message: MessageLike) -> Message:
+    if isinstance(message, Message):
+        return message
+    return Message(message["role"], message["content"])
+
+
+class History:
+    """
+    Append-only-friendly list of Messages. Keeps a running character total so
+    cost estimates do not rescan the history. The API payload is built the
+    first time it is needed and then kept in step with every change, so each
+    turn only adds its own messages to it; a history that is never sent
+    never builds one.
+    """
+
+    __slots__ = ("_messages", "_chars", "_payload")
+
+    def __init__(self, messages: Iterable[MessageLike] = ()):
+        self._messages: List[Message] = [as_message(message) for message in messages]
+        self._chars = sum(len(message.content) for message in self._messages)
+        self._payload: Optional[List[Dict[str, str]]] = None
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Tuple[str, str]]) -> "History":
+        """Build from (role, content) tuples, e.g. straight from a database cursor."""
+        history = cls()
+        history._messages = [Message(role, content) for role, content in rows]
+        history._chars = sum(len(message.content) for message in history._messages)
+        return history
+
+    def append(self, message: MessageLike):
+        message = as_message(message)
+        self._messages.append(message)
+        self._chars += len(message.content)
+        if self._payload is not None:
+            self._payload.append(message.to_dict())
+
+    def add(self, role: str, content: str) -> Message:
+        message = Message(role, content)
+        self.append(message)
+        return message
+
+    def extend(self, messages: Iterable[MessageLike]):
+        for message in messages:
+            self.append(message)
+
+    def pop(self) -> Message:
+        message = self._messages.pop()
+        self._chars -= len(message.content)
+        if self._payload is not None:
+            self._payload.pop()
+        return message
+
+    def __setitem__(self, index: int, message: MessageLike):
+        message = as_message(message)
+        index = range(len(self._messages))[index]
+        self._chars += len(message.content) - len(self._messages[index].content)
+        self._messages[index] = message
+        if self._payload is not None:
+            self._payload[index] = message.to_dict()
+
+    def __getitem__(self, index):
+        return self._messages[index]
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def __iter__(self) -> Iterator[Message]:
+        return iter(self._messages)
+
+    def __add__(self, other: Iterable[MessageLike]) -> "History":
+        history = History(self._messages)
+        history.extend(other)
+        return history
+
+    @property
+    def total_chars(self) -> int:
+        return self._chars
+
+    @property
+    def total_tokens(self) -> int:
+        return sum(message.tokens for message in self._messages)
+
+    def payload(self) -> List[Dict[str, str]]:
+        """
+        The history as API message dicts (sharing the content strings). The same
+        list is returned every time and updated in place: treat it as read-only.
+        """
+        if self._payload is None:
+            self._payload = [message.to_dict() for message in self._messages]
+        return self._payload
+
+    def set_system_prompt(self, content: str) -> Optional[str]:
+        """
+        Make content the active system prompt. Before the first turn the leading
+        system message is replaced; after that the new prompt is appended, so the
+        part of the conversation already sent (and cached by the provider) stays
+        byte-identical. Returns "replaced", "appended", or None if already active.
+        """
+        active = self.last("system")
+        if active is not None and active.content in (content, PERSONA_SWITCH_PREFIX + content):
+            return None
+        if all(message.role == "system" for message in self._messages):
+            if self._messages:
+                self[0] = Message("system", content)
+            else:
+                self.add("system", content)
+            return "replaced"
+        self.add("system", PERSONA_SWITCH_PREFIX + content)
+        return "appended"
+
+    def last(self, role: Optional[str] = None) -> Optional[Message]:
+        for message in reversed(self._messages):
+            if role is None or message.role == role:
+                return message
+        return None
+
+
+def to_payload(messages: Iterable[MessageLike]) -> List[Dict[str, str]]:
+    if isinstance(messages, History):
+        return messages.payload()
+    if isinstance(messages, list) and all(isinstance(message, dict) for message in messages):
+        return messages
+    return [message.to_dict() if isinstance(message, Message) else message for message in messages]
+
+
+def total_chars(messages: Iterable[MessageLike]) -> int:
+    if isinstance(messages, History):
+        return messages.total_chars
+    return sum(len(message["content"]) for message in messages)
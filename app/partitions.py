@@ -0,0 +1,602 @@
+"""
+Month-partitioned message storage for ConversationDB.
+
+Conversations, reviews and usage totals stay in the main database file.
+Messages go to one SQLite file per month (conversations-partitions/messages-2025-01.db),
+ATTACHed to a connection only when a query needs that month. Only the
+current month is writable; older months are switched out of WAL mode once
+("sealed") and attached read-only, so each can be backed up a single time.
+
+Message ids come from a sequence in the main file, so they stay unique and
+ordered across partitions. Each conversation keeps its message count, cost and
+token totals, and the list of partitions holding its messages. So listing
+recent conversations, loading one, forking and daily spend never scan old
+months. Search and the retrieval index walk every partition.
+
+Messages stored before partitioning was enabled remain in the main file's
+messages table and are read as the oldest partition. Deleting a conversation
+removes its rows from writable partitions. Rows in sealed months become
+unreachable and are skipped, because every read goes through the conversations
+table.
+"""
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.request import pathname2url
+
+from .database import READ_CACHE_SIZE, ConversationDB
+from .messages import PERSONA_SWITCH_PREFIX
+
+LEGACY = "main"
+MAX_ATTACHED = 8  # SQLite's default limit is 10 attached databases per connection
+MESSAGE_COLUMNS = ("role", "content", "timestamp", "tokens_used", "cost",
+                   "prompt_tokens", "completion_tokens", "model", "cached_tokens")
+# columns added to the partition schema after its first release
+PARTITION_MIGRATIONS = {"cached_tokens": "INTEGER DEFAULT 0"}
+
+
+def current_month() -> str:
+    """Partition for new messages; UTC, like CURRENT_TIMESTAMP."""
+    return datetime.now(timezone.utc).strftime("%Y-%m")
+
+
+def _uri(path: str, read_only: bool = False) -> str:
+    uri = "file:" + pathname2url(os.path.abspath(path))
+    return uri + "?mode=ro" if read_only else uri
+
+
+class PartitionedConversationDB(ConversationDB):
+
+    def __init__(self, db_path: str = "conversations.db", pool_size: int = 8,
+                 partition_dir: Optional[str] = None, read_cache_size: int = READ_CACHE_SIZE):
+        if db_path == ":memory:":
+            raise ValueError("Partitioned storage needs a database file")
+        self.partition_dir = partition_dir or f"{os.path.splitext(db_path)[0]}-partitions"
+        self._sealed = set()
+        self._seal_lock = threading.Lock()
+        super().__init__(db_path, pool_size, read_cache_size)
+
+    def _open_connection(self) -> sqlite3.Connection:
+        # URI filenames, so read-only partitions can be attached with mode=ro
+        return sqlite3.connect(_uri(self.db_path), uri=True, timeout=30, check_same_thread=False)
+
+    def init_database(self):
+        super().init_database()
+        with self._connect() as conn:
+            existing = {row[1] for row in conn.execute("PRAGMA table_info(conversations)")}
+            self._add_missing_columns(conn, "conversations", {
+                "message_count": "INTEGER DEFAULT 0",
+                "total_cost": "REAL DEFAULT 0.0",
+                "prompt_tokens": "INTEGER DEFAULT 0",
+                "completion_tokens": "INTEGER DEFAULT 0",
+                "cached_tokens": "INTEGER DEFAULT 0",
+                "last_message_id": "INTEGER"
+            })
+
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS message_partitions (
+                    name TEXT PRIMARY KEY,
+                    first_id INTEGER NOT NULL,
+                    sealed INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS conversation_partitions (
+                    conversation_id INTEGER NOT NULL,
+                    partition TEXT NOT NULL,
+                    PRIMARY KEY (conversation_id, partition)
+                ) WITHOUT ROWID
+            """)
+
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS message_sequence (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    value INTEGER NOT NULL
+                )
+            """)
+
+            if "message_count" not in existing:
+                # First start with partitioning: summarize the messages already in the main file
+                conn.execute("""
+                    UPDATE conversations SET
+                        message_count = (SELECT COUNT(*) FROM messages m WHERE m.conversation_id = conversations.id),
+                        total_cost = (SELECT COALESCE(SUM(cost), 0) FROM messages m WHERE m.conversation_id = conversations.id),
+                        prompt_tokens = (SELECT COALESCE(SUM(prompt_tokens), 0) FROM messages m WHERE m.conversation_id = conversations.id),
+                        completion_tokens = (SELECT COALESCE(SUM(completion_tokens), 0) FROM messages m WHERE m.conversation_id = conversations.id),
+                        cached_tokens = (SELECT COALESCE(SUM(cached_tokens), 0) FROM messages m WHERE m.conversation_id = conversations.id),
+                        last_message_id = (SELECT MAX(id) FROM messages m WHERE m.conversation_id = conversations.id)
+                """)
+                conn.execute("""
+                    INSERT OR IGNORE INTO conversation_partitions (conversation_id, partition)
+                    SELECT DISTINCT conversation_id, ? FROM messages
+                """, (LEGACY,))
+
+            conn.execute("""
+                INSERT OR IGNORE INTO message_sequence (id, value)
+                SELECT 1, MAX(COALESCE((SELECT MAX(id) FROM messages), 0),
+                              COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'messages'), 0))
+            """)
+
+    # -- partitions -------------------------------------------------------
+
+    def partition_path(self, name: str) -> str:
+        return os.path.join(self.partition_dir, f"messages-{name}.db")
+
+    def _partitions(self, conn: sqlite3.Connection) -> List[str]:
+        """All partitions holding messages, oldest first (the main file's table first)."""
+        rows = conn.execute("SELECT name FROM message_partitions ORDER BY first_id").fetchall()
+        return [LEGACY] + [name for (name,) in rows]
+
+    def _seal(self, name: str):
+        """Leave WAL mode so the finished month is one self-contained, read-only file."""
+        with self._seal_lock:
+            if name in self._sealed:
+                return
+            with self._connect() as conn:
+                row = conn.execute("SELECT sealed FROM message_partitions WHERE name = ?", (name,)).fetchone()
+                if row and row[0]:
+                    self._sealed.add(name)
+                    return
+            if not os.path.exists(self.partition_path(name)):
+                return  # nothing was ever written for that month; don't create an empty file
+            try:
+                partition = sqlite3.connect(self.partition_path(name), timeout=0)
+                try:
+                    with partition:
+                        self._add_missing_columns(partition, "messages", PARTITION_MIGRATIONS)
+                    mode = partition.execute("PRAGMA journal_mode = DELETE").fetchone()[0]
+                finally:
+                    partition.close()
+            except sqlite3.OperationalError:
+                return
+            if mode.lower() != "delete":
+                return  # still open elsewhere from when it was writable; try again on a later attach
+            with self._connect() as conn:
+                conn.execute("UPDATE message_partitions SET sealed = 1 WHERE name = ?", (name,))
+            self._sealed.add(name)
+
+    def _attach(self, conn: sqlite3.Connection, name: str, writable: Optional[bool] = None) -> str:
+        """
+        Attach a partition to this connection if needed and return its schema name.
+        The current month is attached read-write, older months read-only.
+        """
+        if name == LEGACY:
+            return "main"
+        if writable is None:
+            writable = name == current_month()
+        key = name.replace("-", "_")
+        alias = f"rw_{key}" if writable else f"ro_{key}"
+        attached = [row[1] for row in conn.execute("PRAGMA database_list") if row[1] not in ("main", "temp")]
+        if alias in attached:
+            return alias
+
+        for other in list(attached):
+            if other[3:] == key or len(attached) >= MAX_ATTACHED:
+                conn.execute(f"DETACH DATABASE {other}")
+                attached.remove(other)
+
+        if writable:
+            os.makedirs(self.partition_dir, exist_ok=True)
+            conn.execute(f"ATTACH DATABASE ? AS {alias}", (_uri(self.partition_path(name)),))
+            conn.execute(f"PRAGMA {alias}.journal_mode = WAL")
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {alias}.messages (
+                    id INTEGER PRIMARY KEY,
+                    conversation_id INTEGER NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    tokens_used INTEGER DEFAULT 0,
+                    cost REAL DEFAULT 0.0,
+                    prompt_tokens INTEGER DEFAULT 0,
+                    completion_tokens INTEGER DEFAULT 0,
+                    model TEXT,
+                    cached_tokens INTEGER DEFAULT 0
+                )
+            """)
+            self._add_missing_columns(conn, "messages", PARTITION_MIGRATIONS, alias)
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {alias}.idx_messages_conversation_id ON messages(conversation_id, id)")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {alias}.idx_messages_timestamp ON messages(timestamp)")
+        else:
+            self._seal(name)
+            conn.execute(f"ATTACH DATABASE ? AS {alias}", (_uri(self.partition_path(name), read_only=True),))
+        return alias
+
+    def partition_existing_messages(self) -> Dict[str, int]:
+        """
+        Move the messages kept in the main file (from before partitioning was
+        enabled) into their month's partition; returns the count moved per month.
+        """
+        moved = {}
+        month_now = current_month()
+        with self._connect() as conn:
+            months = [month for (month,) in conn.execute(
+                "SELECT DISTINCT strftime('%Y-%m', timestamp) FROM messages ORDER BY 1"
+            ) if month]
+
+        for month in months:
+            year, number = map(int, month.split("-"))
+            start = f"{month}-01"
+            end = f"{year + number // 12:04d}-{number % 12 + 1:02d}-01"
+            with self._connect() as conn:
+                alias = self._attach(conn, month, writable=True)
+                in_month = "timestamp >= ? AND timestamp < ?"
+                moved[month] = conn.execute(f"""
+                    INSERT INTO {alias}.messages (id, {', '.join(MESSAGE_COLUMNS)}, conversation_id)
+                    SELECT id, {', '.join(MESSAGE_COLUMNS)}, conversation_id
+                    FROM main.messages WHERE {in_month}
+                """, (start, end)).rowcount
+                conn.execute(f"""
+                    INSERT INTO message_partitions (name, first_id)
+                    SELECT ?, MIN(id) FROM main.messages WHERE {in_month}
+                    ON CONFLICT(name) DO UPDATE SET first_id = MIN(first_id, excluded.first_id)
+                """, (month, start, end))
+                conn.execute(f"""
+                    INSERT OR IGNORE INTO conversation_partitions (conversation_id, partition)
+                    SELECT DISTINCT conversation_id, ? FROM main.messages WHERE {in_month}
+                """, (month, start, end))
+                conn.execute(f"DELETE FROM main.messages WHERE {in_month}", (start, end))
+            if month != month_now:
+                with self._connect() as conn:
+                    conn.execute(f"DETACH DATABASE {alias}")
+                self._seal(month)
+
+        with self._connect() as conn:
+            conn.execute("""
+                DELETE FROM conversation_partitions
+                WHERE partition = ? AND conversation_id NOT IN (SELECT conversation_id FROM main.messages)
+            """, (LEGACY,))
+        self._read_cache.clear()
+        return moved
+
+    def get_partitions(self) -> List[Dict]:
+        month = current_month()
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute("SELECT * FROM message_partitions ORDER BY first_id").fetchall()
+        partitions = []
+        for row in rows:
+            path = self.partition_path(row['name'])
+            partitions.append({
+                **dict(row),
+                "path": path,
+                "read_only": row['name'] != month,
+                "size_bytes": os.path.getsize(path) if os.path.exists(path) else 0
+            })
+        return partitions
+
+    # -- writes -----------------------------------------------------------
+
+    def _insert_message(self, conn: sqlite3.Connection, conversation_id: int, role: str, content: str,
+                        tokens_used: int, cost: float, prompt_tokens: int, completion_tokens: int,
+                        model: Optional[str], cached_tokens: int) -> int:
+        month = current_month()
+        alias = self._attach(conn, month)
+        cursor = conn.cursor()
+
+        cursor.execute("UPDATE message_sequence SET value = value + 1 WHERE id = 1")
+        message_id = cursor.execute("SELECT value FROM message_sequence WHERE id = 1").fetchone()[0]
+        cursor.execute("INSERT OR IGNORE INTO message_partitions (name, first_id) VALUES (?, ?)",
+                       (month, message_id))
+
+        cursor.execute(f"""
+            INSERT INTO {alias}.messages (id, conversation_id, role, content, tokens_used, cost,
+                                          prompt_tokens, completion_tokens, model, cached_tokens)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (message_id, conversation_id, role, content, tokens_used, cost,
+              prompt_tokens, completion_tokens, model, cached_tokens))
+
+        cursor.execute("INSERT OR IGNORE INTO conversation_partitions (conversation_id, partition) VALUES (?, ?)",
+                       (conversation_id, month))
+        cursor.execute("""
+            UPDATE conversations SET
+                updated_at = CURRENT_TIMESTAMP,
+                message_count = message_count + 1,
+                total_cost = total_cost + ?,
+                prompt_tokens = prompt_tokens + ?,
+                completion_tokens = completion_tokens + ?,
+                cached_tokens = cached_tokens + ?,
+                last_message_id = ?
+            WHERE id = ?
+        """, (cost, prompt_tokens, completion_tokens, cached_tokens, message_id, conversation_id))
+        return message_id
+
+    def delete_conversation(self, conversation_id: int) -> bool:
+        month = current_month()
+        with self._connect() as conn:
+            if conn.execute("SELECT 1 FROM conversations WHERE parent_id = ? LIMIT 1", (conversation_id,)).fetchone():
+                return False
+
+            partitions = [name for (name,) in conn.execute(
+                "SELECT partition FROM conversation_partitions WHERE conversation_id = ?", (conversation_id,)
+            )]
+            aliases = [self._attach(conn, name) for name in partitions if name in (LEGACY, month)]
+            for alias in aliases:
+                conn.execute(f"DELETE FROM {alias}.messages WHERE conversation_id = ?", (conversation_id,))
+            conn.execute("DELETE FROM conversation_partitions WHERE conversation_id = ?", (conversation_id,))
+            deleted = conn.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,)).rowcount > 0
+
+        if deleted:
+            self._forget_conversation(conversation_id)
+            for callback in self.on_conversation_deleted:
+                callback(conversation_id)
+        return deleted
+
+    def clean_duplicate_system_messages(self) -> int:
+        """
+        Drop repeated system prompts, keeping each conversation's first system message,
+        its persona switches and its newest other one; only writable partitions are changed.
+        The ids are collected first and each partition is then cleaned in its own
+        transaction, so no month has to be attached while a write is open.
+        """
+        month = current_month()
+        with self._connect() as conn:
+            system_messages: Dict[int, List[Tuple[int, str]]] = {}
+            for name in self._partitions(conn):
+                alias = self._attach(conn, name)
+                for message_id, conversation_id in conn.execute(
+                    f"SELECT id, conversation_id FROM {alias}.messages "
+                    f"WHERE role = 'system' AND substr(content, 1, ?) != ?",
+                    (len(PERSONA_SWITCH_PREFIX), PERSONA_SWITCH_PREFIX)
+                ):
+                    system_messages.setdefault(conversation_id, []).append((message_id, name))
+
+        duplicates: Dict[str, Dict[int, List[int]]] = {}
+        for conversation_id, found in system_messages.items():
+            for message_id, name in sorted(found)[1:-1]:
+                if name in (LEGACY, month):
+                    duplicates.setdefault(name, {}).setdefault(conversation_id, []).append(message_id)
+
+        total_deleted = 0
+        for name, by_conversation in duplicates.items():
+            with self._connect() as conn:
+                alias = self._attach(conn, name)
+                for conversation_id, message_ids in by_conversation.items():
+                    deleted = 0
+                    for start in range(0, len(message_ids), 500):
+                        batch = message_ids[start:start + 500]
+                        deleted += conn.execute(
+                            f"DELETE FROM {alias}.messages WHERE id IN ({', '.join('?' for _ in batch)})", batch
+                        ).rowcount
+                    if deleted:
+                        conn.execute("UPDATE conversations SET message_count = message_count - ? WHERE id = ?",
+                                     (deleted, conversation_id))
+                        total_deleted += deleted
+        self._read_cache.clear()
+        return total_deleted
+
+    # -- reads ------------------------------------------------------------
+
+    def _chain_rows(self, conn: sqlite3.Connection, conversation_id: int, columns: str,
+                    roles: Optional[Tuple[str, ...]] = None) -> List[tuple]:
+        """(id, *columns) of a conversation's messages including inherited ones, in id order."""
+        chain = dict(conn.execute(self.ANCESTRY_CTE + "SELECT id, upto FROM chain", (conversation_id,)).fetchall())
+        if not chain:
+            return []
+        ids = ", ".join("?" for _ in chain)
+        partitions = {name for (name,) in conn.execute(
+            f"SELECT DISTINCT partition FROM conversation_partitions WHERE conversation_id IN ({ids})",
+            list(chain)
+        )}
+        role_filter = f"AND role IN ({', '.join('?' for _ in roles)})" if roles else ""
+
+        rows = []
+        for name in self._partitions(conn):
+            if name not in partitions:
+                continue
+            alias = self._attach(conn, name)
+            for row in conn.execute(f"""
+                SELECT id, conversation_id, {columns}
+                FROM {alias}.messages
+                WHERE conversation_id IN ({ids}) {role_filter}
+            """, [*chain, *(roles or ())]):
+                upto = chain[row[1]]
+                if upto is None or row[0] <= upto:
+                    rows.append((row[0],) + row[2:])
+        rows.sort(key=lambda row: row[0])
+        return rows
+
+    def _fetch_messages(self, conversation_id: int) -> List[Dict]:
+        with self._connect() as conn:
+            rows = self._chain_rows(conn, conversation_id, ", ".join(MESSAGE_COLUMNS))
+        return [dict(zip(MESSAGE_COLUMNS, row[1:])) for row in rows]
+
+    def _fetch_turns(self, conversation_id: int) -> List[Tuple[str, str]]:
+        with self._connect() as conn:
+            rows = self._chain_rows(conn, conversation_id, "role, content", ("system", "user", "assistant"))
+        return [row[1:] for row in rows]
+
+    def _last_message_id(self, conn: sqlite3.Connection, conversation_id: int) -> Optional[int]:
+        row = conn.execute("SELECT last_message_id FROM conversations WHERE id = ?", (conversation_id,)).fetchone()
+        return row[0] if row else None
+
+    def _nth_message_id(self, conn: sqlite3.Connection, conversation_id: int, n: int) -> Optional[int]:
+        rows = self._chain_rows(conn, conversation_id, "role", ("user", "assistant"))
+        return rows[n - 1][0] if len(rows) >= n else None
+
+    def iter_messages(self, roles: Tuple[str, ...] = ('user', 'assistant'),
+                      batch_size: int = 5000) -> Iterator[Tuple[int, int, str, str]]:
+        placeholders = ", ".join("?" for _ in roles)
+        with self._connect() as conn:
+            live = {conversation_id for (conversation_id,) in conn.execute("SELECT id FROM conversations")}
+            for name in self._partitions(conn):
+                alias = self._attach(conn, name)
+                cursor = conn.execute(f"""
+                    SELECT id, conversation_id, role, content
+                    FROM {alias}.messages
+                    WHERE role IN ({placeholders})
+                    ORDER BY id
+                """, roles)
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield from (row for row in rows if row[1] in live)
+
+    def scan_messages(self, select: str, chunk_size: int = 500_000) -> Iterator[tuple]:
+        with self._connect() as conn:
+            for name in self._partitions(conn):
+                alias = self._attach(conn, name)
+                yield from self._scan_table(conn, f"{alias}.messages", select, chunk_size)
+
+    def get_messages_by_ids(self, message_ids: List[int]) -> Dict[int, Dict]:
+        if not message_ids:
+            return {}
+        with self._connect() as conn:
+            first_ids = [(name, first_id) for name, first_id in conn.execute(
+                "SELECT name, first_id FROM message_partitions ORDER BY first_id"
+            )]
+            by_partition: Dict[str, List[int]] = {}
+            for message_id in message_ids:
+                name = LEGACY
+                for partition, first_id in first_ids:
+                    if first_id > message_id:
+                        break
+                    name = partition
+                by_partition.setdefault(name, []).append(message_id)
+
+            found: Dict[int, Dict] = {}
+            columns = ("id", "conversation_id", "role", "content", "timestamp")
+
+            def fetch(name: str, ids: List[int]):
+                alias = self._attach(conn, name)
+                placeholders = ", ".join("?" for _ in ids)
+                for row in conn.execute(
+                    f"SELECT {', '.join(columns)} FROM {alias}.messages WHERE id IN ({placeholders})", ids
+                ):
+                    found[row[0]] = dict(zip(columns, row))
+
+            for name, ids in by_partition.items():
+                fetch(name, ids)
+            # Messages written across a month boundary can land just outside their range
+            missing = [message_id for message_id in message_ids if message_id not in found]
+            for name in self._partitions(conn) if missing else ():
+                fetch(name, missing)
+                missing = [message_id for message_id in missing if message_id not in found]
+                if not missing:
+                    break
+            return found
+
+    def _branch_totals(self, conn: sqlite3.Connection, row: Dict) -> Dict:
+        """
+        The stored counters only cover a conversation's own messages; a branch's
+        message count and cost also include what it inherits.
+        """
+        if row.get('parent_id') is not None:
+            costs = [cost or 0 for _, cost in self._chain_rows(conn, row['id'], "cost")]
+            row['message_count'] = len(costs)
+            row['total_cost'] = round(sum(costs), 6)
+        return row
+
+    def _fetch_conversation_list(self, limit: int) -> List[Dict]:
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            rows = [dict(row) for row in conn.execute("""
+                SELECT id, title, model, prompt_id, created_at, updated_at, parent_id,
+                       message_count, ROUND(total_cost, 6) as total_cost
+                FROM conversations
+                ORDER BY updated_at DESC
+                LIMIT ?
+            """, (limit,))]
+            conn.row_factory = None
+            return [self._branch_totals(conn, row) for row in rows]
+
+    def search_conversations(self, query: str, limit: int = 10) -> List[Dict]:
+        pattern = f"%{query}%"
+        with self._connect() as conn:
+            hits: Dict[int, List[int]] = {}
+            for name in self._partitions(conn):
+                alias = self._attach(conn, name)
+                for message_id, conversation_id in conn.execute(
+                    f"SELECT id, conversation_id FROM {alias}.messages WHERE content LIKE ?", (pattern,)
+                ):
+                    hits.setdefault(conversation_id, []).append(message_id)
+            matches = {conversation_id: len(ids) for conversation_id, ids in hits.items()}
+            # branches also match on the messages they inherit, up to each fork point
+            chains = conn.execute(
+                "WITH RECURSIVE" + self.CHAINS_CTE.format(seed="conversations WHERE parent_id IS NOT NULL")
+                + "SELECT leaf, id, upto FROM chains"
+            ).fetchall()
+            for branch_id in {leaf for leaf, _, _ in chains}:
+                matches.pop(branch_id, None)
+            for branch_id, conversation_id, upto in chains:
+                count = sum(1 for message_id in hits.get(conversation_id, ()) if upto is None or message_id <= upto)
+                if count:
+                    matches[branch_id] = matches.get(branch_id, 0) + count
+
+            conn.row_factory = sqlite3.Row
+            results = {row['id']: dict(row) for row in conn.execute("""
+                SELECT id, title, model, created_at, updated_at, message_count
+                FROM conversations WHERE title LIKE ?
+            """, (pattern,))}
+            ids = list(matches)
+            for start in range(0, len(ids), 500):
+                batch = ids[start:start + 500]
+                for row in conn.execute(f"""
+                    SELECT id, title, model, created_at, updated_at, message_count
+                    FROM conversations WHERE id IN ({', '.join('?' for _ in batch)})
+                """, batch):
+                    results[row['id']] = dict(row, message_count=matches[row['id']])
+
+        ordered = sorted(results.values(), key=lambda row: row['updated_at'], reverse=True)[:limit]
+        for row in ordered:
+            del row['updated_at']
+        return ordered
+
+    def _fetch_conversation_info(self, conversation_id: int) -> Optional[Dict]:
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute("SELECT * FROM conversations WHERE id = ?", (conversation_id,)).fetchone()
+            conn.row_factory = None
+            return self._branch_totals(conn, dict(row)) if row else None
+
+    def get_stats(self) -> Dict:
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            stats = dict(conn.execute("""
+                SELECT
+                    COUNT(*) as total_conversations,
+                    COALESCE(SUM(message_count), 0) as total_messages,
+                    ROUND(COALESCE(SUM(total_cost), 0), 6) as total_cost,
+                    SUM(prompt_tokens) as prompt_tokens,
+                    SUM(completion_tokens) as completion_tokens,
+                    SUM(cached_tokens) as cached_tokens,
+                    COUNT(DISTINCT model) as models_used,
+                    COUNT(DISTINCT prompt_id) as prompts_used
+                FROM conversations
+            """).fetchone())
+            stats["partitions"] = conn.execute("SELECT COUNT(*) FROM message_partitions").fetchone()[0]
+        return stats
+
+    def get_daily_spend(self, model: Optional[str] = None) -> float:
+        """Today's messages can only be in the current month (or the main file, if partitioning started today)."""
+        month = current_month()
+        total = 0.0
+        with self._connect() as conn:
+            names = [LEGACY] + ([month] if month in self._partitions(conn) else [])
+            for name in names:
+                alias = self._attach(conn, name)
+                query = f"SELECT COALESCE(SUM(cost), 0) FROM {alias}.messages WHERE timestamp >= date('now')"
+                if model:
+                    total += conn.execute(query + " AND model = ?", (model,)).fetchone()[0]
+                else:
+                    total += conn.execute(query).fetchone()[0]
+            total += self._daily_request_spend(conn, model)
+        return total
+
+
+if __name__ == "__main__":
+    import sys
+
+    db_path = sys.argv[1] if len(sys.argv) > 1 else "conversations.db"
+    db = PartitionedConversationDB(db_path)
+    print(f"🗂️ Moving the messages in {db_path} into monthly partitions in {db.partition_dir}...")
+    moved = db.partition_existing_messages()
+    for month, count in moved.items():
+        print(f"   {month}: {count} messages")
+    with db._connect() as conn:
+        conn.execute("VACUUM")
+    print(f"✅ Moved {sum(moved.values())} messages; run with CHATBOT_DB_PARTITIONS=monthly from now on")
@@ -0,0 +1,132 @@
+import cProfile
+import os
+import pstats
+import re
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+PROFILE_ENV = "CHATBOT_PROFILE"
+PROFILE_MEMORY_ENV = "CHATBOT_PROFILE_MEMORY"
+DEFAULT_PROFILE_DIR = "profiles"
+
+
+class Profiler:
+    """
+    Opt-in cProfile/tracemalloc wrapper for the chat loop.
+    The session profile covers chat() as a whole; each command or message
+    turn gets its own .prof file while the session profile is paused.
+    """
+
+    def __init__(self, output_dir: str = DEFAULT_PROFILE_DIR, trace_memory: bool = False, top: int = 10):
+        self.output_dir = output_dir
+        self.trace_memory = trace_memory
+        self.top = top
+        self.timings: Dict[str, List[float]] = {}
+        self.files: List[str] = []
+        self._session: Optional[cProfile.Profile] = None
+        self._baseline = None
+        self._counter = 0
+        os.makedirs(self.output_dir, exist_ok=True)
+
+    def run_session(self, fn: Callable, *args, **kwargs):
+        if self.trace_memory:
+            tracemalloc.start(25)
+            self._baseline = tracemalloc.take_snapshot()
+        self._session = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            return self._session.runcall(fn, *args, **kwargs)
+        finally:
+            self._session.disable()
+            self.timings.setdefault("session", []).append(time.perf_counter() - start)
+            self._dump(self._session, "session")
+            self.report()
+            if self.trace_memory:
+                tracemalloc.stop()
+
+    def run(self, label: str, fn: Callable, *args, **kwargs):
+        if self._session:
+            self._session.disable()
+        profile = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            return profile.runcall(fn, *args, **kwargs)
+        finally:
+            self.timings.setdefault(label, []).append(time.perf_counter() - start)
+            self._dump(profile, label)
+            if self._session:
+                self._session.enable()
+
+    def _dump(self, profile: cProfile.Profile, label: str):
+        self._counter += 1
+        safe_label = re.sub(r'[^a-z0-9_]+', '_', label.lower()).strip('_') or "command"
+        path = os.path.join(self.output_dir, f"{self._counter:03d}_{safe_label}.prof")
+        profile.dump_stats(path)
+        self.files.append(path)
+
+    def report(self):
+        snapshot = None
+        if self.trace_memory and tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, cProfile.__file__),
+                tracemalloc.Filter(False, pstats.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            ))
+
+        print("\n🔬 Profiling Summary:")
+        print("-" * 60)
+        for label, samples in sorted(self.timings.items(), key=lambda item: -sum(item[1])):
+            print(f"  {label:15} | {len(samples):4} calls | {sum(samples):8.3f}s total | {max(samples):8.3f}s max")
+        print(f"\n📁 {len(self.files)} profiles written to {self.output_dir}/")
+        print(f"   Inspect with: python -m pstats {os.path.join(self.output_dir, '001_<label>.prof')}")
+
+        if self.files:
+            slowest = max(self.files, key=lambda path: pstats.Stats(path).total_tt)
+            print(f"\n🐢 Top functions in {slowest} (by cumulative time):")
+            pstats.Stats(slowest).sort_stats("cumulative").print_stats(self.top)
+
+        if snapshot:
+            stats = snapshot.compare_to(self._baseline, "lineno") if self._baseline else snapshot.statistics("lineno")
+            current, peak = tracemalloc.get_traced_memory()
+            print(f"🧠 Memory: {current / 1024:.1f} KiB current, {peak / 1024:.1f} KiB peak")
+            print(f"   Top {self.top} allocation sites:")
+            for stat in stats[:self.top]:
+                print(f"   {stat}")
+        print()
+
+
+def get_profiler(argv: Optional[List[str]] = None) -> Optional[Profiler]:
+    """
+    Build a Profiler when enabled by --profile[=DIR] / --profile-memory or the
+    CHATBOT_PROFILE / CHATBOT_PROFILE_MEMORY environment variables.
+    Returns None when profiling is off so callers skip it entirely.
+    """
+    argv = argv or []
+    enabled = os.getenv(PROFILE_ENV, "").strip()
+    trace_memory = os.getenv(PROFILE_MEMORY_ENV, "").strip().lower() in ("1", "true", "yes")
+    output_dir = DEFAULT_PROFILE_DIR
+
+    if enabled and enabled.lower() not in ("0", "false", "no"):
+        if enabled.lower() not in ("1", "true", "yes"):
+            output_dir = enabled
+    else:
+        enabled = ""
+
+    for arg in argv:
+        if arg == "--profile":
+            enabled = "1"
+        elif arg.startswith("--profile="):
+            enabled = "1"
+            output_dir = arg.split("=", 1)[1] or DEFAULT_PROFILE_DIR
+        elif arg == "--profile-memory":
+            enabled = "1"
+            trace_memory = True
+
+    if trace_memory:
+        enabled = enabled or "1"
+
+    if not enabled:
+        return None
+    return Profiler(output_dir=output_dir, trace_memory=trace_memory)
@@ -0,0 +1,228 @@
+import math
+import re
+import sys
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from .database import ConversationDB
+from .messages import CHARS_PER_TOKEN, History, Message
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9_]+")
+STOPWORDS = frozenset("""
+a an and are as at be but by can do does for from has have how i if in into is it its me my
+no not of on or so that the their them then there these they this to was we what when where
+which who why will with you your
+""".split())
+SNIPPET_CHARS = 600
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in TOKEN_PATTERN.findall(text.lower())
+            if token not in STOPWORDS and len(token) > 1]
+
+
+class BM25Index:
+    """
+    Incremental in-memory BM25 ranker over an inverted index.
+    Documents are message ids; only term frequencies, lengths and each
+    document's (interned) terms are kept, the text itself stays in the database.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self.doc_lengths: Dict[int, int] = {}
+        self.doc_conversations: Dict[int, int] = {}
+        self.doc_terms: Dict[int, Tuple[str, ...]] = {}
+        self.conversation_docs: Dict[int, Set[int]] = {}
+        self.total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def add(self, doc_id: int, conversation_id: int, text: str):
+        if doc_id in self.doc_lengths:
+            return
+        terms = tokenize(text)
+        if not terms:
+            return
+        frequencies: Dict[str, int] = {}
+        for term in terms:
+            frequencies[term] = frequencies.get(term, 0) + 1
+        for term, frequency in frequencies.items():
+            self.postings.setdefault(term, {})[doc_id] = frequency
+        self.doc_terms[doc_id] = tuple(sys.intern(term) for term in frequencies)
+        self.doc_lengths[doc_id] = len(terms)
+        self.doc_conversations[doc_id] = conversation_id
+        self.conversation_docs.setdefault(conversation_id, set()).add(doc_id)
+        self.total_length += len(terms)
+
+    def remove_conversation(self, conversation_id: int):
+        """Drop a conversation's documents, touching only the postings of their terms."""
+        for doc_id in self.conversation_docs.pop(conversation_id, set()):
+            for term in self.doc_terms.pop(doc_id, ()):
+                posting = self.postings.get(term)
+                if posting is None:
+                    continue
+                posting.pop(doc_id, None)
+                if not posting:
+                    del self.postings[term]
+            self.total_length -= self.doc_lengths.pop(doc_id, 0)
+            self.doc_conversations.pop(doc_id, None)
+
+    def search(self, query: str, top_k: int = 5) -> List[Tuple[int, float]]:
+        if not self.doc_lengths:
+            return []
+        count = len(self.doc_lengths)
+        average_length = self.total_length / count
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = math.log(1 + (count - len(posting) + 0.5) / (len(posting) + 0.5))
+            for doc_id, frequency in posting.items():
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / average_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return sorted(scores.items(), key=lambda item: -item[1])[:top_k]
+
+
+def make_snippet(content: str, query_terms: Set[str], max_chars: int = SNIPPET_CHARS) -> str:
+    """Cut a window of the message around its first query-term hit."""
+    content = " ".join(content.split())
+    if len(content) <= max_chars:
+        return content
+    lowered = content.lower()
+    hits = [lowered.find(term) for term in query_terms if term in lowered]
+    center = min(hits) if hits else 0
+    start = max(0, min(center - max_chars // 3, len(content) - max_chars))
+    snippet = content[start:start + max_chars]
+    return ("..." if start else "") + snippet + ("..." if start + max_chars < len(content) else "")
+
+
+class Retriever:
+    """
+    Keeps a BM25 index of past user/assistant messages in sync with a
+    ConversationDB and turns the best matches into a compact context message.
+    The index is built on first use and updated incrementally afterwards.
+    """
+
+    def __init__(self, db: ConversationDB):
+        self.db = db
+        self.index = BM25Index()
+        self._loaded = False
+        self._lock = threading.Lock()
+        db.on_message_added.append(self._on_message_added)
+        db.on_conversation_deleted.append(self._on_conversation_deleted)
+
+    def _on_message_added(self, message_id: int, conversation_id: int, role: str, content: str):
+        if role not in ("user", "assistant"):
+            return
+        with self._lock:
+            if self._loaded:
+                self.index.add(message_id, conversation_id, content)
+
+    def _on_conversation_deleted(self, conversation_id: int):
+        with self._lock:
+            self.index.remove_conversation(conversation_id)
+
+    def ensure_loaded(self):
+        with self._lock:
+            if self._loaded:
+                return
+            for message_id, conversation_id, _, content in self.db.iter_messages():
+                self.index.add(message_id, conversation_id, content)
+            self._loaded = True
+
+    def retrieve(self, query: str, top_k: int = 5, token_budget: int = 800,
+                 exclude_hashes: Optional[Set[str]] = None) -> List[Dict]:
+        """Best-matching past messages whose snippets fit in the token budget."""
+        self.ensure_loaded()
+        with self._lock:
+            # over-fetch: some hits are dropped as duplicates of the recent window
+            ranked = self.index.search(query, top_k * 3)
+        rows = self.db.get_messages_by_ids([doc_id for doc_id, _ in ranked])
+        terms = set(tokenize(query))
+
+        results = []
+        used_tokens = 0
+        seen = set(exclude_hashes or ())
+        for doc_id, score in ranked:
+            row = rows.get(doc_id)
+            if not row:
+                continue
+            digest = Message(row['role'], row['content']).content_hash
+            if digest in seen:
+                continue
+            seen.add(digest)
+            snippet = make_snippet(row['content'], terms)
+            tokens = -(-len(snippet) // CHARS_PER_TOKEN)
+            if used_tokens + tokens > token_budget:
+                continue
+            used_tokens += tokens
+            results.append({**row, "snippet": snippet, "score": score})
+            if len(results) >= top_k:
+                break
+        return results
+
+    def build_context(self, messages: Iterable, top_k: int = 5, token_budget: int = 800,
+                      recent_messages: int = 6) -> Dict:
+        """
+        When the turns older than the recent window fit in token_budget, the full
+        history is kept. Otherwise it is replaced with: system prompt(s) (including
+        the latest persona switch), one message of retrieved snippets, and the most
+        recent turns; if that is not smaller, the full history is kept after all.
+        Returns the message list and the token counts before and after.
+        """
+        history = messages if isinstance(messages, History) else History(messages)
+        leading = []
+        for message in history:
+            if message.role != "system":
+                break
+            leading.append(message)
+        conversation = history[len(leading):]
+        recent = conversation[-recent_messages:] if recent_messages else []
+        # a persona switch appended earlier in the conversation still applies
+        older = conversation[:len(conversation) - len(recent)]
+        leading += [message for message in older if message.role == "system"][-1:]
+        tokens_before = history.total_tokens
+        full = {"messages": history, "retrieved": 0, "tokens_before": tokens_before, "tokens_after": tokens_before}
+        if sum(message.tokens for message in older) <= token_budget:
+            return full
+        query_message = history.last("user")
+
+        snippets = []
+        if query_message is not None:
+            recent_hashes = {message.content_hash for message in recent}
+            snippets = self.retrieve(query_message.content, top_k, token_budget, recent_hashes)
+
+        result = History(leading)
+        if snippets:
+            lines = ["Relevant excerpts from earlier conversations (use them only if they help):"]
+            for item in snippets:
+                lines.append(f"- [{item['timestamp'][:10]}, {item['role']}] {item['snippet']}")
+            result.add("system", "\n".join(lines))
+        result.extend(recent)
+
+        if result.total_tokens >= tokens_before:
+            return full
+        return {
+            "messages": result,
+            "retrieved": len(snippets),
+            "tokens_before": tokens_before,
+            "tokens_after": result.total_tokens,
+        }
+
+
+_retrievers: Dict[int, Retriever] = {}
+_retrievers_lock = threading.Lock()
+
+
+def get_retriever(db: ConversationDB) -> Retriever:
+    """One shared retriever (and index) per database."""
+    with _retrievers_lock:
+        retriever = _retrievers.get(id(db))
+        if retriever is None or retriever.db is not db:
+            retriever = _retrievers[id(db)] = Retriever(db)
+        return retriever
@@ -0,0 +1,245 @@
+"""
+HTTP server mode: many chat sessions in one process.
+
+Endpoints (JSON unless noted):
+    POST /conversations                   create a conversation, body {"title"?, "model"?, "prompt_id"?}
+    GET  /conversations?limit=20          list recent conversations
+    GET  /conversations/<id>              load a conversation with its messages
+    POST /conversations/<id>/messages     send {"content"}; reply streams as Server-Sent Events
+    POST /conversations/<id>/fork         branch a conversation, body {"after_messages"?, "title"?}
+
+Each conversation is a ChatSession with its own model, prompt and history.
+All sessions share the module's OpenAI client (and its HTTP connection pool)
+and one ConversationDB connection pool.
+"""
+import json
+import re
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import parse_qs, urlparse
+
+from .chatbot import ChatSession
+from .database import ConversationDB, conversation_db
+
+CONVERSATION_PATH = re.compile(r"^/conversations/(\d+)$")
+MESSAGES_PATH = re.compile(r"^/conversations/(\d+)/messages$")
+FORK_PATH = re.compile(r"^/conversations/(\d+)/fork$")
+MAX_SESSIONS = 1000
+
+
+class SessionStore:
+    """Chat sessions keyed by conversation id, loaded from the database on demand."""
+
+    def __init__(self, db: ConversationDB, max_sessions: int = MAX_SESSIONS):
+        self.db = db
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[int, ChatSession]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, session: ChatSession) -> ChatSession:
+        """Keep the most recently used sessions in memory; older ones reload from the database."""
+        session = self._sessions.setdefault(session.conversation_id, session)
+        self._sessions.move_to_end(session.conversation_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+        return session
+
+    def create(self, title: Optional[str] = None, model: Optional[str] = None,
+               prompt_id: Optional[str] = None) -> ChatSession:
+        session = ChatSession(db=self.db)
+        if model and not session.set_model(model):
+            raise ValueError(f"Model {model} not available")
+        if prompt_id and not session.set_prompt(prompt_id):
+            raise ValueError(f"Prompt {prompt_id} not available")
+        session.start_conversation(title)
+        with self._lock:
+            return self._remember(session)
+
+    def get(self, conversation_id: int) -> Optional[ChatSession]:
+        with self._lock:
+            session = self._sessions.get(conversation_id)
+            if session:
+                self._sessions.move_to_end(conversation_id)
+                return session
+
+        session = ChatSession(db=self.db)
+        if not session.load_conversation(conversation_id):
+            return None
+        with self._lock:
+            return self._remember(session)
+
+
+class ChatRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "AIChatbot/1.0"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    @property
+    def store(self) -> SessionStore:
+        return self.server.store
+
+    def _read_json(self) -> Dict:
+        """The request body as a JSON object; raises ValueError for anything else."""
+        length = int(self.headers.get("Content-Length", 0))
+        if not length:
+            return {}
+        body = json.loads(self.rfile.read(length))
+        if not isinstance(body, dict):
+            raise ValueError("JSON body must be an object")
+        return body
+
+    def _send_json(self, status: int, payload):
+        data = json.dumps(payload, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, status: int, message: str):
+        self._send_json(status, {"error": message})
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/conversations":
+            try:
+                limit = int(parse_qs(url.query).get("limit", ["20"])[0])
+            except ValueError:
+                self._send_error(400, "limit must be an integer")
+                return
+            self._send_json(200, self.store.db.list_conversations(limit))
+            return
+
+        match = CONVERSATION_PATH.match(url.path)
+        if match:
+            conversation_id = int(match.group(1))
+            info = self.store.db.get_conversation_info(conversation_id)
+            if not info:
+                self._send_error(404, f"Conversation {conversation_id} not found")
+                return
+            self._send_json(200, {
+                "conversation": info,
+                "messages": self.store.db.get_conversation_messages(conversation_id)
+            })
+            return
+
+        self._send_error(404, f"Unknown path {url.path}")
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        try:
+            body = self._read_json()
+        except ValueError:  # includes json.JSONDecodeError
+            self._send_error(400, "Invalid JSON body: expected an object")
+            return
+
+        if url.path == "/conversations":
+            try:
+                session = self.store.create(body.get("title"), body.get("model"), body.get("prompt_id"))
+            except ValueError as e:
+                self._send_error(400, str(e))
+                return
+            self._send_json(201, {
+                "id": session.conversation_id,
+                "model": session.model,
+                "prompt_id": session.prompt_id
+            })
+            return
+
+        match = MESSAGES_PATH.match(url.path)
+        if match:
+            content = (body.get("content") or "").strip()
+            if not content:
+                self._send_error(400, "content is required")
+                return
+            session = self.store.get(int(match.group(1)))
+            if not session:
+                self._send_error(404, f"Conversation {match.group(1)} not found")
+                return
+            self._stream_reply(session, content)
+            return
+
+        match = FORK_PATH.match(url.path)
+        if match:
+            after_messages = body.get("after_messages")
+            if after_messages is not None and not isinstance(after_messages, int):
+                self._send_error(400, "after_messages must be an integer")
+                return
+            parent_id = int(match.group(1))
+            branch_id = self.store.db.fork_conversation(parent_id, after_messages, body.get("title"))
+            if branch_id is None:
+                self._send_error(404, f"Conversation {parent_id} not found or has fewer messages")
+                return
+            self._send_json(201, {"id": branch_id, "parent_id": parent_id})
+            return
+
+        self._send_error(404, f"Unknown path {url.path}")
+
+    def _send_event(self, event: str, payload: Dict):
+        self.wfile.write(f"event: {event}\ndata: {json.dumps(payload)}\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+    def _stream_reply(self, session: ChatSession, content: str):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        parts = []
+        result = {}
+        turn = session.send(content, result)
+        try:
+            for delta in turn:
+                parts.append(delta)
+                self._send_event("delta", {"content": delta})
+            usage = result["usage"]
+            self._send_event("done", {
+                "conversation_id": session.conversation_id,
+                "content": "".join(parts),
+                "model": usage["model"],
+                "usage": {
+                    "prompt_tokens": usage["prompt_tokens"],
+                    "completion_tokens": usage["completion_tokens"],
+                    "cached_tokens": usage["cached_tokens"],
+                    "estimated": usage["estimated"]
+                },
+                "cost": usage["cost"],
+                "estimated_cost": result["admission"]["cost"]["total"]
+            })
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        except Exception as e:
+            try:
+                self._send_event("error", {"error": str(e)})
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+        finally:
+            turn.close()
+
+
+def create_server(host: str = "127.0.0.1", port: int = 8000, db: Optional[ConversationDB] = None,
+                  verbose: bool = False) -> ThreadingHTTPServer:
+    httpd = ThreadingHTTPServer((host, port), ChatRequestHandler)
+    httpd.daemon_threads = True
+    httpd.store = SessionStore(db or conversation_db)
+    httpd.verbose = verbose
+    return httpd
+
+
+def serve(host: str = "127.0.0.1", port: int = 8000):
+    httpd = create_server(host, port, verbose=True)
+    print(f"🌐 Serving chat sessions on http://{host}:{httpd.server_address[1]}")
+    print("   POST /conversations | GET /conversations | GET /conversations/<id> | POST /conversations/<id>/messages")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 Server stopped")
+    finally:
+        httpd.server_close()
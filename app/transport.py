@@ -0,0 +1,261 @@
+"""
+Record/replay transport for the OpenAI client.
+
+CassetteClient stands in for the OpenAI client (it only needs
+chat.completions.create). In record mode it forwards every request to the
+real client and writes the request and the response, including the arrival
+time of each streamed chunk, to a cassette file: JSON Lines with a version
+header, one interaction appended per line. In replay mode it
+answers from the cassette without touching the network, at the recorded
+speed or faster.
+
+Enabled from the environment:
+    CHATBOT_CASSETTE=sessions/demo.jsonl  cassette file
+    CHATBOT_CASSETTE_MODE=record|replay   default: replay if the file exists, else record
+    CHATBOT_REPLAY_SPEED=4                replay 4x faster; 0 replays without delays
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+CASSETTE_VERSION = 2
+MODES = ("record", "replay")
+
+
+class CassetteMissError(LookupError):
+    """Raised in replay mode when the cassette has no response for a request."""
+
+
+def request_key(request: Dict[str, Any]) -> str:
+    """Requests match on model, streaming and messages; sampling settings may change between runs."""
+    relevant = {
+        "model": request.get("model"),
+        "stream": bool(request.get("stream")),
+        "messages": [{"role": m["role"], "content": m["content"]} for m in request.get("messages", [])],
+    }
+    encoded = json.dumps(relevant, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class Cassette:
+    """A list of recorded interactions backed by a JSON Lines file that recording appends to."""
+
+    def __init__(self, path: str, mode: str = "replay", speed: float = 1.0):
+        if mode not in MODES:
+            raise ValueError(f"Cassette mode must be one of {', '.join(MODES)}, not {mode!r}")
+        self.path = path
+        self.mode = mode
+        self.speed = speed
+        self.interactions: List[Dict] = []
+        self._lock = threading.Lock()
+        if mode == "replay" or os.path.exists(path):
+            self.load()
+        self.rewind()
+
+    def load(self):
+        with open(self.path, 'r', encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        try:
+            header = json.loads(lines[0]) if lines else {}
+        except json.JSONDecodeError:
+            header = {}
+        if not isinstance(header, dict) or header.get("version") != CASSETTE_VERSION:
+            raise ValueError(f"Unsupported cassette version {header.get('version') if isinstance(header, dict) else None} "
+                             f"in {self.path} (expected a version {CASSETTE_VERSION} JSON Lines cassette)")
+        self.interactions = []
+        for number, line in enumerate(lines[1:], start=2):
+            if not line.strip():
+                continue
+            try:
+                self.interactions.append(json.loads(line))
+            except json.JSONDecodeError:
+                if number == len(lines):
+                    break  # a recording cut off mid-write: keep everything before it
+                raise ValueError(f"Corrupt interaction on line {number} of {self.path}")
+
+    def append(self, interaction: Dict):
+        """Write one interaction to the end of the file, adding the header to a new file."""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            if f.tell() == 0:
+                f.write(json.dumps({"version": CASSETTE_VERSION}) + "\n")
+            f.write(json.dumps(interaction, ensure_ascii=False) + "\n")
+
+    def rewind(self):
+        """Start replaying from the first recorded interaction again."""
+        with self._lock:
+            self._queues: Dict[str, deque] = {}
+            for interaction in self.interactions:
+                self._queues.setdefault(interaction["key"], deque()).append(interaction)
+            self._last: Dict[str, Dict] = {}
+
+    def record(self, interaction: Dict):
+        with self._lock:
+            self.interactions.append(interaction)
+            self.append(interaction)
+
+    def find(self, request: Dict[str, Any]) -> Dict:
+        """
+        Next unplayed interaction for this request. Identical requests are
+        answered in recorded order; once used up, the last answer repeats.
+        """
+        key = request_key(request)
+        with self._lock:
+            queue = self._queues.get(key)
+            if queue:
+                self._last[key] = queue.popleft()
+            if key not in self._last:
+                raise CassetteMissError(
+                    f"No recorded response in {self.path} for this {request.get('model')} request "
+                    f"({len(request.get('messages', []))} messages)"
+                )
+            return self._last[key]
+
+    def wait_until(self, start: float, offset: float):
+        """Sleep until the recorded offset, scaled by the replay speed."""
+        if self.speed <= 0:
+            return
+        delay = start + offset / self.speed - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class RecordingStream:
+    """Passes the real stream through and records each chunk with its arrival time."""
+
+    def __init__(self, response, cassette: Cassette, interaction: Dict, start: float):
+        self._response = response
+        self._cassette = cassette
+        self._interaction = interaction
+        self._start = start
+        self._saved = False
+
+    def __iter__(self) -> Iterator[ChatCompletionChunk]:
+        try:
+            for chunk in self._response:
+                self._interaction["chunks"].append({
+                    "t": round(time.perf_counter() - self._start, 6),
+                    "data": chunk.model_dump(mode="json", exclude_unset=True)
+                })
+                yield chunk
+            self._interaction["complete"] = True
+        finally:
+            self._save()
+
+    def _save(self):
+        if not self._saved:
+            self._saved = True
+            self._cassette.record(self._interaction)
+
+    def close(self):
+        try:
+            self._response.close()
+        finally:
+            self._save()
+
+
+class ReplayStream:
+    """Plays recorded chunks back with their original spacing (scaled by the cassette speed)."""
+
+    def __init__(self, cassette: Cassette, interaction: Dict):
+        self._cassette = cassette
+        self._interaction = interaction
+        self._closed = False
+
+    def __iter__(self) -> Iterator[ChatCompletionChunk]:
+        start = time.perf_counter()
+        for chunk in self._interaction["chunks"]:
+            if self._closed:
+                return
+            self._cassette.wait_until(start, chunk["t"])
+            yield ChatCompletionChunk.model_validate(chunk["data"])
+
+    def close(self):
+        self._closed = True
+
+
+class _Completions:
+    def __init__(self, owner: "CassetteClient"):
+        self._owner = owner
+
+    def create(self, **kwargs):
+        return self._owner.create(**kwargs)
+
+
+class _Chat:
+    def __init__(self, owner: "CassetteClient"):
+        self.completions = _Completions(owner)
+
+
+class CassetteClient:
+    """
+    Drop-in for the OpenAI client's chat.completions.create that records to
+    or replays from a cassette. `client` is only needed for recording.
+    """
+
+    def __init__(self, cassette: Cassette, client=None):
+        if cassette.mode == "record" and client is None:
+            raise ValueError("Recording needs a real OpenAI client")
+        self.cassette = cassette
+        self.client = client
+        self.chat = _Chat(self)
+
+    def create(self, **kwargs):
+        if self.cassette.mode == "replay":
+            return self._replay(kwargs)
+        return self._record(kwargs)
+
+    def _record(self, request: Dict[str, Any]):
+        request = json.loads(json.dumps(request, default=str))
+        interaction = {"key": request_key(request), "request": request}
+        start = time.perf_counter()
+        response = self.client.chat.completions.create(**request)
+        if request.get("stream"):
+            interaction.update({"chunks": [], "complete": False})
+            return RecordingStream(response, self.cassette, interaction, start)
+        interaction.update({
+            "elapsed": round(time.perf_counter() - start, 6),
+            "response": response.model_dump(mode="json", exclude_unset=True)
+        })
+        self.cassette.record(interaction)
+        return response
+
+    def _replay(self, request: Dict[str, Any]):
+        interaction = self.cassette.find(request)
+        if "chunks" in interaction:
+            return ReplayStream(self.cassette, interaction)
+        self.cassette.wait_until(time.perf_counter(), interaction["elapsed"])
+        return ChatCompletion.model_validate(interaction["response"])
+
+
+def cassette_from_env() -> Optional[Cassette]:
+    path = os.getenv("CHATBOT_CASSETTE")
+    if not path:
+        return None
+    mode = os.getenv("CHATBOT_CASSETTE_MODE") or ("replay" if os.path.exists(path) else "record")
+    speed = float(os.getenv("CHATBOT_REPLAY_SPEED", "1"))
+    return Cassette(path, mode.lower(), speed)
+
+
+def client_from_env(make_client: Callable[[], Any]):
+    """
+    The OpenAI client, wrapped in a CassetteClient when CHATBOT_CASSETTE is set.
+    Replay mode never creates the real client, so it runs without an API key.
+    """
+    cassette = cassette_from_env()
+    if cassette is None:
+        return make_client()
+    if cassette.mode == "replay":
+        speed = f"{cassette.speed:g}x speed" if cassette.speed > 0 else "no delays"
+        print(f"📼 Replaying {len(cassette.interactions)} recorded responses from {cassette.path} ({speed})")
+        return CassetteClient(cassette)
+    print(f"📼 Recording API responses to {cassette.path}")
+    return CassetteClient(cassette, make_client())
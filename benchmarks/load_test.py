@@ -0,0 +1,188 @@
+"""
+Load test for the HTTP server mode against the local mock OpenAI backend.
+
+Starts the mock API and the chat server in-process (with a temporary
+database), runs many concurrent sessions, each creating a conversation and
+streaming replies over SSE, and reports sessions/sec and latency percentiles.
+
+Usage:
+    python -m benchmarks.load_test --sessions 200 --concurrency 32 --turns 2
+"""
+import argparse
+import http.client
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.mock_openai_server import MockOpenAIServer
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def request_json(host: str, port: int, method: str, path: str, body: Dict = None) -> Dict:
+    conn = http.client.HTTPConnection(host, port, timeout=60)
+    try:
+        payload = json.dumps(body or {})
+        conn.request(method, path, body=payload, headers={"Content-Type": "application/json"})
+        response = conn.getresponse()
+        data = json.loads(response.read() or b"{}")
+        if response.status >= 400:
+            raise RuntimeError(f"{method} {path} -> {response.status}: {data}")
+        return data
+    finally:
+        conn.close()
+
+
+def send_message(host: str, port: int, conversation_id: int, content: str) -> Dict:
+    """POST a message and consume the SSE stream; returns timing for the turn."""
+    conn = http.client.HTTPConnection(host, port, timeout=60)
+    start = time.perf_counter()
+    first_byte = None
+    done = False
+    try:
+        conn.request("POST", f"/conversations/{conversation_id}/messages",
+                     body=json.dumps({"content": content}),
+                     headers={"Content-Type": "application/json"})
+        response = conn.getresponse()
+        if response.status != 200:
+            raise RuntimeError(f"send message -> {response.status}")
+        event = None
+        for raw in response:
+            line = raw.decode("utf-8").rstrip("\n")
+            if line.startswith("event: "):
+                event = line[7:]
+            elif line.startswith("data: "):
+                if event == "delta" and first_byte is None:
+                    first_byte = time.perf_counter() - start
+                elif event == "error":
+                    raise RuntimeError(json.loads(line[6:])["error"])
+                elif event == "done":
+                    done = True
+        if not done:
+            raise RuntimeError("stream ended without a done event")
+    finally:
+        conn.close()
+    return {"latency": time.perf_counter() - start, "ttfb": first_byte or 0.0}
+
+
+def run(args) -> Dict:
+    mock = MockOpenAIServer(
+        latency=args.latency, chunk_delay=args.chunk_delay,
+        chunk_size=args.chunk_size, reply_chars=args.reply_chars
+    ).start()
+    os.environ["OPENAI_API_KEY"] = "mock"
+    os.environ["OPENAI_BASE_URL"] = mock.base_url
+    tmp = tempfile.TemporaryDirectory()
+    # importing the app opens its module-level database; keep it out of the repo
+    os.environ["CHATBOT_DB_PATH"] = os.path.join(tmp.name, "conversations.db")
+    os.chdir(REPO_ROOT)
+
+    from app.database import ConversationDB
+    from app.partitions import PartitionedConversationDB
+    from app.server import create_server
+
+    db_class = PartitionedConversationDB if args.partitioned else ConversationDB
+    db = db_class(os.path.join(tmp.name, "load.db"))
+    httpd = create_server("127.0.0.1", 0, db=db)
+    host, port = httpd.server_address[:2]
+    server_thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    server_thread.start()
+
+    session_latencies = []
+    turn_latencies = []
+    ttfbs = []
+    errors = []
+    lock = threading.Lock()
+
+    def session(index: int):
+        start = time.perf_counter()
+        try:
+            conversation_id = request_json(host, port, "POST", "/conversations", {"title": f"Load {index}"})["id"]
+            for turn in range(args.turns):
+                timing = send_message(host, port, conversation_id, f"Session {index}, question {turn}")
+                with lock:
+                    turn_latencies.append(timing["latency"])
+                    ttfbs.append(timing["ttfb"])
+            with lock:
+                session_latencies.append(time.perf_counter() - start)
+        except Exception as e:
+            with lock:
+                errors.append(str(e))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(session, range(args.sessions)))
+    elapsed = time.perf_counter() - start
+
+    httpd.shutdown()
+    httpd.server_close()
+    mock.stop()
+    db.close()
+    tmp.cleanup()
+
+    return {
+        "sessions": args.sessions,
+        "concurrency": args.concurrency,
+        "partitioned": args.partitioned,
+        "turns_per_session": args.turns,
+        "elapsed_s": elapsed,
+        "sessions_per_s": len(session_latencies) / elapsed if elapsed else 0.0,
+        "errors": len(errors),
+        "session_latency_p50_s": percentile(session_latencies, 50),
+        "session_latency_p99_s": percentile(session_latencies, 99),
+        "turn_latency_p50_s": percentile(turn_latencies, 50),
+        "turn_latency_p99_s": percentile(turn_latencies, 99),
+        "ttfb_p50_s": percentile(ttfbs, 50),
+        "ttfb_p99_s": percentile(ttfbs, 99),
+        "turn_latency_mean_s": statistics.fmean(turn_latencies) if turn_latencies else 0.0,
+        "first_errors": errors[:5],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the HTTP server mode")
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--turns", type=int, default=1, help="Messages sent per session")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mock API time to first byte")
+    parser.add_argument("--chunk-delay", type=float, default=0.002)
+    parser.add_argument("--chunk-size", type=int, default=16)
+    parser.add_argument("--reply-chars", type=int, default=1000)
+    parser.add_argument("--partitioned", action="store_true", help="Store messages in monthly partition files")
+    parser.add_argument("--output", help="Write the results as JSON to this path")
+    args = parser.parse_args()
+
+    results = run(args)
+    print(f"🚀 {results['sessions']} sessions x {results['turns_per_session']} turns, "
+          f"concurrency {results['concurrency']}: {results['sessions_per_s']:.1f} sessions/s")
+    print(f"   Session latency p50 {results['session_latency_p50_s'] * 1000:.1f} ms, "
+          f"p99 {results['session_latency_p99_s'] * 1000:.1f} ms")
+    print(f"   Turn latency p50 {results['turn_latency_p50_s'] * 1000:.1f} ms, "
+          f"p99 {results['turn_latency_p99_s'] * 1000:.1f} ms | TTFB p99 {results['ttfb_p99_s'] * 1000:.1f} ms")
+    if results["errors"]:
+        print(f"   ❌ {results['errors']} failed sessions, e.g. {results['first_errors'][0]}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
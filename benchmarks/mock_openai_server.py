@@ -0,0 +1,260 @@
+"""
+Local stand-in for the OpenAI chat completions API.
+
+Serves ``POST /v1/chat/completions`` in both streaming (Server-Sent Events)
+and non-streaming modes, with configurable latency, chunk size and error
+rate, so the chatbot can be exercised without network access or an API key.
+Usage includes prompt-prefix cache hits, reported the way the API does.
+
+Run standalone:
+    python -m benchmarks.mock_openai_server --port 8765 --latency 0.05
+
+Then point the app at it:
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=mock python main.py
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+DEFAULT_REPLY = (
+    "Here is a short answer with **Markdown** formatting.\n\n"
+    "- first point\n"
+    "- second point\n\n"
+    "```python\n"
+    "def greet(name):\n"
+    "    print(f\"Hello, {name}!\")\n"
+    "```\n\n"
+    "That covers the main idea. "
+)
+
+
+class MockSettings:
+    def __init__(self, latency: float = 0.0, chunk_delay: float = 0.0,
+                 chunk_size: int = 8, error_rate: float = 0.0,
+                 reply_chars: int = 2000, reply: Optional[str] = None,
+                 seed: Optional[int] = None):
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+        self.chunk_size = max(1, chunk_size)
+        self.error_rate = error_rate
+        self.reply_chars = reply_chars
+        self.reply = reply
+        self.random = random.Random(seed)
+        self.prefixes = set()
+        self.request_count = 0
+        self.lock = threading.Lock()
+
+    def count_request(self) -> bool:
+        """Count a request from a handler thread; returns True if it should fail (error_rate)."""
+        with self.lock:
+            self.request_count += 1
+            return bool(self.error_rate) and self.random.random() < self.error_rate
+
+    def build_reply(self) -> str:
+        if self.reply is not None:
+            return self.reply
+        repeats = self.reply_chars // len(DEFAULT_REPLY) + 1
+        return (DEFAULT_REPLY * repeats)[:self.reply_chars]
+
+    def cached_tokens(self, model: str, messages) -> int:
+        """
+        Mimic provider prompt caching: the longest run of leading messages seen in
+        an earlier request counts as cached, in 128-token blocks, from 1024 tokens on.
+        """
+        digest = hashlib.sha256(model.encode('utf-8'))
+        chars = cached_chars = 0
+        with self.lock:
+            for message in messages:
+                digest.update(json.dumps([message.get('role'), message.get('content')]).encode('utf-8'))
+                chars += len(str(message.get('content', '')))
+                key = digest.hexdigest()
+                if key in self.prefixes:
+                    cached_chars = chars
+                self.prefixes.add(key)
+        cached = cached_chars // 4
+        return cached // 128 * 128 if cached >= 1024 else 0
+
+
+def _count_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def settings(self) -> MockSettings:
+        return self.server.settings
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            self._send_json(400, {"error": {"message": "Invalid JSON body"}})
+            return
+
+        fail = self.settings.count_request()
+
+        if self.settings.latency:
+            time.sleep(self.settings.latency)
+
+        if fail:
+            self._send_json(500, {"error": {"message": "Injected mock failure", "type": "server_error"}})
+            return
+
+        prompt_chars = sum(len(str(m.get('content', ''))) for m in body.get('messages', []))
+        reply = self.settings.build_reply()
+        usage = {
+            "prompt_tokens": _count_tokens(" " * prompt_chars),
+            "completion_tokens": _count_tokens(reply),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        usage["prompt_tokens_details"] = {
+            "cached_tokens": self.settings.cached_tokens(body.get('model', 'mock'), body.get('messages', []))
+        }
+
+        if body.get('stream'):
+            include_usage = bool((body.get('stream_options') or {}).get('include_usage'))
+            self._stream_reply(body.get('model', 'mock'), reply, usage if include_usage else None)
+        else:
+            self._send_json(200, {
+                "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get('model', 'mock'),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": reply},
+                    "finish_reason": "stop"
+                }],
+                "usage": usage
+            })
+
+    def _send_json(self, status: int, payload: Dict):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream_reply(self, model: str, reply: str, usage: Optional[Dict]):
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        def event(choices, extra=None):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": choices
+            }
+            if extra:
+                chunk.update(extra)
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+
+        try:
+            event([{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}])
+            size = self.settings.chunk_size
+            for start in range(0, len(reply), size):
+                if self.settings.chunk_delay:
+                    time.sleep(self.settings.chunk_delay)
+                event([{"index": 0, "delta": {"content": reply[start:start + size]}, "finish_reason": None}])
+            event([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+            if usage:
+                event([], {"usage": usage})
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+class MockOpenAIServer:
+    """Mock API server that runs in a background thread."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, **settings):
+        self.httpd = ThreadingHTTPServer((host, port), MockOpenAIHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.settings = MockSettings(**settings)
+        self._thread = None
+
+    @property
+    def settings(self) -> MockSettings:
+        return self.httpd.settings
+
+    @property
+    def request_count(self) -> int:
+        return self.httpd.settings.request_count
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "MockOpenAIServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock OpenAI chat completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds before the first byte")
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="Seconds between streamed chunks")
+    parser.add_argument("--chunk-size", type=int, default=8, help="Characters per streamed chunk")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 500")
+    parser.add_argument("--reply-chars", type=int, default=2000, help="Length of the generated reply")
+    args = parser.parse_args()
+
+    server = MockOpenAIServer(
+        host=args.host, port=args.port, latency=args.latency,
+        chunk_delay=args.chunk_delay, chunk_size=args.chunk_size,
+        error_rate=args.error_rate, reply_chars=args.reply_chars
+    )
+    print(f"🧪 Mock OpenAI server listening on {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
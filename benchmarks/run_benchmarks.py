@@ -0,0 +1,614 @@
+"""
+Benchmark suite for the chatbot, driven by the local mock OpenAI server.
+
+Covers streaming throughput through ``ask_chatbot_stream`` and rendering,
+``ConversationDB`` operations at several history sizes (single file and
+monthly partitions), context retrieval quality and size, ``estimate_cost`` on
+long histories, the memory held by a loaded history, and CLI startup time.
+With ``--cassette`` it also replays a recorded session (see app/transport.py)
+through the same streaming and rendering path.
+Results are written as JSON so runs can be compared over time.
+
+Usage:
+    python -m benchmarks.run_benchmarks
+    python -m benchmarks.run_benchmarks --db-sizes 10k,1m,10m --output bench.json
+    python -m benchmarks.run_benchmarks --only replay --cassette sessions/demo.jsonl --replay-speed 0
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Dict, List
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.mock_openai_server import MockOpenAIServer
+
+SIZE_SUFFIXES = {"k": 1_000, "m": 1_000_000}
+MESSAGES_PER_CONVERSATION = 100
+INSERT_BATCH = 50_000
+
+
+def parse_size(value: str) -> int:
+    value = value.strip().lower()
+    if value and value[-1] in SIZE_SUFFIXES:
+        return int(float(value[:-1]) * SIZE_SUFFIXES[value[-1]])
+    return int(value)
+
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+    return {
+        "runs": len(ordered),
+        "min_s": ordered[0],
+        "median_s": statistics.median(ordered),
+        "mean_s": statistics.fmean(ordered),
+        "p95_s": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        "max_s": ordered[-1],
+    }
+
+
+def time_calls(fn: Callable, repeat: int) -> Dict[str, float]:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def bench_streaming(server: MockOpenAIServer, repeat: int) -> Dict:
+    from app.chatbot import ask_chatbot_stream
+    import main
+    from rich.console import Console
+
+    messages = [
+        {"role": "system", "content": "You are a helpful AI assistant."},
+        {"role": "user", "content": "Explain list comprehensions with an example."}
+    ]
+
+    reply_lengths = []
+
+    def stream_once():
+        with contextlib.redirect_stdout(io.StringIO()):
+            reply_lengths.append(len(ask_chatbot_stream(messages)))
+
+    stream_stats = time_calls(stream_once, repeat)
+    reply_chars = reply_lengths[-1] if reply_lengths else 0
+
+    reply = server.settings.build_reply()
+    main.console = Console(file=io.StringIO(), force_terminal=True, width=100)
+    render_stats = time_calls(lambda: main.render_ai_reply(reply), repeat)
+
+    return {
+        "reply_chars": reply_chars,
+        "chunk_size": server.settings.chunk_size,
+        "stream": stream_stats,
+        "stream_chars_per_s": reply_chars / stream_stats["median_s"] if stream_stats["median_s"] else 0,
+        "render": render_stats,
+        "render_chars_per_s": len(reply) / render_stats["median_s"] if render_stats["median_s"] else 0,
+    }
+
+
+def bench_replay(path: str, repeat: int, speed: float) -> Dict:
+    """Replay every streamed response in a cassette through ask_chatbot_stream and render_ai_reply."""
+    from app import chatbot
+    from app.transport import Cassette, CassetteClient
+    import main
+    from rich.console import Console
+
+    cassette = Cassette(path, "replay", speed)
+    streams = [interaction["request"] for interaction in cassette.interactions if "chunks" in interaction]
+    recorded_s = sum(interaction["chunks"][-1]["t"] for interaction in cassette.interactions
+                     if interaction.get("chunks"))
+    previous_client = chatbot.get_client()
+    chatbot.set_client(CassetteClient(cassette))
+    main.console = Console(file=io.StringIO(), force_terminal=True, width=100)
+    reply_chars = []
+
+    def replay_once():
+        cassette.rewind()
+        chars = 0
+        with contextlib.redirect_stdout(io.StringIO()):
+            for request in streams:
+                reply = chatbot.ask_chatbot_stream(request["messages"], request["model"])
+                main.render_ai_reply(reply)
+                chars += len(reply)
+        reply_chars.append(chars)
+
+    try:
+        stats = time_calls(replay_once, repeat)
+    finally:
+        chatbot.set_client(previous_client)
+
+    return {
+        "cassette": path,
+        "speed": speed,
+        "turns": len(streams),
+        "reply_chars": reply_chars[-1] if reply_chars else 0,
+        "recorded_s": recorded_s,
+        "replay": stats,
+    }
+
+
+def populate_db(db_path: str, total_messages: int) -> int:
+    """Bulk-load a database with synthetic history; returns the conversation count."""
+    from app.database import ConversationDB
+
+    # create the schema, then release the pooled connection so journal_mode can change
+    ConversationDB(db_path).close()
+    conversations = max(1, total_messages // MESSAGES_PER_CONVERSATION)
+    rng = random.Random(42)
+    words = ["python", "error", "function", "database", "stream", "model", "prompt", "token", "cost", "cache"]
+
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.executemany(
+            "INSERT INTO conversations (id, title, model, prompt_id) VALUES (?, ?, ?, ?)",
+            ((i, f"Chat {i}", "gpt-4o-mini", "default") for i in range(1, conversations + 1))
+        )
+
+        def rows():
+            for n in range(total_messages):
+                conv_id = n // MESSAGES_PER_CONVERSATION + 1
+                role = "user" if n % 2 == 0 else "assistant"
+                content = " ".join(rng.choice(words) for _ in range(20))
+                yield conv_id, role, content, 0, 0.0001
+
+        batch = []
+        for row in rows():
+            batch.append(row)
+            if len(batch) >= INSERT_BATCH:
+                conn.executemany(
+                    "INSERT INTO messages (conversation_id, role, content, tokens_used, cost) VALUES (?, ?, ?, ?, ?)",
+                    batch
+                )
+                batch.clear()
+        if batch:
+            conn.executemany(
+                "INSERT INTO messages (conversation_id, role, content, tokens_used, cost) VALUES (?, ?, ?, ?, ?)",
+                batch
+            )
+    return conversations
+
+
+def bench_database(sizes: List[int], repeat: int) -> Dict:
+    from app.database import ConversationDB
+
+    results = {}
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, "bench.db")
+            start = time.perf_counter()
+            conversations = populate_db(db_path, size)
+            populate_s = time.perf_counter() - start
+
+            # raw query cost: the read cache is measured separately in history_browse
+            db = ConversationDB(db_path, read_cache_size=0)
+            cached_db = ConversationDB(db_path)
+            target = max(1, conversations // 2)
+
+            def browse(database):
+                # what /history followed by /load or /export reads
+                database.list_conversations(15)
+                database.get_conversation_info(target)
+                database.get_conversation_messages(target)
+
+            results[str(size)] = {
+                "messages": size,
+                "conversations": conversations,
+                "populate_s": populate_s,
+                "add_message": time_calls(lambda: db.add_message(target, "user", "benchmark message"), repeat),
+                "get_conversation_messages": time_calls(lambda: db.get_conversation_messages(target), repeat),
+                "list_conversations": time_calls(lambda: db.list_conversations(15), repeat),
+                "search_conversations": time_calls(lambda: db.search_conversations("database", 10), repeat),
+                "get_conversation_info": time_calls(lambda: db.get_conversation_info(target), repeat),
+                "get_stats": time_calls(db.get_stats, max(1, repeat // 5)),
+                "history_browse_uncached": time_calls(lambda: browse(db), repeat),
+                "history_browse_cached": time_calls(lambda: browse(cached_db), repeat),
+                "read_cache": cached_db.read_cache_stats(),
+            }
+            db.close()
+            cached_db.close()
+    return results
+
+
+def bench_fork(sizes: List[int], repeat: int) -> Dict:
+    """Fork conversations of growing length: fork time and rows written should stay flat."""
+    from app.database import ConversationDB
+
+    results = {}
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, "fork.db")
+            db = ConversationDB(db_path)
+            parent = db.create_conversation("Long chat", "gpt-4o-mini", "default")
+            with sqlite3.connect(db_path) as conn:
+                conn.executemany(
+                    "INSERT INTO messages (conversation_id, role, content) VALUES (?, ?, ?)",
+                    ((parent, "user" if i % 2 == 0 else "assistant", f"message {i}") for i in range(size))
+                )
+
+            def count_rows() -> int:
+                with sqlite3.connect(db_path) as conn:
+                    return conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+            rows_before = count_rows()
+            branches = []
+            fork_stats = time_calls(lambda: branches.append(db.fork_conversation(parent)), repeat)
+            branch = branches[-1]
+            db.add_message(branch, "user", "alternative follow-up")
+            results[str(size)] = {
+                "messages": size,
+                "fork": fork_stats,
+                "rows_written_per_fork": (count_rows() - rows_before - 1) / repeat,
+                "get_parent_messages": time_calls(lambda: db.get_conversation_messages(parent), max(1, repeat // 4)),
+                "get_branch_messages": time_calls(lambda: db.get_conversation_messages(branch), max(1, repeat // 4)),
+                "fork_of_branch": time_calls(lambda: db.fork_conversation(branch), repeat),
+            }
+            db.close()
+    return results
+
+
+def bench_partitions(sizes: List[int], repeat: int, months: int = 6) -> Dict:
+    """Same history in one file vs monthly partitions (app/partitions.py), spread over past months."""
+    from app.database import ConversationDB
+    from app.partitions import PartitionedConversationDB
+
+    def spread_over_months(db_path: str, size: int):
+        # oldest ids in the oldest month, the newest block in the current month
+        with sqlite3.connect(db_path) as conn:
+            conn.execute(
+                "UPDATE messages SET timestamp = datetime('now', printf('-%d months', (? - id) * ? / ?))",
+                (size, months, size)
+            )
+
+    results = {}
+    for size in sizes:
+        result = {"messages": size, "months": months}
+        for layout in ("single_file", "partitioned"):
+            with tempfile.TemporaryDirectory() as tmp:
+                db_path = os.path.join(tmp, "bench.db")
+                conversations = populate_db(db_path, size)
+                spread_over_months(db_path, size)
+                if layout == "partitioned":
+                    start = time.perf_counter()
+                    db = PartitionedConversationDB(db_path, read_cache_size=0)
+                    db.partition_existing_messages()
+                    migrate_s = time.perf_counter() - start
+                else:
+                    db = ConversationDB(db_path, read_cache_size=0)
+                    migrate_s = 0.0
+
+                target = max(1, conversations // 2)
+                result[layout] = {
+                    "conversations": conversations,
+                    "migrate_s": migrate_s,
+                    "add_message": time_calls(lambda: db.add_message(target, "user", "benchmark message"), repeat),
+                    "list_conversations": time_calls(lambda: db.list_conversations(15), repeat),
+                    "get_conversation_info": time_calls(lambda: db.get_conversation_info(target), repeat),
+                    "get_daily_spend": time_calls(db.get_daily_spend, repeat),
+                    "get_conversation_messages": time_calls(lambda: db.get_conversation_messages(target), repeat),
+                    "search_conversations": time_calls(lambda: db.search_conversations("database", 10),
+                                                       max(1, repeat // 5)),
+                }
+                db.close()
+        results[str(size)] = result
+    return results
+
+
+def bench_analytics(sizes: List[int], repeat: int) -> Dict:
+    """Columnar load, summary and .npz export of the whole history (app/analytics.py)."""
+    from app.analytics import MessageColumns, np
+    from app.database import ConversationDB
+
+    results = {}
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, "bench.db")
+            populate_db(db_path, size)
+            with sqlite3.connect(db_path) as conn:
+                # one message per minute up to now, so the weekly and hourly groups are filled
+                conn.execute("UPDATE messages SET timestamp = datetime('now', '-' || (? - id) || ' minutes')", (size,))
+            db = ConversationDB(db_path, read_cache_size=0)
+            loaded = []
+            load_stats = time_calls(lambda: loaded.append(MessageColumns.load(db)), max(1, repeat // 10))
+            columns = loaded[-1]
+            results[str(size)] = {
+                "messages": len(columns),
+                "backend": "numpy" if np is not None else "python",
+                "load": load_stats,
+                "summarize": time_calls(columns.summarize, max(1, repeat // 10)),
+                "export": time_calls(lambda: columns.export(os.path.join(tmp, "messages.npz")), 1),
+                "export_bytes": os.path.getsize(os.path.join(tmp, "messages.npz")),
+            }
+            db.close()
+    return results
+
+
+def bench_retrieval(sizes: List[int], repeat: int, probes: int = 50) -> Dict:
+    """
+    Context retrieval (app/retrieval.py) over a populated history: recall of
+    planted facts, index build and query time, and tokens sent by build_context
+    for a short and a long conversation compared with the full history.
+    """
+    from app.database import ConversationDB
+    from app.retrieval import Retriever
+
+    results = {}
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, "bench.db")
+            conversations = populate_db(db_path, size)
+            db = ConversationDB(db_path, read_cache_size=0)
+            rng = random.Random(7)
+            facts = {}
+            for n in range(probes):
+                conversation_id = rng.randint(1, conversations)
+                name = f"service{n}"
+                message_id = db.add_message(conversation_id, "assistant",
+                                            f"The {name} deployment uses port {9000 + n} behind the proxy.")
+                facts[message_id] = f"Which port does {name} deploy on?"
+
+            retriever = Retriever(db)
+            build = time_calls(retriever.ensure_loaded, 1)
+            hits = 0
+            for message_id, query in facts.items():
+                hits += any(item['id'] == message_id for item in retriever.retrieve(query, top_k=5))
+            query_stats = time_calls(lambda: retriever.retrieve("database cache cost", top_k=5), repeat)
+
+            def conversation(turns: int) -> List[Dict]:
+                messages = [{"role": "system", "content": "You are a helpful AI assistant."}]
+                for i in range(turns):
+                    messages.append({"role": "user" if i % 2 == 0 else "assistant",
+                                     "content": " ".join(rng.choice(("python", "stream", "token", "model")) for _ in range(60))})
+                messages.append({"role": "user", "content": "Which port does service3 deploy on?"})
+                return messages
+
+            context = {}
+            for turns in (8, 200):
+                built = retriever.build_context(conversation(turns))
+                context[str(turns)] = {key: built[key] for key in ("retrieved", "tokens_before", "tokens_after")}
+            results[str(size)] = {
+                "recall_at_5": hits / len(facts),
+                "build_index": build,
+                "query": query_stats,
+                "context": context,
+            }
+            db.close()
+    return results
+
+
+def bench_estimate_cost(lengths: List[int], repeat: int) -> Dict:
+    from app.chatbot import estimate_cost
+    from app.messages import History
+
+    results = {}
+    for length in lengths:
+        dict_messages = [{"role": "system", "content": "You are a helpful AI assistant."}]
+        for i in range(length):
+            role = "user" if i % 2 == 0 else "assistant"
+            dict_messages.append({"role": role, "content": f"message {i} " * 20})
+        history = History(dict_messages)
+        results[str(length)] = {
+            "dict_messages": time_calls(lambda: estimate_cost(dict_messages), repeat),
+            "history": time_calls(lambda: estimate_cost(history), repeat),
+        }
+    return results
+
+
+def bench_message_memory(count: int) -> Dict:
+    """
+    Retained memory of a loaded history: legacy dict messages vs History/Message,
+    right after loading and after building a request payload from it.
+    """
+    import gc
+    import tracemalloc
+    from app.database import ConversationDB
+    from app.messages import History, to_payload
+
+    def measure(build: Callable) -> Dict[str, float]:
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        loaded = build()
+        elapsed = time.perf_counter() - start
+        gc.collect()
+        retained = tracemalloc.get_traced_memory()[0] - before
+        peak = tracemalloc.get_traced_memory()[1] - before
+        tracemalloc.stop()
+        del loaded
+        return {"retained_bytes": retained, "peak_bytes": peak, "load_s": elapsed}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = ConversationDB(os.path.join(tmp, "memory.db"))
+        conversation_id = db.create_conversation("Memory", "gpt-4o-mini", "default")
+        with sqlite3.connect(db.db_path) as conn:
+            conn.executemany(
+                "INSERT INTO messages (conversation_id, role, content) VALUES (?, ?, ?)",
+                ((conversation_id, "user" if i % 2 == 0 else "assistant", f"message {i} " * 10)
+                 for i in range(count))
+            )
+
+        def load_dicts():
+            return [
+                {'role': msg['role'], 'content': msg['content']}
+                for msg in db.get_conversation_messages(conversation_id)
+                if msg['role'] in ['system', 'user', 'assistant']
+            ]
+
+        def load_history():
+            return History.from_rows(db.get_conversation_turns(conversation_id))
+
+        def after_payload(load: Callable) -> Callable:
+            # what a history in use holds: it has been sent at least once
+            def build():
+                messages = load()
+                to_payload(messages)
+                return messages
+            return build
+
+        legacy = measure(load_dicts)
+        compact = measure(load_history)
+        legacy_sent = measure(after_payload(load_dicts))
+        compact_sent = measure(after_payload(load_history))
+        db.close()
+
+    saved = legacy_sent["retained_bytes"] - compact_sent["retained_bytes"]
+    return {
+        "messages": count,
+        "dict_messages": legacy,
+        "history": compact,
+        "dict_messages_after_payload": legacy_sent,
+        "history_after_payload": compact_sent,
+        "saved_bytes": saved,
+        "saved_bytes_per_100k": saved * 100_000 / count,
+        "saved_bytes_per_message": saved / count,
+    }
+
+
+def bench_startup(env: Dict[str, str], repeat: int) -> Dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        script = f"import os, sys; sys.path.insert(0, {REPO_ROOT!r}); os.chdir({REPO_ROOT!r}); import main"
+        child_env = dict(env, PYTHONDONTWRITEBYTECODE="1")
+
+        def start_once():
+            subprocess.run([sys.executable, "-c", script], cwd=tmp, env=child_env, check=True)
+
+        return time_calls(start_once, repeat)
+
+
+def run(args) -> Dict:
+    server = MockOpenAIServer(
+        latency=args.latency, chunk_delay=args.chunk_delay,
+        chunk_size=args.chunk_size, reply_chars=args.reply_chars, seed=0
+    ).start()
+
+    os.environ["OPENAI_API_KEY"] = "mock"
+    os.environ["OPENAI_BASE_URL"] = server.base_url
+    app_db = tempfile.TemporaryDirectory()
+    # importing the app (or main, for startup) opens its module-level database; keep it out of the repo
+    os.environ["CHATBOT_DB_PATH"] = os.path.join(app_db.name, "conversations.db")
+    os.chdir(REPO_ROOT)
+
+    try:
+        results = {}
+        if "streaming" in args.only:
+            print("⏱️  Streaming throughput...")
+            results["streaming"] = bench_streaming(server, args.repeat)
+        if "database" in args.only:
+            sizes = [parse_size(s) for s in args.db_sizes.split(",") if s]
+            print(f"⏱️  ConversationDB at {', '.join(str(s) for s in sizes)} messages...")
+            results["database"] = bench_database(sizes, args.repeat)
+        if "fork" in args.only:
+            sizes = [parse_size(s) for s in args.fork_sizes.split(",") if s]
+            print(f"⏱️  Forking conversations of {', '.join(str(s) for s in sizes)} messages...")
+            results["fork"] = bench_fork(sizes, args.repeat)
+        if "partitions" in args.only:
+            sizes = [parse_size(s) for s in args.db_sizes.split(",") if s]
+            print(f"⏱️  Single file vs monthly partitions at {', '.join(str(s) for s in sizes)} messages...")
+            results["partitions"] = bench_partitions(sizes, args.repeat)
+        if "analytics" in args.only:
+            sizes = [parse_size(s) for s in args.analytics_sizes.split(",") if s]
+            print(f"⏱️  Usage analytics over {', '.join(str(s) for s in sizes)} messages...")
+            results["analytics"] = bench_analytics(sizes, args.repeat)
+        if "retrieval" in args.only:
+            sizes = [parse_size(s) for s in args.retrieval_sizes.split(",") if s]
+            print(f"⏱️  Context retrieval over {', '.join(str(s) for s in sizes)} messages...")
+            results["retrieval"] = bench_retrieval(sizes, args.repeat)
+        if "estimate_cost" in args.only:
+            lengths = [parse_size(s) for s in args.history_lengths.split(",") if s]
+            print("⏱️  estimate_cost on long histories...")
+            results["estimate_cost"] = bench_estimate_cost(lengths, args.repeat)
+        if "memory" in args.only:
+            print("⏱️  Message memory footprint...")
+            results["memory"] = bench_message_memory(parse_size(args.memory_messages))
+        if "startup" in args.only:
+            print("⏱️  Startup time...")
+            results["startup"] = bench_startup(dict(os.environ), max(1, args.repeat // 4))
+        if "replay" in args.only and args.cassette:
+            print(f"⏱️  Replaying {args.cassette}...")
+            results["replay"] = bench_replay(args.cassette, max(1, args.repeat // 4), args.replay_speed)
+    finally:
+        server.stop()
+        app_db.cleanup()
+
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {
+            "repeat": args.repeat,
+            "latency": args.latency,
+            "chunk_delay": args.chunk_delay,
+            "chunk_size": args.chunk_size,
+            "reply_chars": args.reply_chars,
+        },
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the chatbot benchmark suite")
+    parser.add_argument("--only", default="streaming,database,partitions,fork,analytics,retrieval,estimate_cost,memory,startup",
+                        help="Comma-separated benchmark groups to run")
+    parser.add_argument("--db-sizes", default="10k", help="Message counts for ConversationDB, e.g. 10k,1m,10m")
+    parser.add_argument("--fork-sizes", default="1k,10k,100k", help="Conversation lengths for the fork benchmark")
+    parser.add_argument("--analytics-sizes", default="100k", help="History sizes for the analytics benchmark")
+    parser.add_argument("--retrieval-sizes", default="100k", help="History sizes for the retrieval benchmark")
+    parser.add_argument("--history-lengths", default="1k,10k,100k", help="History lengths for estimate_cost")
+    parser.add_argument("--memory-messages", default="100k", help="History size for the memory benchmark")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--chunk-delay", type=float, default=0.0)
+    parser.add_argument("--chunk-size", type=int, default=8)
+    parser.add_argument("--reply-chars", type=int, default=4000)
+    parser.add_argument("--cassette", help="Recorded session to replay (adds the replay group)")
+    parser.add_argument("--replay-speed", type=float, default=0.0,
+                        help="Replay speed for --cassette; 0 replays without the recorded delays")
+    parser.add_argument("--output", help="Path of the JSON results file")
+    args = parser.parse_args()
+    args.only = set(args.only.split(","))
+    if args.cassette:
+        args.only.add("replay")
+
+    report = run(args)
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"bench-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -16,13 +16,35 @@ from app.chatbot import (
     search_conversation_history,
     delete_conversation_history,
     get_conversation_stats,
+    get_read_cache_stats,
+    get_usage_analytics,
     export_conversation,
-    cleanup_duplicate_system_messages
+    cleanup_duplicate_system_messages,
+    prepare_chat_messages,
+    admit_request,
+    record_reply,
+    BudgetExceededError,
+    fork_conversation,
+    list_conversation_branches,
+    get_conversation_info,
+    get_budget_status,
+    set_retrieval,
+    get_retrieval_settings
 )
 from rich.console import Console
 from rich.markdown import Markdown
 from rich.syntax import Syntax
+from app.file_analysis import ingest_upload, review_file
+from app.ingest import IngestError
+from app.batch_upload import upload_many, is_glob_pattern
+from app.analytics import WEEKDAYS, default_export_path
+from app.messages import History
+from app.profiling import Profiler, get_profiler
+from typing import Optional
+import argparse
 import os
+import sys
+import time
 
 console = Console()
 
@@ -169,7 +191,8 @@ def show_conversation_history():
         created = conv['created_at'][:16]
         cost = f"${conv['total_cost']:.6f}" if conv['total_cost'] else "$0.000000"
         
-        print(f"🆔 {conv['id']:3} | 📝 {title:35} | 📅 {created} | 💬 {conv['message_count']:3} msgs | 💰 {cost}")
+        branch = f" | 🌿 branch of {conv['parent_id']}" if conv.get('parent_id') else ""
+        print(f"🆔 {conv['id']:3} | 📝 {title:35} | 📅 {created} | 💬 {conv['message_count']:3} msgs | 💰 {cost}{branch}")
     print()
 
 def load_conversation_by_id():
@@ -191,6 +214,56 @@ def load_conversation_by_id():
         print("❌ Invalid conversation ID")
         return None
 
+def fork_current_conversation(command: str, messages: History, conversation_id: int):
+    """/fork [N]: continue in a branch that shares this conversation's history (or its first N messages)"""
+    args = command.split()[1:]
+    after_messages = None
+    if args:
+        try:
+            after_messages = int(args[0])
+        except ValueError:
+            print("❌ Usage: /fork [number of user/assistant messages to keep]")
+            return None
+    
+    branch_id = fork_conversation(conversation_id, after_messages)
+    if branch_id is None:
+        print(f"❌ Could not fork conversation {conversation_id}")
+        return None
+    branch_messages = History(messages) if after_messages is None else load_conversation(branch_id)
+    kept = "all messages" if after_messages is None else f"the first {after_messages} messages"
+    print(f"🌿 Forked conversation {conversation_id} into {branch_id} (keeping {kept}); the original is unchanged")
+    return branch_messages, branch_id
+
+def switch_branch(conversation_id: int):
+    """/branch: list the branches of this conversation (and its parent) and switch to one"""
+    info = get_conversation_info(conversation_id)
+    branches = list_conversation_branches(conversation_id)
+    
+    if not branches and not (info and info.get('parent_id')):
+        print("🌿 This conversation has no branches. Use /fork to create one.")
+        return None
+    
+    print("\n🌿 Branches:")
+    print("-" * 60)
+    if info and info.get('parent_id'):
+        print(f"⬆️  {info['parent_id']:3} | parent conversation")
+    for branch in branches:
+        print(f"🌿 {branch['id']:3} | {branch['title'][:45]} | 📅 {branch['created_at'][:16]}")
+    print()
+    
+    try:
+        target = int(input("Enter conversation ID to switch to (or 0 to cancel): "))
+    except ValueError:
+        print("❌ Invalid conversation ID")
+        return None
+    if target == 0:
+        return None
+    branch_messages = load_conversation(target)
+    if not branch_messages:
+        print(f"❌ Conversation {target} not found")
+        return None
+    return branch_messages, target
+
 def search_conversations():
     query = input("Enter search query: ").strip()
     if not query:
@@ -224,6 +297,8 @@ def delete_conversation():
         if confirm == 'y' or confirm == 'yes':
             if delete_conversation_history(conv_id):
                 print(f"✅ Conversation {conv_id} deleted")
+            elif list_conversation_branches(conv_id):
+                print(f"❌ Conversation {conv_id} has branches that share its messages; delete them first")
             else:
                 print(f"❌ Failed to delete conversation {conv_id}")
         else:
@@ -239,8 +314,76 @@ def show_usage_stats():
     print(f"📚 Total Conversations: {stats['total_conversations']}")
     print(f"💬 Total Messages: {stats['total_messages']}")
     print(f"💰 Total Cost: ${stats['total_cost']:.6f}")
+    print(f"🔢 Tokens: {stats['prompt_tokens'] or 0} prompt, {stats['completion_tokens'] or 0} completion")
+    if stats['prompt_tokens']:
+        ratio = (stats['cached_tokens'] or 0) / stats['prompt_tokens']
+        print(f"💾 Prompt Cache: {ratio:.1%} of prompt tokens cached ({stats['cached_tokens'] or 0})")
     print(f"🤖 Models Used: {stats['models_used']}")
     print(f"🎭 Prompts Used: {stats['prompts_used']}")
+    if 'partitions' in stats:
+        print(f"🗂️ Message Partitions: {stats['partitions']}")
+    cache = get_read_cache_stats()
+    print(f"🗄️ Read Cache: {cache['hit_rate']:.1%} hits ({cache['hits']} of {cache['hits'] + cache['misses']} reads), "
+          f"{cache['entries']}/{cache['maxsize']} entries")
+    print()
+
+def show_analytics(command: str):
+    """/analytics [weeks] [export [path]]: usage report over all messages, optionally exported as .npz"""
+    args = command.split()[1:]
+    weeks = 8
+    export_path = None
+    if args and args[0].isdigit():
+        weeks = int(args.pop(0))
+    if args and args[0].lower() == "export":
+        export_path = args[1] if len(args) > 1 else default_export_path()
+    elif args:
+        print("❌ Usage: /analytics [weeks] [export [path.npz]]")
+        return
+    
+    start = time.perf_counter()
+    report = get_usage_analytics(weeks, export_path)
+    elapsed = time.perf_counter() - start
+    
+    print(f"\n📈 Usage Analytics ({report['messages']} messages in {report['conversations']} conversations, "
+          f"{elapsed:.2f}s, {report['backend']}):")
+    print("-" * 60)
+    print(f"💰 Total Cost: ${report['cost']:.6f}")
+    print(f"🔢 Tokens: {report['prompt_tokens']} prompt ({report['cached_tokens']} cached), "
+          f"{report['completion_tokens']} completion")
+    
+    print(f"\n📅 Cost per model, last {weeks} weeks:")
+    for row in report['weekly']:
+        print(f"  {row['week']} | {row['model'][:20]:20} | 💬 {row['replies']:6} replies | ${row['cost']:.6f}")
+    if not report['weekly']:
+        print("  No messages yet")
+    
+    print("\n📏 Message length (characters):")
+    for role, row in report['lengths'].items():
+        print(f"  {role:9} | p50 {row['p50']:8.0f} | p90 {row['p90']:8.0f} | p99 {row['p99']:8.0f} | max {row['max']}")
+    
+    busiest = sorted(range(24), key=lambda hour: report['hours'][hour], reverse=True)[:3]
+    print(f"\n🕐 Busiest hours (UTC): {', '.join(f'{hour:02}:00' for hour in busiest)}")
+    print("📆 Messages per weekday: " + ", ".join(
+        f"{day} {count}" for day, count in zip(WEEKDAYS, report['weekdays'])))
+    if export_path:
+        print(f"💾 Exported message columns to {report['export_path']}")
+    print()
+
+def show_budget():
+    status = get_budget_status()
+    limits = status['limits']
+    
+    print("\n💸 Budget:")
+    print("-" * 40)
+    print(f"Session spent: ${status['session_spent']:.6f}")
+    print(f"Spent today:   ${status['daily_spent']:.6f}")
+    if not status['remaining']:
+        print("No limits set (configure \"budget\" in config.json)")
+    for name, left in status['remaining'].items():
+        print(f"{name.capitalize()} budget left: ${max(left, 0):.6f}")
+    policy = limits.get('policy') or []
+    steps = [step for step in ([policy] if isinstance(policy, str) else policy) if step != "reject"]
+    print(f"When over budget: {', then '.join(steps + ['reject'])}")
     print()
 
 def export_conversation_menu():
@@ -268,6 +411,16 @@ def export_conversation_menu():
     except ValueError:
         print("❌ Invalid conversation ID")
 
+def toggle_retrieval():
+    settings = get_retrieval_settings()
+    enabled = not settings['enabled']
+    set_retrieval(enabled)
+    if enabled:
+        print(f"✅ Retrieval enabled: sending the last {settings['recent_messages']} messages plus up to "
+              f"{settings['top_k']} relevant past snippets (~{settings['token_budget']} tokens)")
+    else:
+        print("✅ Retrieval disabled: sending the full conversation")
+
 def display_help():
     print("\n🔧 Available Commands:")
     print("  /models    - View available models")
@@ -277,19 +430,25 @@ def display_help():
     print("  /persona   - Change current prompt/persona")
     print("  /prompt    - Show current prompt")
     print("  /create    - Create custom prompt")
-    print("  /upload    - Upload a TXT or Python file for analysis/review")
+    print("  /upload    - Upload a TXT/Python file, directory or glob for analysis/review")
     print("  /history   - View recent conversations")
     print("  /load      - Load a previous conversation")
+    print("  /fork [N]  - Continue in a branch of this conversation (optionally after its first N messages)")
+    print("  /branch    - List this conversation's branches and switch to one")
     print("  /search    - Search conversation history")
     print("  /delete    - Delete a conversation")
     print("  /export    - Export a conversation")
     print("  /stats     - Show usage statistics")
     print("  /cost      - Show estimated cost for next message")
+    print("  /budget    - Show spending against the configured budget limits")
+    print("  /analytics [weeks] [export [path]] - Usage report over all messages (optionally exported as .npz)")
+    print("  /retrieval - Toggle sending recent turns + relevant past snippets instead of full history")
     print("  /help      - Show this help")
     print("  exit       - Exit the program")
     print()
 
-def handle_command(command: str, messages: list) -> bool:
+def handle_command(command: str, messages: History, conversation_id: Optional[int] = None) -> bool:
+    original = command.strip()
     command = command.lower().strip()
     
     if command == "/models":
@@ -322,6 +481,16 @@ def handle_command(command: str, messages: list) -> bool:
             new_messages, conv_id = result
             return ('load_conversation', new_messages, conv_id)
         return True
+    elif command.split()[0] == "/fork" and conversation_id is not None:
+        result = fork_current_conversation(command, messages, conversation_id)
+        if result:
+            return ('load_conversation', *result)
+        return True
+    elif command == "/branch" and conversation_id is not None:
+        result = switch_branch(conversation_id)
+        if result:
+            return ('load_conversation', *result)
+        return True
     elif command == "/search":
         search_conversations()
         return True
@@ -346,6 +515,15 @@ def handle_command(command: str, messages: list) -> bool:
         print(f"\n💰 Estimated cost for next message: ${cost['total']:.6f}")
         print(f"   Input: ${cost['input']:.6f}, Output: ${cost['output']:.6f}")
         return True
+    elif command == "/budget":
+        show_budget()
+        return True
+    elif command.split()[0] == "/analytics":
+        show_analytics(original)
+        return True
+    elif command == "/retrieval":
+        toggle_retrieval()
+        return True
     elif command == "/help":
         display_help()
         return True
@@ -390,7 +568,19 @@ def render_ai_reply(reply: str):
 
 def upload_and_analyze_file():
     """Handle file upload and send content to AI for analysis/review"""
-    filename = input("Enter the path to the file to upload (TXT or .py): ").strip()
+    filename = input("Enter the path to a file (TXT or .py), a directory or a glob pattern: ").strip()
+    if filename and (os.path.isdir(filename) or is_glob_pattern(filename)):
+        try:
+            print("\nAI analysis:")
+            result = upload_many(filename)
+            if result:
+                render_ai_reply(result['report'])
+                print(f"💾 Report saved as conversation {result['conversation_id']} (use /load to continue it)")
+        except BudgetExceededError as e:
+            print(f"❌ {e}")
+        except Exception as e:
+            print(f"❌ Error reading or analyzing files: {e}")
+        return
     if not filename or not os.path.isfile(filename):
         print(f"❌ File '{filename}' not found.")
         return
@@ -399,27 +589,58 @@ def upload_and_analyze_file():
         print("❌ Only TXT and Python (.py) files are supported in this demo.")
         return
     try:
-        with open(filename, "r", encoding="utf-8") as f:
-            content = f.read()
-        if ext == ".py":
-            prompt = f"Here is my Python code:\n\n{content}\n\nCan you review it and suggest improvements?"
-        else:
-            prompt = f"Here is a document:\n\n{content}\n\nSummarize the main points."
-        messages = [
-            {"role": "system", "content": load_system_prompt()},
-            {"role": "user", "content": prompt}
-        ]
+        upload = ingest_upload(filename)
+        if upload['encoding'] not in ("utf-8", "utf-8-sig"):
+            print(f"🔤 Decoded as {upload['encoding']}")
+        if upload['omitted_lines'] or upload['omitted_chars']:
+            print(f"🧹 Compressed {upload['omitted_lines']:,} repeated lines and {upload['omitted_chars']:,} "
+                  f"characters of generated data (~{upload['tokens']:,} tokens left to send)")
+        if upload['generated']:
+            print("ℹ️  The file is marked as generated code")
         print("\nAI analysis:")
-        from app.chatbot import ask_chatbot_stream
-        reply = ask_chatbot_stream(messages)
+        reply = review_file(filename, upload['text'])
         render_ai_reply(reply)
+    except (IngestError, BudgetExceededError) as e:
+        print(f"❌ {e}")
     except Exception as e:
         print(f"❌ Error reading or analyzing file: {e}")
 
-def chat():
-    messages = [
-        {"role": "system", "content": load_system_prompt()}
-    ]
+def process_user_message(user_input: str, messages: History, conversation_id: int):
+    messages.add("user", user_input)
+    context = prepare_chat_messages(messages)
+    if context['messages'] is not messages:
+        print(f"🔎 Context: {context['retrieved']} retrieved snippets, "
+              f"~{context['tokens_after']} tokens instead of ~{context['tokens_before']}")
+    try:
+        admission = admit_request(context['messages'])
+    except BudgetExceededError as e:
+        messages.pop()
+        print(f"❌ {e}")
+        return
+    if admission['action'] == "downgrade":
+        print(f"💸 Over the {admission['reason']}: using {admission['model']} for this message")
+    elif admission['action'] == "trim":
+        print(f"✂️ Over the {admission['reason']}: sending only the last "
+              f"{len(admission['messages'])} messages")
+    cost = admission['cost']
+    calibrated = " (calibrated)" if cost.get('calibrated') else ""
+    print(f"💰 Estimated cost: ${cost['total']:.6f}{calibrated}")
+    
+    save_message_to_db(conversation_id, "user", user_input)
+    print("\nAI: ", end="", flush=True)
+    from app.chatbot import ask_chatbot_stream
+    reply = ask_chatbot_stream(admission['messages'], admission['model'], admission)
+    usage = record_reply(conversation_id, reply, admission)
+    messages.add("assistant", reply)
+    render_ai_reply(reply)
+    if not usage['estimated']:
+        cached = f" ({usage['cached_tokens']} cached)" if usage['cached_tokens'] else ""
+        print(f"🧾 {usage['prompt_tokens']} prompt{cached} + {usage['completion_tokens']} completion tokens: "
+              f"${usage['cost']:.6f}")
+
+def chat(profiler: Optional[Profiler] = None):
+    messages = History()
+    messages.add("system", load_system_prompt())
 
     conversation_id = create_conversation()
     print(f"🆔 Started new conversation (ID: {conversation_id})")
@@ -439,7 +660,10 @@ def chat():
             break
         
         if user_input.startswith('/'):
-            result = handle_command(user_input, messages)
+            if profiler:
+                result = profiler.run(user_input.split()[0], handle_command, user_input, messages, conversation_id)
+            else:
+                result = handle_command(user_input, messages, conversation_id)
             if isinstance(result, tuple) and result[0] == 'load_conversation':
                 _, loaded_messages, loaded_conv_id = result
                 messages = loaded_messages
@@ -448,11 +672,14 @@ def chat():
                 continue
             elif result:
                 if user_input.lower() in ['/persona', '/create']:
-                    new_system_content = load_system_prompt()
-                    if messages[0]["content"] != new_system_content:
-                        messages[0] = {"role": "system", "content": new_system_content}
-                        save_message_to_db(conversation_id, "system", new_system_content)
-                        print("🔄 System prompt updated")
+                    change = messages.set_system_prompt(load_system_prompt())
+                    if change:
+                        save_message_to_db(conversation_id, "system", messages[-1]["content"]
+                                           if change == "appended" else messages[0]["content"])
+                        if change == "appended":
+                            print("🔄 System prompt updated (appended, so the earlier turns stay cached)")
+                        else:
+                            print("🔄 System prompt updated")
                 continue
             else:
                 print("❌ Unknown command. Type '/help' for available commands.")
@@ -461,17 +688,24 @@ def chat():
         if not user_input:
             continue
         
-        cost = estimate_cost(messages + [{"role": "user", "content": user_input}])
-        print(f"💰 Estimated cost: ${cost['total']:.6f}")
-        
-        save_message_to_db(conversation_id, "user", user_input)
-        messages.append({"role": "user", "content": user_input})
-        print("\nAI: ", end="", flush=True)
-        from app.chatbot import ask_chatbot_stream
-        reply = ask_chatbot_stream(messages)
-        save_message_to_db(conversation_id, "assistant", reply, cost=cost['total'])
-        messages.append({"role": "assistant", "content": reply})
-        render_ai_reply(reply)
+        if profiler:
+            profiler.run("message", process_user_message, user_input, messages, conversation_id)
+        else:
+            process_user_message(user_input, messages, conversation_id)
 
 if __name__ == "__main__":
-    chat()
+    parser = argparse.ArgumentParser(description="AI Chatbot")
+    parser.add_argument("--serve", action="store_true", help="Run the multi-session HTTP server instead of the CLI")
+    parser.add_argument("--host", default="127.0.0.1", help="Host for --serve")
+    parser.add_argument("--port", type=int, default=8000, help="Port for --serve")
+    args, _ = parser.parse_known_args()
+    if args.serve:
+        from app.server import serve
+        serve(args.host, args.port)
+        sys.exit(0)
+
+    profiler = get_profiler(sys.argv[1:])
+    if profiler:
+        profiler.run_session(chat, profiler)
+    else:
+        chat()